@@ -0,0 +1,101 @@
+'''
+Benchmark databases
+
+Either point the benchmarks at an existing (disposable!) PostgreSQL database, or let them start
+a throwaway PostgreSQL cluster from the local `initdb`/`pg_ctl` binaries - no containers needed.
+'''
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+from sqlalchemy import exc
+from sqlalchemy.dialects.postgresql import ENUM
+
+from status_page.models import Base
+
+
+def find_postgres_binary(name):
+    path = shutil.which(name)
+    if path:
+        return path
+
+    # Debian/Ubuntu keep the server binaries out of the PATH
+    candidates = sorted(glob.glob(f'/usr/lib/postgresql/*/bin/{name}'), reverse=True)
+    if candidates:
+        return candidates[0]
+
+    raise RuntimeError(f"Could not find the PostgreSQL '{name}' binary. Install the PostgreSQL "
+                       "server, or pass --db-url to use an existing database.")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class EphemeralPostgres(object):
+    """
+    A PostgreSQL cluster in a temporary directory, removed again on exit
+
+    Use it as a context manager, the `url` attribute is the database URL.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.url = None
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='status-page-bench-')
+        data_directory = os.path.join(self.directory, 'data')
+        port = free_port()
+
+        subprocess.run([find_postgres_binary('initdb'), '-D', data_directory, '-U', 'postgres',
+                        '--auth=trust', '-E', 'UTF8'],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        # Unix socket only, in the temporary directory
+        options = f"-p {port} -k {self.directory} -c listen_addresses='' -c fsync=off"
+        subprocess.run([find_postgres_binary('pg_ctl'), '-D', data_directory, '-o', options,
+                        '-l', os.path.join(self.directory, 'postgres.log'), '-w', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        self.url = f"postgresql://postgres@/postgres?host={self.directory}&port={port}"
+        return self
+
+    def __exit__(self, *exc_info):
+        subprocess.run([find_postgres_binary('pg_ctl'), '-D', os.path.join(self.directory, 'data'),
+                        '-m', 'fast', '-w', 'stop'],
+                       stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def create_schema(engine):
+    """
+    Create everything the models need, including what `create_all()` does not
+    """
+    try:
+        with engine.begin() as conn:
+            conn.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"')
+    except exc.DBAPIError:
+        # Minimal PostgreSQL builds ship without contrib - gen_random_uuid() is built into 13+
+        with engine.begin() as conn:
+            conn.execute('CREATE OR REPLACE FUNCTION uuid_generate_v4() RETURNS uuid '
+                         'AS \'SELECT gen_random_uuid()\' LANGUAGE SQL')
+
+    with engine.begin() as conn:
+
+        # The models declare their enum types with create_type=False
+        for table in Base.metadata.sorted_tables:
+            for column in table.columns:
+                if isinstance(column.type, ENUM):
+                    column.type.create(conn, checkfirst=True)
+
+    Base.metadata.create_all(engine)
+
+
+def drop_schema(engine):
+    Base.metadata.drop_all(engine)
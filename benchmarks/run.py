@@ -0,0 +1,514 @@
+'''
+Benchmark every route of the application against a seeded database
+
+    python -m benchmarks.run --ephemeral --services 200 --events-per-service 500
+    python -m benchmarks.run --db-url postgresql://localhost/status_page_bench --concurrency 16
+
+Each scenario is run in-process through Falcon's test client (latency and SQL statements per
+request) and, with --concurrency, through a real HTTP server under concurrent load (latency and
+throughput). Results can be saved as a baseline and later runs compared against it:
+
+    python -m benchmarks.run --ephemeral --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --ephemeral --baseline benchmarks/baseline.json --fail-on-regression
+
+WARNING: the database given with --db-url is dropped and recreated.
+'''
+import argparse
+import http.client
+import json
+import os
+import socketserver
+import statistics
+import sys
+import threading
+import time
+from datetime import (datetime, timedelta)
+from urllib.parse import urlencode
+from wsgiref.simple_server import (WSGIRequestHandler, WSGIServer, make_server)
+
+import jwt
+import pytz
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+SITE_ADMIN = 'bench-admin'
+
+
+def generate_key_pair():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode('utf-8')
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode('utf-8')
+
+    return private_pem, public_pem
+
+
+def configure_environment(db_url):
+    """
+    Set up the environment the application reads its configuration from
+
+    Returns a landing page JWT for a site admin.
+    """
+    landing_private, landing_public = generate_key_pair()
+    status_private, status_public = generate_key_pair()
+
+    os.environ.update({
+        'DB_URL': db_url,
+        'STATUS_PAGE_SITE_ADMINS': SITE_ADMIN,
+        'LANDING_PAGE_JWT_PUBLIC_KEY': landing_public,
+        'STATUS_PAGE_JWT_PRIVATE_KEY': status_private,
+        'STATUS_PAGE_JWT_PUBLIC_KEY': status_public,
+        'STATUS_PAGE_AUDIT_LOG': os.devnull,
+    })
+
+    token = jwt.encode({
+        'user_dict': {'username': f'{SITE_ADMIN}@corpmz.com'},
+        'exp': datetime.now(tz=pytz.UTC) + timedelta(days=1),
+    }, landing_private, algorithm='RS512')
+
+    return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def check_response(scenario, status, body):
+    """
+    Refuse to time a scenario that does not succeed, its latency would be meaningless
+    """
+    if not 200 <= status < 300:
+        raise BenchmarkError(f"{scenario.name}: {scenario.method} {scenario.url} returned "
+                             f"{status}: {body[:300]!r}")
+
+
+class Scenario(object):
+    def __init__(self, name, path, method='GET', params=None, body=None, authenticated=False,
+                 headers=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.params = params or {}
+        self.body = body
+        self.authenticated = authenticated
+        self.headers = headers or {}
+
+    @property
+    def url(self):
+        return f"{self.path}?{urlencode(self.params)}" if self.params else self.path
+
+    @property
+    def is_read(self):
+        return self.method in ('GET', 'HEAD', 'OPTIONS')
+
+
+def build_scenarios(dataset, include_writes=True):
+    slug = dataset.service_slugs[len(dataset.service_slugs) // 2]
+    username = dataset.usernames[0]
+    at = dataset.midpoint.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    scenarios = [
+        Scenario('root', '/'),
+        Scenario('status', '/status'),
+        Scenario('status-gzip', '/status', headers={'Accept-Encoding': 'gzip'}),
+        Scenario('status-at', '/status', params={'at': at}),
+        Scenario('status-batch', '/status/batch',
+                 params={'services': ','.join(dataset.service_slugs[:20])}),
+        Scenario('status-batch-group', '/status/batch', params={'groups': dataset.group_slugs[0]}),
+        Scenario('status-preferences', '/status', params={'preferences': 'true'},
+                 authenticated=True),
+        Scenario('services', '/services'),
+        Scenario('services-last-page', '/services',
+                 params={'page': max(len(dataset.service_slugs) // 20, 1)}),
+        Scenario('services-search', '/services', params={'q': '0001'}),
+        Scenario('services-status', '/services',
+                 params={'fields': 'url,name,status,last_event_at,open_incident'}),
+        Scenario('service', f'/services/{slug}'),
+        Scenario('service-status', f'/services/{slug}/status'),
+        Scenario('service-status-at', f'/services/{slug}/status', params={'at': at}),
+        Scenario('service-subscription', f'/services/{slug}/subscription', authenticated=True),
+        Scenario('events', f'/services/{slug}/events'),
+        Scenario('events-filtered', f'/services/{slug}/events',
+                 params={'status': 'down', 'order_by': '-when', 'extra.check': '3'}),
+        Scenario('events-count-exact', f'/services/{slug}/events', params={'count': 'exact'}),
+        Scenario('events-count-cached', f'/services/{slug}/events', params={'count': 'cached'}),
+        Scenario('events-count-none', f'/services/{slug}/events', params={'count': 'none'}),
+        Scenario('events-export', f'/services/{slug}/events/export'),
+        Scenario('events-export-csv', f'/services/{slug}/events/export', params={'format': 'csv'}),
+        Scenario('event', f'/services/{slug}/events/{dataset.event_ids[slug]}'),
+        Scenario('incidents', '/incidents'),
+        Scenario('incidents-open', '/incidents', params={'open': 'true'}),
+        Scenario('service-incidents', f'/services/{slug}/incidents'),
+        Scenario('incident', f'/services/{slug}/incidents/{dataset.incident_ids.get(slug)}'),
+        Scenario('permissions', f'/services/{slug}/permissions', authenticated=True),
+        Scenario('permission', f'/services/{slug}/permissions/{dataset.permission_ids[slug]}',
+                 authenticated=True),
+        Scenario('user-permissions', f'/users/{username}/permissions', authenticated=True),
+        Scenario('user-preferences', f'/users/{SITE_ADMIN}/preferences', authenticated=True),
+        Scenario('webhooks', '/webhooks', authenticated=True),
+        Scenario('webhook', f'/webhooks/{dataset.webhook_id}', authenticated=True),
+        Scenario('webhook-deliveries', f'/webhooks/{dataset.webhook_id}/deliveries',
+                 authenticated=True),
+        Scenario('webhook-deliveries-dead', f'/webhooks/{dataset.webhook_id}/deliveries',
+                 params={'state': 'dead'}, authenticated=True),
+        Scenario('metrics', '/metrics'),
+    ]
+
+    if include_writes:
+        scenarios.append(Scenario(
+            'api-key-post', '/api-keys', method='POST', authenticated=True,
+            body={'permission': str(dataset.admin_permission_id), 'bot': True}))
+        scenarios.append(Scenario(
+            'event-post', f'/services/{slug}/events', method='POST', authenticated=True,
+            body={'status': 'up', 'description': 'Benchmark event', 'informational': True,
+                  'extra': {'from': 'benchmark'}}))
+        scenarios.append(Scenario(
+            'webhook-redeliver', f'/webhooks/{dataset.webhook_id}/redeliver', method='POST',
+            authenticated=True))
+
+    return scenarios
+
+
+def registered_templates(app):
+    """
+    Every URI template routed by a Falcon application
+    """
+    templates = []
+
+    def walk(nodes):
+        for node in nodes:
+            if node.resource is not None:
+                templates.append(node.uri_template)
+            walk(node.children)
+
+    walk(app._router._roots)
+    return templates
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, queries=None, cpu_times=None):
+    return {
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'queries_per_request': queries,
+        # CPU time of the application itself, without the time the database spent on the queries
+        'cpu_p50_ms': percentile(cpu_times, 0.50) * 1000 if cpu_times else None,
+    }
+
+
+def _db_query_totals():
+    from status_page.middleware import request_db_queries
+
+    snapshot = request_db_queries.snapshot()
+    total = sum(value[-1] for labels, value in snapshot['samples'])
+    count = sum(sum(value[:-1]) for labels, value in snapshot['samples'])
+    return total, count
+
+
+def run_in_process(app, scenarios, token, requests, warmup):
+    import falcon.testing
+
+    client = falcon.testing.TestClient(app)
+    results = {}
+
+    for scenario in scenarios:
+        headers = {'Content-Type': 'application/json', **scenario.headers}
+        if scenario.authenticated:
+            headers['Authorization'] = f'JWT {token}'
+
+        def request():
+            return client.simulate_request(
+                scenario.method, scenario.path, params=scenario.params, headers=headers,
+                body=json.dumps(scenario.body) if scenario.body is not None else None)
+
+        for _ in range(warmup):
+            response = request()
+            check_response(scenario, response.status_code, response.content)
+
+        latencies = []
+        cpu_times = []
+        queries_before, count_before = _db_query_totals()
+        started = time.perf_counter()
+
+        for _ in range(requests):
+            request_started = time.perf_counter()
+            cpu_started = time.thread_time()
+            response = request()
+            cpu_times.append(time.thread_time() - cpu_started)
+            latencies.append(time.perf_counter() - request_started)
+            check_response(scenario, response.status_code, response.content)
+
+        elapsed = time.perf_counter() - started
+        queries_after, count_after = _db_query_totals()
+
+        queries = ((queries_after - queries_before) / (count_after - count_before)
+                   if count_after > count_before else None)
+
+        results[scenario.name] = summarize(latencies, elapsed, queries, cpu_times)
+
+    return results
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def run_concurrent(app, scenarios, token, concurrency, duration, url=None):
+    """
+    Hammer the read scenarios with `concurrency` clients for `duration` seconds each
+    """
+    server = None
+    if url is None:
+        server = make_server('127.0.0.1', 0, app, server_class=ThreadingWSGIServer,
+                             handler_class=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+    else:
+        host, port = url.split('://', 1)[-1].rstrip('/').split(':')
+        port = int(port)
+
+    results = {}
+
+    try:
+        for scenario in scenarios:
+            if not scenario.is_read:
+                continue
+
+            headers = dict(scenario.headers)
+            if scenario.authenticated:
+                headers['Authorization'] = f'JWT {token}'
+            latencies = []
+            errors = []
+            lock = threading.Lock()
+            deadline = time.perf_counter() + duration
+
+            def client():
+                own = []
+                try:
+                    while time.perf_counter() < deadline:
+                        connection = http.client.HTTPConnection(host, port, timeout=30)
+                        started = time.perf_counter()
+                        connection.request(scenario.method, scenario.url, headers=headers)
+                        response = connection.getresponse()
+                        body = response.read()
+                        own.append(time.perf_counter() - started)
+                        connection.close()
+                        check_response(scenario, response.status, body)
+                except BenchmarkError as e:
+                    errors.append(e)
+                with lock:
+                    latencies.extend(own)
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=client) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            if errors:
+                raise errors[0]
+
+            results[scenario.name] = summarize(latencies, time.perf_counter() - started)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print each scenario next to its baseline and return the names of regressed scenarios
+    """
+    regressions = []
+
+    print(f"\n{'scenario':<32} {'p50 ms':>9} {'base':>9} {'p99 ms':>9} {'base':>9} "
+          f"{'rps':>9} {'base':>9} {'cpu ms':>9} {'base':>9} {'queries':>8}")
+
+    for mode in ('in_process', 'concurrent'):
+        for name, result in results.get(mode, {}).items():
+            base = baseline.get(mode, {}).get(name, {})
+            label = f"{mode}:{name}"
+
+            def fmt(value):
+                return f"{value:9.2f}" if isinstance(value, (int, float)) else f"{'-':>9}"
+
+            queries = result.get('queries_per_request')
+            print(f"{label:<32} {fmt(result['p50_ms'])} {fmt(base.get('p50_ms'))} "
+                  f"{fmt(result['p99_ms'])} {fmt(base.get('p99_ms'))} "
+                  f"{fmt(result['throughput_rps'])} {fmt(base.get('throughput_rps'))} "
+                  f"{fmt(result.get('cpu_p50_ms'))} {fmt(base.get('cpu_p50_ms'))} "
+                  f"{queries if queries is not None else '-':>8}")
+
+            if base and result['p50_ms'] > base['p50_ms'] * (1 + threshold):
+                regressions.append(label)
+
+            base_queries = base.get('queries_per_request')
+            if base_queries is not None and queries is not None and queries > base_queries:
+                regressions.append(f"{label} (queries)")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    database = parser.add_mutually_exclusive_group(required=True)
+    database.add_argument('--db-url', help="A disposable database, it is dropped and recreated")
+    database.add_argument('--ephemeral', action='store_true',
+                          help="Start a throwaway PostgreSQL cluster with initdb/pg_ctl")
+
+    parser.add_argument('--services', type=int, default=100)
+    parser.add_argument('--events-per-service', type=int, default=200)
+    parser.add_argument('--permissions-per-service', type=int, default=5)
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+    parser.add_argument('--warmup', type=int, default=10, help="Untimed requests per scenario")
+    parser.add_argument('--only', action='append', help="Only run these scenarios")
+    parser.add_argument('--no-writes', action='store_true', help="Skip scenarios that write")
+
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help="Also run the read scenarios over HTTP with this many clients")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="Seconds of concurrent load per scenario")
+    parser.add_argument('--url', help="Load test an already running server instead, eg: "
+                                      "http://127.0.0.1:8000 (it must use the same database)")
+
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="Compare against this JSON file")
+    parser.add_argument('--save-baseline', help="Write the results to this JSON file as the new "
+                                                "baseline")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative p50 slowdown counted as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.ephemeral:
+            from .database import EphemeralPostgres
+            with EphemeralPostgres() as postgres:
+                return benchmark(args, postgres.url)
+        else:
+            return benchmark(args, args.db_url)
+    except BenchmarkError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+
+
+def benchmark(args, db_url):
+    token = configure_environment(db_url)
+
+    # Imported here, so --help does not have to import the whole application
+    from sqlalchemy import create_engine
+    from status_page import app as app_module
+    from status_page.config import Config
+
+    from .database import (create_schema, drop_schema)
+    from .seed import seed
+
+    engine = create_engine(db_url)
+    drop_schema(engine)
+    create_schema(engine)
+
+    print(f"Seeding {args.services} services with {args.events_per_service} events each...",
+          file=sys.stderr)
+    started = time.perf_counter()
+    dataset = seed(engine, services=args.services, events_per_service=args.events_per_service,
+                   permissions_per_service=args.permissions_per_service, groups=args.groups,
+                   seed=args.seed, admin=SITE_ADMIN)
+    print(f"Seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    # The SQL echo and debug logging would dominate every measurement
+    config = Config.from_environ()
+    config.db_echo = False
+    config.log_level = 'WARNING'
+    # Events still add their deliveries to the outbox, but nothing sends them while measuring
+    config.webhooks = False
+    # Every request is sent as the same user, as fast as it goes
+    config.event_rate_limit = None
+    app = app_module.create_app(config)
+
+    scenarios = build_scenarios(dataset, include_writes=not args.no_writes)
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if scenario.name in args.only]
+
+    covered = {scenario.path for scenario in scenarios}
+    for template in registered_templates(app):
+        if not any(_matches(template, path) for path in covered):
+            print(f"WARNING: no scenario covers {template}", file=sys.stderr)
+
+    results = {
+        'parameters': {
+            'services': args.services,
+            'events_per_service': args.events_per_service,
+            'permissions_per_service': args.permissions_per_service,
+            'groups': args.groups,
+            'seed': args.seed,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+        },
+        'in_process': run_in_process(app, scenarios, token, args.requests, args.warmup),
+    }
+
+    if args.concurrency:
+        results['concurrent'] = run_concurrent(app, scenarios, token, args.concurrency,
+                                               args.duration, url=args.url)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline.get('parameters') != results['parameters']:
+            print("WARNING: the baseline was recorded with different parameters", file=sys.stderr)
+
+    regressions = compare(results, baseline, args.threshold)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print(f"\nRegressions: {', '.join(regressions)}", file=sys.stderr)
+        if args.fail_on_regression:
+            return 1
+
+    return 0
+
+
+def _matches(template, path):
+    template_segments = template.strip('/').split('/')
+    path_segments = path.strip('/').split('/')
+
+    if len(template_segments) != len(path_segments):
+        return False
+
+    return all(t.startswith('{') or t == p for t, p in zip(template_segments, path_segments))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
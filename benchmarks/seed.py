@@ -0,0 +1,226 @@
+'''
+Seed a database with a reproducible synthetic dataset
+'''
+import random
+import uuid
+from datetime import (datetime, timedelta)
+
+import pytz
+from slugify import slugify
+from sqlalchemy.orm import Session
+
+from status_page.incidents import backfill_incidents
+from status_page.models import (
+    DisplayPreferences, EphemeralNotification, Event, Incident, Permission, Service, ServiceGroup, ServiceServiceGroup,
+    Webhook, WebhookDelivery,
+)
+
+
+CHUNK_SIZE = 10000
+
+
+class Dataset(object):
+    """
+    What was seeded, so scenarios can refer to real slugs and IDs
+    """
+
+    def __init__(self):
+        self.service_slugs = []
+        self.group_slugs = []
+        self.event_ids = {}
+        self.incident_ids = {}
+        self.permission_ids = {}
+        self.usernames = []
+        self.admin_permission_id = None
+        self.webhook_id = None
+        # Halfway through the seeded history, for status requests as of a past time
+        self.midpoint = None
+
+
+def _insert(conn, table, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        conn.execute(table.insert(), rows[start:start + CHUNK_SIZE])
+
+
+def seed(engine, services=100, events_per_service=200, permissions_per_service=5, groups=10,
+         down_fraction=0.1, history_days=30, seed=0, admin=None):
+    """
+    Fill the database with services, groups, events, and permissions
+
+    `services` - The number of services
+    `events_per_service` - The number of events for each service
+    `permissions_per_service` - The number of permissions for each service
+    `groups` - The number of service groups, services are spread evenly across them
+    `down_fraction` - The fraction of services whose most recent event is not 'up'
+    `history_days` - How far back the events go
+    `seed` - The random seed, the same seed always produces the same dataset
+    `admin` (optional) - A username to make service admin of, and subscribe to, one service, and
+        to give display preferences, for the requests that need them
+    """
+    rng = random.Random(seed)
+    dataset = Dataset()
+
+    now = datetime.now(tz=pytz.UTC)
+    start = now - timedelta(days=history_days)
+    dataset.midpoint = start + (now - start) / 2
+
+    group_rows = []
+    for i in range(groups):
+        name = f"Group {i:04d}"
+        group_rows.append({
+            'id': uuid.UUID(int=rng.getrandbits(128)),
+            'name': name,
+            'slug': slugify(name, to_lower=True),
+            'description': f"Synthetic benchmark group number {i}",
+        })
+    dataset.group_slugs = [row['slug'] for row in group_rows]
+
+    usernames = [f"user{i:04d}" for i in range(max(permissions_per_service * 4, 1))]
+    dataset.usernames = usernames
+
+    service_rows, membership_rows, event_rows, permission_rows = [], [], [], []
+
+    for i in range(services):
+        name = f"Service {i:05d}"
+        service_id = uuid.UUID(int=rng.getrandbits(128))
+        slug = slugify(name, to_lower=True)
+
+        service_rows.append({
+            'id': service_id,
+            'name': name,
+            'slug': slug,
+            'description': f"Synthetic benchmark service number {i}",
+        })
+        dataset.service_slugs.append(slug)
+
+        if group_rows:
+            membership_rows.append({
+                'id': uuid.UUID(int=rng.getrandbits(128)),
+                'group_id': group_rows[i % len(group_rows)]['id'],
+                'service_id': service_id,
+            })
+
+        # A random walk that is mostly up, with outages of a few events
+        ends_down = rng.random() < down_fraction
+        status = 'up'
+        step = (now - start) / max(events_per_service, 1)
+        for j in range(events_per_service):
+            last = j == events_per_service - 1
+
+            if last and ends_down:
+                status = 'down'
+            elif last:
+                status = 'up'
+            elif status == 'up':
+                status = 'down' if rng.random() < 0.05 else 'up'
+            else:
+                status = 'up' if rng.random() < 0.3 else 'down'
+
+            event_id = uuid.UUID(int=rng.getrandbits(128))
+            event_rows.append({
+                'id': event_id,
+                'service_id': service_id,
+                'when': start + step * j,
+                'status': status,
+                'description': f"Synthetic {status} event {j}",
+                'informational': rng.random() < 0.2,
+                'extra': {'from': 'benchmark', 'check': j % 10},
+            })
+        if events_per_service:
+            dataset.event_ids[slug] = event_id
+
+        for username in rng.sample(usernames, min(permissions_per_service, len(usernames))):
+            permission_id = uuid.UUID(int=rng.getrandbits(128))
+            permission_rows.append({
+                'id': permission_id,
+                'username': username,
+                'service_id': service_id,
+                'type': rng.choice(['service-admin', 'updater']),
+            })
+            dataset.permission_ids[slug] = permission_id
+
+    if admin is not None and service_rows:
+        dataset.admin_permission_id = uuid.UUID(int=rng.getrandbits(128))
+        permission_rows.append({
+            'id': dataset.admin_permission_id,
+            'username': admin,
+            'service_id': service_rows[len(service_rows) // 2]['id'],
+            'type': 'service-admin',
+        })
+        subscription_rows = [{
+            'username': admin,
+            'service_id': service_rows[len(service_rows) // 2]['id'],
+            'chat': True,
+            'email': False,
+        }]
+        preference_rows = [{
+            'username': admin,
+            'preferences': {
+                'services': [row['slug'] for row in service_rows[:20]],
+                'groups': [group_rows[0]['slug']] if group_rows else [],
+            },
+        }]
+    else:
+        subscription_rows, preference_rows = [], []
+
+    # A webhook for every group, and a delivery history for the first one
+    webhook_rows, delivery_rows = [], []
+    for group in group_rows:
+        webhook_rows.append({
+            'id': uuid.UUID(int=rng.getrandbits(128)),
+            'endpoint': f"http://127.0.0.1:9/{group['slug']}",
+            'secret': None,
+            'service_id': None,
+            'group_id': group['id'],
+            'changes_only': False,
+            'created_by': admin or 'benchmark',
+        })
+
+    if webhook_rows:
+        dataset.webhook_id = webhook_rows[0]['id']
+
+        first_group = {row['service_id'] for row in membership_rows
+                       if row['group_id'] == group_rows[0]['id']}
+        for event in event_rows:
+            if event['service_id'] not in first_group:
+                continue
+
+            dead = rng.random() < 0.01
+            delivery_rows.append({
+                'webhook_id': dataset.webhook_id,
+                'event_id': event['id'],
+                'state': 'dead' if dead else 'delivered',
+                'attempts': 10 if dead else 1,
+                'next_attempt_at': event['when'],
+                'created_at': event['when'],
+                'delivered_at': None if dead else event['when'],
+                'last_error': "503 Service Unavailable" if dead else None,
+            })
+
+    with engine.begin() as conn:
+        _insert(conn, ServiceGroup.__table__, group_rows)
+        _insert(conn, Service.__table__, service_rows)
+        _insert(conn, ServiceServiceGroup.__table__, membership_rows)
+        _insert(conn, Event.__table__, event_rows)
+        _insert(conn, Permission.__table__, permission_rows)
+        _insert(conn, EphemeralNotification.__table__, subscription_rows)
+        _insert(conn, DisplayPreferences.__table__, preference_rows)
+        _insert(conn, Webhook.__table__, webhook_rows)
+        _insert(conn, WebhookDelivery.__table__, delivery_rows)
+
+    # The incidents of the seeded events, like on a database that predates them
+    db = Session(bind=engine)
+    try:
+        backfill_incidents(db)
+
+        dataset.incident_ids = dict(db.query(Service.slug, Incident.id)
+                                    .join(Incident.service)
+                                    .distinct(Service.slug)
+                                    .order_by(Service.slug, Incident.started_at.desc()))
+    finally:
+        db.close()
+
+    with engine.begin() as conn:
+        conn.execute('ANALYZE')
+
+    return dataset
@@ -0,0 +1,136 @@
+'''
+Benchmark how long a fresh worker process takes to become useful
+
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.startup --importtime
+
+Every run is a new Python process, like a freshly forked (non-preloaded) worker, and measures:
+
+* importing `status_page.app`
+* building the application with `create_app()`
+* loading the JWT keys
+* the first request, and a second one for comparison
+
+No database is needed, the engine is created but never connects.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from .run import (SITE_ADMIN, configure_environment)
+
+
+STAGES = ('import', 'create_app', 'load_keys', 'first_request', 'second_request')
+
+CHILD = '''
+import json, time
+started = time.perf_counter()
+
+from status_page import app as app_module
+imported = time.perf_counter()
+
+from status_page.config import Config
+config = Config.from_environ()
+config.db_echo = False
+config.log_level = 'WARNING'
+app = app_module.create_app(config)
+created = time.perf_counter()
+
+from status_page import api
+api.landing_page_auth.public_key
+api.status_page_human_auth.private_key
+api.status_page_human_auth.public_key
+keys = time.perf_counter()
+
+import falcon.testing
+client = falcon.testing.TestClient(app)
+client.simulate_get('/')
+first = time.perf_counter()
+client.simulate_get('/')
+second = time.perf_counter()
+
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'load_keys': keys - created,
+    'first_request': first - keys,
+    'second_request': second - first,
+}))
+'''
+
+
+def child_environment():
+    configure_environment('postgresql://postgres@localhost/status_page_bench')
+
+    environ = dict(os.environ)
+    source = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    environ['PYTHONPATH'] = os.pathsep.join(filter(None, [source, environ.get('PYTHONPATH')]))
+    return environ
+
+
+def measure(environ):
+    output = subprocess.run([sys.executable, '-c', CHILD], env=environ, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def importtime(environ, top=25):
+    """
+    The modules with the largest cumulative import time, from `python -X importtime`
+    """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import status_page.app'],
+                            env=environ, check=True, stderr=subprocess.PIPE).stderr
+
+    rows = []
+    for line in stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # import time:       self |  cumulative | module
+        self_us, cumulative_us, module = line[len('import time:'):].split('|', 2)
+        rows.append((int(cumulative_us), int(self_us), module.rstrip()))
+
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', action='store_true',
+                        help="Also show the slowest modules to import")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    environ = child_environment()
+
+    runs = [measure(environ) for _ in range(args.runs)]
+
+    results = {}
+    print(f"{'stage':<20}{'median ms':>12}{'min ms':>12}{'max ms':>12}")
+    for stage in STAGES:
+        timings = [run[stage] * 1000 for run in runs]
+        results[stage] = {
+            'median_ms': statistics.median(timings),
+            'min_ms': min(timings),
+            'max_ms': max(timings),
+        }
+        print(f"{stage:<20}{results[stage]['median_ms']:>12.2f}{results[stage]['min_ms']:>12.2f}"
+              f"{results[stage]['max_ms']:>12.2f}")
+
+    if args.importtime:
+        print(f"\n{'module':<50}{'cumulative ms':>15}{'self ms':>12}")
+        for cumulative_us, self_us, module in importtime(environ):
+            print(f"{module.strip():<50}{cumulative_us / 1000:>15.2f}{self_us / 1000:>12.2f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
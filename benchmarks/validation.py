@@ -0,0 +1,86 @@
+'''
+Benchmark validating event POST bodies
+
+    python -m benchmarks.validation --number 20000
+
+Compares what Falcon's validator does on every request (`jsonschema.validate()`, which checks the
+schema and builds a new validator each time) with the validators compiled once by
+`status_page.utils.validation`, with and without fastjsonschema.
+'''
+import argparse
+import statistics
+import sys
+import timeit
+
+import jsonschema
+
+from status_page.api import EVENT_SCHEMA
+from status_page.utils.validation import (SchemaValidator, fastjsonschema)
+
+
+BODIES = {
+    'valid': {
+        'status': 'down',
+        'description': "The health check timed out after 10 seconds",
+        'informational': False,
+        'extra': {'check': 'http', 'region': 'us-east-1', 'attempts': 3},
+    },
+    'invalid': {
+        'status': 'sideways',
+        'description': "The health check timed out after 10 seconds",
+        'informational': False,
+    },
+}
+
+
+def per_request(body):
+    try:
+        jsonschema.validate(body, EVENT_SCHEMA, format_checker=jsonschema.FormatChecker())
+    except jsonschema.ValidationError:
+        pass
+
+
+def compiled(validator):
+    def run(body):
+        try:
+            validator.validate(body)
+        except jsonschema.ValidationError:
+            pass
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=10000,
+                        help="Validations per measurement")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    strategies = [
+        ('per-request jsonschema.validate()', per_request),
+        ('compiled jsonschema', compiled(SchemaValidator(EVENT_SCHEMA, use_codegen=False))),
+    ]
+    if fastjsonschema is not None:
+        strategies.append(
+            ('compiled fastjsonschema', compiled(SchemaValidator(EVENT_SCHEMA, use_codegen=True))))
+    else:
+        print("fastjsonschema is not installed, skipping it", file=sys.stderr)
+
+    print(f"{'strategy':<36}{'body':<10}{'median us':>12}{'min us':>12}")
+    for name, strategy in strategies:
+        for body_name, body in BODIES.items():
+            # The first call compiles
+            strategy(body)
+
+            timings = timeit.repeat(lambda: strategy(body), number=args.number, repeat=args.repeat)
+            per_call = [timing / args.number * 1e6 for timing in timings]
+
+            print(f"{name:<36}{body_name:<10}{statistics.median(per_call):>12.2f}"
+                  f"{min(per_call):>12.2f}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+'''
+Gunicorn configuration
+
+    gunicorn status_page.wsgi:application
+
+Gunicorn picks this file up from the working directory. The application is built and warmed up
+once in the master process, and the workers fork from it with everything already loaded.
+'''
+import multiprocessing
+import os
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# Build the application (and warm it up) before forking the workers. Its background threads are
+# only started in the workers, the master never touches the database.
+preload_app = True
+os.environ['STATUS_PAGE_PRELOAD'] = 'true'
+
+# Workers are recycled now and then, the jitter keeps them from all restarting at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+
+
+def post_fork(server, worker):
+    from status_page import app
+
+    app.post_fork()
@@ -95,6 +95,14 @@ setup(
         'dev': [
             'httpie',
         ],
+        # Code generated request validation
+        'fast': [
+            'fastjsonschema',
+        ],
+        # Brotli response compression, gzip and deflate need nothing extra
+        'brotli': [
+            'brotli',
+        ],
     },
 
     # If there are data files included in your packages that need to be
@@ -113,7 +121,13 @@ setup(
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
-    entry_points={},
+    entry_points={
+        'console_scripts': [
+            'status-page-checks=status_page.checks:main',
+            'status-page-incidents=status_page.incidents:main',
+            'status-page-webhooks=status_page.webhooks:main',
+        ],
+    },
     zip_safe=False,
     use_2to3=(sys.version_info < (3, 0)),
 )
@@ -1,32 +1,25 @@
-import os
 import uuid
 from collections import OrderedDict
 from datetime import (datetime, timedelta)
+from functools import wraps
+from urllib.parse import urlencode
 
 import falcon
-from falcon.media.validators import jsonschema
 import jwt
 import pytz
 
-from sqlalchemy import func
+from sqlalchemy import (and_, exists, func, select, true)
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import (aliased, contains_eager)
+from sqlalchemy.orm import (aliased, contains_eager, joinedload, load_only)
 from sqlalchemy.orm.exc import NoResultFound
 
+from .config import get_config
+from .ingestion import EventIngestor
 from .models import *
+from .queries import *
 from .utils import *
 
 
-SITE_ADMINS = os.environ.get('STATUS_PAGE_SITE_ADMINS').split(',')
-
-LANDING_PAGE_PUBLIC_KEY = os.environ.get('LANDING_PAGE_JWT_PUBLIC_KEY').encode('utf-8')
-
-STATUS_PAGE_PRIVATE_KEY = os.environ.get('STATUS_PAGE_JWT_PRIVATE_KEY').encode('utf-8')
-STATUS_PAGE_PUBLIC_KEY = os.environ.get('STATUS_PAGE_JWT_PUBLIC_KEY').encode('utf-8')
-
-HTTP_HEADER_PREFIX = os.environ.get('HTTP_HEADER_PREFIX', 'JWT')
-
-
 def get_user_dict(data):
     user_dict = data['user_dict']
 
@@ -65,25 +58,233 @@ def add_authentication_method(data):
     return data
 
 
+def is_site_admin(username):
+    return username in get_config().site_admins
+
+
+# The keys are only read from the configuration the first time a request needs them
 landing_page_auth = JWTAuth(
-    public_key=LANDING_PAGE_PUBLIC_KEY, algorithm='RS512',
-    http_header_prefix=HTTP_HEADER_PREFIX, options={'verify_exp': True},
+    public_key=lambda: get_config().landing_page_public_key, algorithm='RS512',
+    http_header_prefix=lambda: get_config().http_header_prefix, options={'verify_exp': True},
     userdata_function=get_user_dict)
 
 status_page_human_auth = JWTAPIKeyAuth(
-    private_key=STATUS_PAGE_PRIVATE_KEY, public_key=STATUS_PAGE_PUBLIC_KEY, algorithm='RS512',
-    http_header_prefix=HTTP_HEADER_PREFIX, options={'verify_exp': True},
+    private_key=lambda: get_config().status_page_private_key,
+    public_key=lambda: get_config().status_page_public_key, algorithm='RS512',
+    http_header_prefix=lambda: get_config().http_header_prefix, options={'verify_exp': True},
     verify_function=verify_is_not_bot, userdata_function=add_authentication_method)
 
 status_page_bot_auth = JWTAPIKeyAuth(
-    private_key=STATUS_PAGE_PRIVATE_KEY, public_key=STATUS_PAGE_PUBLIC_KEY, algorithm='RS512',
-    http_header_prefix=HTTP_HEADER_PREFIX, options={'verify_exp': False},
+    private_key=lambda: get_config().status_page_private_key,
+    public_key=lambda: get_config().status_page_public_key, algorithm='RS512',
+    http_header_prefix=lambda: get_config().http_header_prefix, options={'verify_exp': False},
     verify_function=verify_is_bot, userdata_function=add_authentication_method)
 
 
 logger = logging.getLogger(__name__)
 
 
+def is_site_admin_request(req):
+    """
+    Whether the request carries a valid human JWT for a site admin
+
+    This is for middleware, which runs outside of the `authenticate` decorator.
+    """
+    for auth in (landing_page_auth, status_page_human_auth):
+        try:
+            payload = auth.authenticate(req)
+        except (jwt.InvalidTokenError, falcon.HTTPError):
+            continue
+
+        user = auth.userdata_function(payload) if auth.userdata_function else payload
+        return is_site_admin(user.get('username'))
+
+    return False
+
+
+# Display preferences change rarely but are read on every personalized /status request. Each
+# worker process caches them, and the copy in the process that handles an update is invalidated
+# immediately; other processes pick the change up within the TTL.
+preferences_cache = TTLCache(maxsize=10000, ttl=300)
+
+EVENT_FIELDS = ('url', 'when', 'status', 'description', 'informational', 'extra')
+
+
+# Heartbeat deadlines are checked by a background thread, not to the second
+MIN_HEARTBEAT_INTERVAL = 10
+
+# Registering and replacing a service take the same body, so they share one compiled validator
+SERVICE_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-06/schema#",
+    "title": "Service",
+    "description": "Register a new service, or replace a registered one",
+    "type": "object",
+    "properties": {
+        "name": {
+            "type": "string",
+            "minLength": 4,
+        },
+        # Try to force users to create reasonable descriptions. Consider allowing descriptions
+        # with <20 characters, because services may be very obvious to the most casual observer,
+        # so an enforced description isn't necessarily helpful.
+        "description": {
+            "type": "string",
+            "minLength": 20,
+        },
+        # Seconds, null for services that only report changes
+        "heartbeat_interval": {
+            "type": ["integer", "null"],
+            "minimum": MIN_HEARTBEAT_INTERVAL,
+        },
+    },
+    "required": ["name", "description"],
+}
+
+SERVICE_PATCH_SCHEMA = {
+    key: value for key, value in SERVICE_SCHEMA.items() if key != "required"
+}
+SERVICE_PATCH_SCHEMA["description"] = "Update an attribute of a registered service"
+
+
+EVENT_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-06/schema#",
+    "title": "Event",
+    "description": "Report an event for a registered service.",
+    "type": "object",
+    "properties": {
+        "status": {
+            "type": "string",
+            "enum": ["up", "down"],
+        },
+        "description": {
+            "type": "string",
+        },
+        "informational": {
+            "type": "boolean",
+        },
+        "extra": {
+            "type": "object",
+        },
+    },
+    "required": ["status", "description", "informational"],
+}
+
+
+def get_display_preferences(db, username):
+    def load_preferences():
+        preferences = db.query(DisplayPreferences.preferences)\
+            .filter(DisplayPreferences.username == username)\
+            .scalar()
+        return preferences or {}
+
+    return preferences_cache.get_or_set(username, load_preferences)
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+PAGINATION_OPTIONS = {
+    "page": {
+        "type": "number",
+        "description": _("Page to return"),
+    },
+    "page_size": {
+        "type": "number",
+        "minimum": 1,
+        "maximum": MAX_PAGE_SIZE,
+        "description": _(f"Results per page (default: {DEFAULT_PAGE_SIZE})"),
+    },
+    "count": {
+        "type": "string",
+        "enum": list(COUNT_STRATEGIES),
+        "description": _("How to count the results: exactly, estimated by the database, exactly "
+                         "but cached for a minute, or not at all (just whether there is a next "
+                         "page)"),
+    },
+}
+
+
+def get_page_size(req):
+    page_size = req.get_param_as_int('page_size')
+
+    if page_size is None:
+        return DEFAULT_PAGE_SIZE
+
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        title = _(f"Invalid page size '{page_size}'")
+        description = _(f"The page size must be between 1 and {MAX_PAGE_SIZE}")
+        raise falcon.HTTPBadRequest(title, description)
+
+    return page_size
+
+
+def get_count_strategy(req, default):
+    count = req.get_param('count')
+
+    if count is None:
+        return default
+
+    if count not in COUNT_STRATEGIES:
+        title = _(f"Invalid count strategy '{count}'")
+        description = _(f"You can choose from these strategies: {', '.join(COUNT_STRATEGIES)}")
+        raise falcon.HTTPBadRequest(title, description)
+
+    return count
+
+
+def get_list_param(req, name):
+    """
+    A comma separated (or repeated) query parameter as a list
+    """
+    # Split the values ourselves, newer versions of Falcon don't split commas in query strings
+    return [item
+            for value in req.get_param_as_list(name) or []
+            for item in value.split(',') if item]
+
+
+def fields_option(fields, default):
+    return {
+        "type": "array",
+        "items": {
+            "type": "string",
+            "enum": list(fields),
+        },
+        "description": _("Comma separated fields to include in each result (default: "
+                         f"{', '.join(default)})"),
+    }
+
+
+def get_fields(req, fields, default, required=()):
+    """
+    The sparse fieldset requested with `?fields=`, and the columns needed to render it
+
+    Returns the field names and a `load_only()` option, so only those columns are selected.
+
+    `fields` - Maps every field name to the model attributes it needs
+    `default` - The fields returned when none are requested
+    `required` (optional) - Attributes the conversion to a dictionary always uses, leaving them
+                            out would load each of them with another query
+    """
+    requested = get_list_param(req, 'fields') or list(default)
+
+    unknown = [field for field in requested if field not in fields]
+    if unknown:
+        title = _(f"Unknown fields: {', '.join(unknown)}")
+        description = _(f"You can choose from these fields: {', '.join(fields)}")
+        raise falcon.HTTPBadRequest(title, description)
+
+    columns = set(required) | {column for field in requested for column in fields[field]}
+
+    # The primary key is always loaded, and load_only() needs at least one column
+    return requested, load_only(*(columns or {'id'}))
+
+
+def only_fields(to_dict, fields):
+    def convert(obj):
+        return {key: value for key, value in to_dict(obj).items() if key in fields}
+    return convert
+
+
 class RootRoute(object):
     def on_get(self, req, resp):
         resp.media = {
@@ -100,11 +301,11 @@ class RootRoute(object):
                 "User-based permissions scheme",
                 "JWT authentication",
                 "Integration with the internal landing page ( https://mz/ )",
-            ],
-            "todo": [
-                "Individual user preferences",
                 "Ephemeral (one time) subscriptions for updates",
+                "Webhooks for integrations",
+                "Individual user preferences",
             ],
+            "todo": [],
             "routes": {
                 "Status List": {
                     "url": "/status",
@@ -122,6 +323,10 @@ class RootRoute(object):
                     "url": "/services/{{ slug }}/status",
                     "description": "View the current status for a specific service",
                 },
+                "Service Subscription": {
+                    "url": "/services/{{ slug }}/subscription",
+                    "description": "Get notified once the next time a specific service changes status",
+                },
                 "Events List": {
                     "url": "/services/{{ slug }}/events",
                     "description": "View events for a specific service",
@@ -130,6 +335,18 @@ class RootRoute(object):
                     "url": "/services/{{ slug }}/events/{{ event_uuid }}",
                     "description": "View the details for a specific event",
                 },
+                "Incidents List": {
+                    "url": "/incidents",
+                    "description": "List the spans of time services weren't up, eg: ?open=true",
+                },
+                "Service Incidents List": {
+                    "url": "/services/{{ slug }}/incidents",
+                    "description": "List the incidents of a specific service",
+                },
+                "Incident Detail": {
+                    "url": "/services/{{ slug }}/incidents/{{ incident_uuid }}",
+                    "description": "View an incident and its events",
+                },
                 "Service Permissions List": {
                     "url": "/services/{{ slug }}/permissions",
                     "description": "List all of the users who have permissons for a specific service",
@@ -142,47 +359,264 @@ class RootRoute(object):
                     "url": "/user/{{ username }}/permissions",
                     "description": "List the permissions for a specific user",
                 },
+                "User Display Preferences": {
+                    "url": "/users/{{ username }}/preferences",
+                    "description": "Choose the services, groups, and fields shown by /status?preferences=true",
+                },
+                "Webhooks List": {
+                    "url": "/webhooks",
+                    "description": "Send the events of a service or group to other systems (site "
+                                   "admins only)",
+                },
+                "Webhook Detail": {
+                    "url": "/webhooks/{{ webhook_uuid }}",
+                    "description": "View or delete a webhook",
+                },
+                "Webhook Deliveries": {
+                    "url": "/webhooks/{{ webhook_uuid }}/deliveries",
+                    "description": "List the deliveries of a webhook, eg: ?state=dead",
+                },
+                "Webhook Redelivery": {
+                    "url": "/webhooks/{{ webhook_uuid }}/redeliver",
+                    "description": "Send the dead-lettered deliveries of a webhook again",
+                },
                 "API Keys": {
                     "url": "/api-keys",
                     "description": "Get an API key for a user or an updater bot",
                 },
+                "Metrics": {
+                    "url": "/metrics",
+                    "description": "Request, database, and authentication metrics in the "
+                                   "Prometheus exposition format",
+                },
             },
         }
 
 
+DEFAULT_STATUS_EVENTS = 20
+MAX_STATUS_EVENTS = MAX_PAGE_SIZE
+
+STATUS_OPTIONS = {
+    "limit": {
+        "type": "number",
+        "minimum": 1,
+        "maximum": MAX_STATUS_EVENTS,
+        "description": _("The most events since the last time it was up to include per service "
+                         f"(default: {DEFAULT_STATUS_EVENTS})"),
+    },
+    "since": {
+        "type": "string",
+        "format": "date-time",
+        "description": _("Leave out events older than this, eg: 2018-01-01T00:00:00Z"),
+    },
+    "at": {
+        "type": "string",
+        "format": "date-time",
+        "description": _("The status as it was at this time instead of now, eg: "
+                         "2018-01-01T14:03:00Z"),
+    },
+}
+
+
+def get_status_window(req):
+    """
+    How many events per service, since when, and as of when a status response includes
+    """
+    limit = req.get_param_as_int('limit')
+
+    if limit is None:
+        limit = DEFAULT_STATUS_EVENTS
+    elif not 1 <= limit <= MAX_STATUS_EVENTS:
+        title = _(f"Invalid limit '{limit}'")
+        description = _(f"The limit must be between 1 and {MAX_STATUS_EVENTS}")
+        raise falcon.HTTPBadRequest(title, description)
+
+    return limit, req.get_param_as_datetime('since'), req.get_param_as_datetime('at')
+
+
+# Event times have microseconds, and the links to a window of events must not round them off
+PRECISE_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def format_precise_datetime(when):
+    return when.astimezone(pytz.utc).strftime(PRECISE_DATETIME_FORMAT)
+
+
+def get_param_as_precise_datetime(req, name):
+    """
+    A datetime query parameter, like `req.get_param_as_datetime()`, that can also have fractional
+    seconds, eg: 2018-01-01T00:00:00.250000Z
+    """
+    value = req.get_param(name)
+
+    if value is not None and '.' in value:
+        try:
+            return datetime.strptime(value, PRECISE_DATETIME_FORMAT).replace(tzinfo=pytz.utc)
+        except ValueError:
+            raise falcon.HTTPInvalidParam(_("The date value does not match the required format."),
+                                          name)
+
+    return req.get_param_as_datetime(name)
+
+
+def status_window_marker(service_slug, limit, truncated, start, end):
+    """
+    Whether events were left out of a status response, and where to find the rest
+
+    `truncated` - Whether there are more than `limit` events in the window
+    `start` - When the window starts (inclusive), or None if it goes back to the first event
+    `end` - When the newest event of the window happened
+    """
+    if not truncated:
+        return {"truncated": False}
+
+    # The same window, pinned to its newest event so events recorded since don't shift the pages,
+    # and the next page starts right after the events we returned
+    params = OrderedDict([('order_by', '-when'), ('page_size', limit), ('page', 2)])
+    if start is not None:
+        params['since'] = format_precise_datetime(start)
+    params['until'] = format_precise_datetime(end)
+
+    return {
+        "truncated": True,
+        "more": f"/services/{service_slug}/events?{urlencode(params)}",
+    }
+
+
+def status_scope(req):
+    # Personalized responses are only shared by requests with the same credentials
+    return req.get_header('Authorization') if req.get_param_as_bool('preferences') else None
+
+
+# Events are recorded with the time they are received, so once a time is this far in the past no
+# more events can show up before it, and the status as of then is settled
+HISTORY_SETTLE_TIME = timedelta(minutes=1)
+
+# Status responses as of settled times never change, unless a service is renamed or removed. Each
+# worker process caches them, and the copy in the process that handles that change is cleared
+# immediately; other processes pick the change up within the TTL.
+history_cache = TTLCache(maxsize=1024, ttl=60 * 60)
+
+
+def cache_history(scope=None):
+    """
+    Cache the responses of a status responder for requests `at` a settled time
+
+    Only the status and media of the response are cached, like `coalesce()`.
+
+    `scope` (optional) - A callable that takes the request and returns what else the response
+                         depends on, eg: the user for personalized responses
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, req, resp, *args, **kwargs):
+            at = req.get_param_as_datetime('at')
+            if at is None:
+                return func(self, req, resp, *args, **kwargs)
+
+            # Without a time zone, it's UTC
+            if at.tzinfo is None:
+                at = at.replace(tzinfo=pytz.utc)
+            if at > datetime.now(pytz.utc) - HISTORY_SETTLE_TIME:
+                return func(self, req, resp, *args, **kwargs)
+
+            key = request_key(self, req, scope)
+            cached = history_cache.get(key)
+            if cached is not None:
+                resp.status, resp.media = cached
+                return
+
+            func(self, req, resp, *args, **kwargs)
+
+            # Stale responses are served while the database is unavailable, they may not be as of
+            # `at` at all
+            if str(resp.status).startswith('200') and not resp.media.get('stale'):
+                history_cache.set(key, (resp.status, resp.media))
+
+        return wrapper
+    return decorator
+
+
+# The last good responses of the read routes, served (marked stale) while the database is
+# unavailable. The application factory sets the latency budget.
+stale_while_revalidate = StaleWhileRevalidate()
+
+
+def rate_limit_key(req):
+    """
+    Whose rate limit an authenticated request counts against: its API key (every key issued for a
+    permission shares its JWT ID) or its user
+    """
+    jti = req.user.get('jti')
+    return f"key:{jti}" if jti is not None else f"user:{req.user['username']}"
+
+
+# One bot that misbehaves shouldn't flood the database with events. The application factory sets
+# the limiter.
+event_rate_limit = RateLimit(rate_limit_key)
+
+
 class StatusRoute(object):
+    def on_options(self, req, resp):
+        resp.media = {
+            "preferences": {
+                "type": "boolean",
+                "description": _("Only show the services, groups, and event fields selected in "
+                                 "your display preferences (requires authentication)"),
+            },
+            **STATUS_OPTIONS,
+        }
+
+    def get_preferences(self, req, resp):
+        if not (landing_page_auth | status_page_human_auth).is_authenticated(req, resp):
+            raise falcon.HTTPUnauthorized(resp.media['error'])
+
+        return get_display_preferences(self.db, req.user['username'])
+
+    # During an outage everybody polls this at once, so identical requests share one response
+    @coalesce(scope=status_scope)
+    @cache_history(scope=status_scope)
+    @stale_while_revalidate(scope=status_scope)
     def on_get(self, req, resp):
-        last_up = self.db.query(Event.service_id, func.max(Event.when).label('when'))\
-            .filter(Event.status == 'up')\
-            .group_by(Event.service_id)
+        if req.get_param_as_bool('preferences'):
+            preferences = self.get_preferences(req, resp)
+        else:
+            preferences = {}
 
-        last_up_subquery = last_up.subquery('last_up_subquery')
+        selected_services = preferences.get('services')
+        selected_groups = preferences.get('groups')
 
-        # Not sure if this is strictly required, since SQLAlchemy doesn't seem to be running any
-        # additional queries when it loads event.service.slug in the loop below, but this is
-        # working
-        service_alias = aliased(Service)
+        fields = preferences.get('fields')
+
+        if fields:
+            def convert_event(event):
+                return {k: v for k, v in event_to_dict(event).items() if k in fields}
+        else:
+            convert_event = event_to_dict
+
+        limit, since, at = get_status_window(req)
 
-        relevant_events = self.db.query(Event)\
-            .join(service_alias, service_alias.id == Event.service_id)\
-            .join(last_up_subquery, (last_up_subquery.c.when <= Event.when) &
-                                    (last_up_subquery.c.service_id == Event.service_id))\
-            .order_by(service_alias.name.asc(), Event.when.desc())\
-            .options(contains_eager(Event.service, alias=service_alias))
+        relevant_events = status_events(self.db, limit, since=since, at=at,
+                                        services=selected_services,
+                                        groups=selected_groups,
+                                        # Don't even load it from the database
+                                        load_extra=not fields or 'extra' in fields)
 
         events_result = {}
         last_service_id = None
-        for event in relevant_events:
+        for event, truncated, start in relevant_events:
             if event.service_id != last_service_id:
                 events_result[event.service.name] = {
                     "url": f"/services/{event.service.slug}",
                     "status": event.status,
-                    "events": [event_to_dict(event)],
+                    "events": [convert_event(event)],
+                    **status_window_marker(event.service.slug, limit, truncated, start,
+                                           event.when),
                 }
 
                 last_service_id = event.service_id
             else:
-                events_result[event.service.name]['events'].append(event_to_dict(event))
+                events_result[event.service.name]['events'].append(convert_event(event))
 
         resp.media = {
             "url": "/status",
@@ -190,61 +624,171 @@ class StatusRoute(object):
         }
 
 
+MAX_BATCH_SERVICES = 100
+
+
+class StatusBatchRoute(object):
+    def on_options(self, req, resp):
+        resp.media = {
+            "services": {
+                "type": "array",
+                "items": {
+                    "type": "string",
+                },
+                "description": _("Comma separated service slugs"),
+            },
+            "groups": {
+                "type": "array",
+                "items": {
+                    "type": "string",
+                },
+                "description": _("Comma separated service group slugs, their services are "
+                                 "included too"),
+            },
+        }
+
+    @coalesce()
+    @stale_while_revalidate()
+    def on_get(self, req, resp):
+        services = get_list_param(req, 'services')
+        groups = get_list_param(req, 'groups')
+
+        if not services and not groups:
+            title = _("No services selected")
+            description = _("Select services with ?services=<slug>,<slug> or service groups with "
+                            "?groups=<slug>")
+            raise falcon.HTTPBadRequest(title, description)
+
+        if len(services) + len(groups) > MAX_BATCH_SERVICES:
+            title = _("Too many services selected")
+            description = _(f"You can select up to {MAX_BATCH_SERVICES} services and groups at "
+                            "once")
+            raise falcon.HTTPBadRequest(title, description)
+
+        results = OrderedDict()
+        for service, event in latest_events(self.db, services=services, groups=groups):
+            results[service.slug] = {
+                "url": f"/services/{service.slug}",
+                "name": service.name,
+                "status": event.status if event is not None else None,
+                "event": event_to_dict(event) if event is not None else None,
+            }
+
+        resp.media = {
+            "url": req.relative_uri,
+            "results": results,
+            "missing": [slug for slug in services if slug not in results],
+        }
+
+
+def with_latest_event(q):
+    """
+    Add the status and time of each service's newest event, and whether it has an open incident,
+    to a query of services
+
+    A lateral join picks the newest event of every service in the same query, one index lookup
+    per service, and the open incident is looked up in the partial index of open incidents. The
+    results are tuples of the service, the status and the time (both `None` for services without
+    events), and whether an incident is open.
+    """
+    latest_event = select([Event.status, Event.when])\
+        .where(Event.service_id == Service.id)\
+        .order_by(Event.when.desc())\
+        .limit(1)\
+        .lateral('latest_event')
+
+    has_open_incident = exists()\
+        .where(and_(Incident.service_id == Service.id, Incident.ended_at.is_(None)))\
+        .correlate(Service)
+
+    return q.outerjoin(latest_event, true()).add_columns(latest_event.c.status, latest_event.c.when,
+                                                         has_open_incident.label('open_incident'))
+
+
+def service_with_status_to_dict(row):
+    service, status, when, has_open_incident = row
+
+    return {
+        **service_to_dict(service),
+        "status": status,
+        "last_event_at": when,
+        "open_incident": has_open_incident,
+    }
+
+
 class ServicesRoute(object):
+    # The fields of each result, and the columns they need
+    FIELDS = OrderedDict([
+        ('url', ()),
+        ('name', ('name',)),
+        ('slug', ()),
+        ('description', ('description',)),
+        ('heartbeat_interval', ('heartbeat_interval',)),
+        ('status', ()),
+        ('last_event_at', ()),
+        ('open_incident', ()),
+    ])
+
+    DEFAULT_FIELDS = ('url', 'name', 'slug', 'description')
+
+    # These need the newest event of each service, so they are only included when asked for
+    STATUS_FIELDS = ('status', 'last_event_at', 'open_incident')
+
+    # How results are counted, unless the request asks otherwise
+    COUNT = 'exact'
+
     def on_options(self, req, resp):
         resp.media = {
             "q": {
                 "type": "string",
                 "description": _("Search by service name"),
             },
+            "fields": fields_option(ServicesRoute.FIELDS, ServicesRoute.DEFAULT_FIELDS),
+            **PAGINATION_OPTIONS,
         }
 
+    @stale_while_revalidate()
     def on_get(self, req, resp):
         page_number = req.get_param_as_int('page')
+        page_size = get_page_size(req)
+        fields, only_columns = get_fields(req, ServicesRoute.FIELDS, ServicesRoute.DEFAULT_FIELDS,
+                                          required=('slug',))
 
         search_query = req.get_param('q')
 
-        q = self.db.query(Service)
+        q = self.db.query(Service).options(only_columns)
 
         if search_query is not None:
             q = q.filter(Service.name.ilike(f'%{search_query}%'))
 
-        page = paginate(q.order_by(Service.name.asc()), page_number, 20,
+        if any(field in ServicesRoute.STATUS_FIELDS for field in fields):
+            q = with_latest_event(q)
+            to_dict = service_with_status_to_dict
+        else:
+            to_dict = service_to_dict
+
+        page = paginate(q.order_by(Service.name.asc()), page_number, page_size,
                         path=req.path,
                         params=req.params,
-                        convert_items_callback=service_to_dict)
+                        convert_items_callback=only_fields(to_dict, fields),
+                        count=get_count_strategy(req, self.COUNT))
 
         resp.media = obj_to_dict(page)
 
-    @jsonschema.validate({
-        "$schema": "http://json-schema.org/draft-06/schema#",
-        "title": "Service",
-        "description": "Register a new service",
-        "type": "object",
-        "properties": {
-            "name": {
-                "type": "string",
-                "minLength": 4,
-            },
-            "description": {
-                "type": "string",
-                # Try to force users to create reasonable descriptions
-                "minLength": 20,
-            },
-        },
-        "required": ["name", "description"],
-    })
+    @validate(SERVICE_SCHEMA)
     @authenticate(landing_page_auth | status_page_human_auth)
     def on_post(self, req, resp):
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
-            logger.audit(f"Unauthorized: user {req.user['username']} attempted to create a "
-                         "service but is not a site admin")
+        if not is_site_admin(req.user['username']):
+            logger.audit("Unauthorized: user %s attempted to create a service but is not a site "
+                         "admin", req.user['username'],
+                         action='create-service', user=req.user['username'], authorized=False)
             title = _(f"You cannot register a new service.")
             description = _(f"Only site administrators are allowed to register new services.")
             raise falcon.HTTPUnauthorized(title, description)
 
-        service = Service(name=req.media.get('name'), description=req.media.get('description'))
+        service = Service(name=req.media.get('name'), description=req.media.get('description'),
+                          heartbeat_interval=req.media.get('heartbeat_interval'))
         self.db.add(service)
 
         try:
@@ -252,8 +796,10 @@ class ServicesRoute(object):
         except IntegrityError:
             self.db.rollback()
 
-            logger.audit(f"User {req.user['username']} attempted to replace the existing "
-                         f"'{service.name}' service")
+            logger.audit("User %s attempted to replace the existing '%s' service",
+                         req.user['username'], service.name,
+                         action='create-service', user=req.user['username'], service=service.slug,
+                         authorized=True, succeeded=False)
 
             title = _(f"A service with the slug '{service.slug}' already exists.")
             description = _("You can create a new service with a different slug/name, or update "
@@ -261,7 +807,9 @@ class ServicesRoute(object):
                             "PUT.")
             raise falcon.HTTPBadRequest(title, description)
         else:
-            logger.audit(f"User {req.user['username']} created the '{service.name}' service")
+            logger.audit("User %s created the '%s' service", req.user['username'], service.name,
+                         action='create-service', user=req.user['username'], service=service.slug,
+                         authorized=True)
 
         resp.media = service_to_dict(service)
         resp.status = falcon.HTTP_CREATED
@@ -271,37 +819,18 @@ class ServicesRoute(object):
 class ServiceRoute(object):
     def on_get(self, req, resp, service_slug):
         try:
-            service = self.db.query(Service).filter(Service.slug == service_slug).one()
+            service = get_service(self.db, service_slug)
         except NoResultFound:
             self.db.rollback()
             raise falcon.HTTPNotFound()
 
         resp.media = service_to_dict(service)
 
-    @jsonschema.validate({
-        "$schema": "http://json-schema.org/draft-06/schema#",
-        "title": "Service",
-        "description": "Update a registered service",
-        "type": "object",
-        "properties": {
-            "name": {
-                "type": "string",
-                "minLength": 4,
-            },
-            # Consider allowing descriptions with <20 characters, because services may be very
-            # obvious to the most casual observer, so an enforced description isn't necessarily
-            # helpful.
-            "description": {
-                "type": "string",
-                "minLength": 20,
-            }
-        },
-        "required": ["name", "description"],
-    })
+    @validate(SERVICE_SCHEMA)
     @authenticate(landing_page_auth | status_page_human_auth)
     def on_put(self, req, resp, service_slug):
         try:
-            service = self.db.query(Service).filter(Service.slug == service_slug).one()
+            service = get_service(self.db, service_slug)
         except NoResultFound:
             self.db.rollback()
             resp.status = HTTP_BAD_REQUEST
@@ -311,19 +840,16 @@ class ServiceRoute(object):
             }
 
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
+        if not is_site_admin(req.user['username']):
             # Only let site admins and service admins modify services
             try:
-                self.db.query(Permission)\
-                    .join(Service, Service.id == Permission.service_id)\
-                    .filter(Service.slug == service_slug,
-                            Permission.type == 'service-admin',
-                            Permission.username == req.user['username'])\
-                    .one()
+                get_user_permission(self.db, service_slug, req.user['username'])
             except NoResultFound:
-                logger.audit(f"Unauthorized: user {req.user['username']} attempted to update the "
-                             f"'{service.name}' service but is not a site admin or a service "
-                             "admin for it")
+                logger.audit("Unauthorized: user %s attempted to update the '%s' service but is "
+                             "not a site admin or a service admin for it",
+                             req.user['username'], service.name,
+                             action='update-service', user=req.user['username'],
+                             service=service_slug, authorized=False)
 
                 title = _(f"You cannot modify the metadata of this service.")
                 description = _(f"Only site administrators and service administrators are allowed "
@@ -332,6 +858,7 @@ class ServiceRoute(object):
 
         service.name = req.media.get('name')
         service.description = req.media.get('description')
+        service.heartbeat_interval = req.media.get('heartbeat_interval')
 
         self.db.add(service)
 
@@ -341,31 +868,15 @@ class ServiceRoute(object):
             self.db.rollback()
             raise
         else:
+            # Historical status responses include the service's name
+            history_cache.clear()
             resp.media = service_to_dict(service)
 
-    @jsonschema.validate({
-        "$schema": "http://json-schema.org/draft-06/schema#",
-        "title": "Service",
-        "description": "Update an attribute of a registered service",
-        "type": "object",
-        "properties": {
-            "name": {
-                "type": "string",
-                "minLength": 4,
-            },
-            # Consider allowing descriptions with <20 characters, because services may be very
-            # obvious to the most casual observer, so an enforced description isn't necessarily
-            # helpful.
-            "description": {
-                "type": "string",
-                "minLength": 20,
-            }
-        },
-    })
+    @validate(SERVICE_PATCH_SCHEMA)
     @authenticate(landing_page_auth | status_page_human_auth)
     def on_patch(self, req, resp, service_slug):
         try:
-            service = self.db.query(Service).filter(Service.slug == service_slug).one()
+            service = get_service(self.db, service_slug)
         except NoResultFound:
             self.db.rollback()
             resp.status = falcon.HTTP_BAD_REQUEST
@@ -376,19 +887,16 @@ class ServiceRoute(object):
             return
 
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
+        if not is_site_admin(req.user['username']):
             # Only let site admins and service admins modify services
             try:
-                self.db.query(Permission)\
-                    .join(Service, Service.id == Permission.service_id)\
-                    .filter(Service.slug == service_slug,
-                            Permission.type == 'service-admin',
-                            Permission.username == req.user['username'])\
-                    .one()
+                get_user_permission(self.db, service_slug, req.user['username'])
             except NoResultFound:
-                logger.audit(f"Unauthorized: user {req.user['username']} attempted to update the "
-                             f"'{service.name}' service but is not a site admin or a service "
-                             "admin for it")
+                logger.audit("Unauthorized: user %s attempted to update the '%s' service but is "
+                             "not a site admin or a service admin for it",
+                             req.user['username'], service.name,
+                             action='update-service', user=req.user['username'],
+                             service=service_slug, authorized=False)
 
                 title = _(f"You cannot modify the metadata of this service.")
                 description = _(f"Only site administrators and service administrators are allowed "
@@ -401,6 +909,10 @@ class ServiceRoute(object):
         if req.media.get('description') is not None:
             service.description = req.media.get('description')
 
+        # null turns heartbeats off, so only leave it alone when it's missing
+        if 'heartbeat_interval' in req.media:
+            service.heartbeat_interval = req.media['heartbeat_interval']
+
         self.db.add(service)
 
         try:
@@ -409,27 +921,33 @@ class ServiceRoute(object):
             self.db.rollback()
             raise
         else:
+            # Historical status responses include the service's name
+            history_cache.clear()
             resp.media = service_to_dict(service)
 
     @authenticate(landing_page_auth | status_page_human_auth)
     def on_delete(self, req, resp, service_slug):
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
-            logger.audit(f"Unauthorized: user {req.user['username']} attempted to delete the "
-                         f"'{service_slug}' service but is not a site admin")
+        if not is_site_admin(req.user['username']):
+            logger.audit("Unauthorized: user %s attempted to delete the '%s' service but is not a "
+                         "site admin", req.user['username'], service_slug,
+                         action='delete-service', user=req.user['username'], service=service_slug,
+                         authorized=False)
 
             title = _(f"Only site admins can remove services.")
             description = _(f"Only site administrators can remove services.")
             raise falcon.HTTPUnauthorized(title, description)
 
         try:
-            service = self.db.query(Service).filter(Service.slug == service_slug).one()
+            service = get_service(self.db, service_slug)
         except NoResultFound:
             # If the user asked to delete a service that doesn't actually exist, just move on
             self.db.rollback()
 
-            logger.audit(f"User {req.user['username']} attempted to delete a non-existent "
-                         f"'{service_slug}' service")
+            logger.audit("User %s attempted to delete a non-existent '%s' service",
+                         req.user['username'], service_slug,
+                         action='delete-service', user=req.user['username'], service=service_slug,
+                         authorized=True, succeeded=False)
 
             resp.location = "/services"
         else:
@@ -437,38 +955,43 @@ class ServiceRoute(object):
             service_name = service.name
 
             self.db.commit()
-            logger.audit(f"User {req.user['username']} deleted the '{service_name}' service")
+            history_cache.clear()
+            logger.audit("User %s deleted the '%s' service", req.user['username'], service_name,
+                         action='delete-service', user=req.user['username'], service=service_slug,
+                         authorized=True)
 
             resp.location = "/services"
 
 
 class ServiceStatusRoute(object):
+    def on_options(self, req, resp, service_slug):
+        resp.media = STATUS_OPTIONS
+
+    @coalesce()
+    @cache_history()
+    @stale_while_revalidate()
     def on_get(self, req, resp, service_slug):
         try:
-            self.db.query(Service).filter(Service.slug == service_slug).one()
+            get_service(self.db, service_slug)
         except NoResultFound as e:
             title = _(f"Service '{service_slug}' does not exist")
             description = _("You must specify a slug for a service that exists. Go to /services "
                             "for a list of services and their slugs.")
             raise falcon.HTTPBadRequest(title, description)
 
-        last_up_query = self.db.query(Event)\
-            .join(Service)\
-            .filter(Service.slug == service_slug,
-                    Event.status == 'up')\
-            .order_by(Event.when.desc())\
-            .limit(1)
+        limit, since, at = get_status_window(req)
 
-        relevant_events = self.db.query(Event)\
-            .join(Service)\
-            .filter(Service.slug == service_slug,
-                    last_up_query.subquery('last_up_query').c.when <= Event.when)\
-            .order_by(Event.when.desc())
+        rows = service_status_events(self.db, service_slug, limit, since=since, at=at)
+        relevant_events = [event for event, truncated, start in rows]
 
         try:
-            event_status = relevant_events[0].status
+            newest, truncated, start = rows[0]
         except IndexError:
             event_status = None
+            marker = {"truncated": False}
+        else:
+            event_status = newest.status
+            marker = status_window_marker(service_slug, limit, truncated, start, newest.when)
 
         resp.media = dict(
             **{
@@ -478,153 +1001,285 @@ class ServiceStatusRoute(object):
                 "status": event_status,
                 "events": [event_to_dict(event) for event in relevant_events],
             },
+            **marker,
         )
 
 
-class EventsRoute(object):
-    ALLOWED_ORDERING_COLUMNS = ('service_id', 'when', 'status', 'informational')
+class SubscriptionRoute(object):
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_get(self, req, resp, service_slug):
+        try:
+            subscription = self.db.query(EphemeralNotification)\
+                .join(Service)\
+                .filter(Service.slug == service_slug,
+                        EphemeralNotification.username == req.user['username'])\
+                .one()
+        except NoResultFound:
+            title = _(f"You are not subscribed to the '{service_slug}' service")
+            description = _("You can subscribe to a service with an HTTP PUT to this URL.")
+            raise falcon.HTTPNotFound(title, description)
 
-    def on_options(self, req, resp, service_slug):
-        resp.media = {
-            "q": {
-                "type": "string",
-                "description": _("Search event descriptions"),
-            },
-            "status": {
-                "type": "string",
-                "enum": ["up", "down"],  # Also "limited", but we don't expose that yet
-                "description": _("Search by status"),
-            },
-            "informational": {
+        resp.media = subscription_to_dict(subscription)
+
+    @validate({
+        "$schema": "http://json-schema.org/draft-06/schema#",
+        "title": "Subscription",
+        "description": "Get notified once, the next time this service changes status",
+        "type": "object",
+        "properties": {
+            "chat": {
                 "type": "boolean",
-                "description": _("Search by informational status"),
-            },
-            "after": {
-                "type": "string",
-                "format": "date-time",
-                "description": _("Search for events after this datetime"),
-            },
-            "before": {
-                "type": "string",
-                "format": "date-time",
-                "description": _("Search for events before this datetime"),
             },
-            "order_by": {
-                "type": "string",
-                "enum": EventsRoute.ALLOWED_ORDERING_COLUMNS,
-                "description": _("Order results by different columns. Prepend with '-' "
-                                 "to order by descending."),
+            "email": {
+                "type": "boolean",
             },
-        }
+        },
+        "required": ["chat", "email"],
+    })
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_put(self, req, resp, service_slug):
+        try:
+            service = get_service(self.db, service_slug)
+        except NoResultFound:
+            title = _(f"Service '{service_slug}' does not exist")
+            description = _("You must specify a slug for a service that exists. Go to /services "
+                            "for a list of services and their slugs.")
+            raise falcon.HTTPBadRequest(title, description)
 
-    def on_get(self, req, resp, service_slug):
-        page_number = req.get_param_as_int('page', min=1)
+        if not (req.media.get('chat') or req.media.get('email')):
+            title = _("You must subscribe to at least one notification channel")
+            description = _("Set 'chat', 'email', or both to true. To unsubscribe, use an HTTP "
+                            "DELETE instead.")
+            raise falcon.HTTPBadRequest(title, description)
 
-        # search_query = req.get_param('q')
+        try:
+            subscription = self.db.query(EphemeralNotification)\
+                .filter(EphemeralNotification.service_id == service.id,
+                        EphemeralNotification.username == req.user['username'])\
+                .one()
+        except NoResultFound:
+            subscription = EphemeralNotification(service=service, username=req.user['username'])
+        else:
+            # Even when nothing else changes, so a notification being sent right now doesn't
+            # consume the renewed subscription
+            subscription.version = EphemeralNotification.version + 1
 
-        status = req.get_param('status')
-        informational = req.get_param_as_bool('informational')
-        after = req.get_param_as_datetime('after')
-        before = req.get_param_as_datetime('before')
+        subscription.chat = req.media.get('chat')
+        subscription.email = req.media.get('email')
 
-        order_bys = req.get_param_as_list('order_by')
+        self.db.add(subscription)
+        self.db.commit()
 
-        # self.events.search(slug=service_slug, status=status, informational=informational, after=after, before=before, order_bys=order_bys)
-        q = self.db.query(Event).join(Service).filter(Service.slug == service_slug)
+        logger.audit("User %s subscribed to the '%s' service", req.user['username'], service.name,
+                     action='subscribe', user=req.user['username'], service=service_slug,
+                     authorized=True)
 
-        # TODO: Implement full-text search
-        # if search_query is not None:
-        #     q = q.filter(Event.description.)
+        resp.media = subscription_to_dict(subscription)
 
-        if status is not None:
-            q = q.filter(Event.status == status)
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_delete(self, req, resp, service_slug):
+        self.db.query(EphemeralNotification)\
+            .filter(EphemeralNotification.username == req.user['username'],
+                    EphemeralNotification.service_id.in_(
+                        self.db.query(Service.id).filter(Service.slug == service_slug).subquery()))\
+            .delete(synchronize_session=False)
+        self.db.commit()
 
-        if informational is not None:
-            q = q.filter(Event.informational == informational)
+        logger.audit("User %s unsubscribed from the '%s' service", req.user['username'],
+                     service_slug,
+                     action='unsubscribe', user=req.user['username'], service=service_slug,
+                     authorized=True)
 
-        if after is not None:
-            q = q.filter(Event.when > after)
+        resp.location = f"/services/{service_slug}"
 
-        if before is not None:
-            q = q.filter(Event.when < before)
 
-        # Special processing for extra because we want to allow JSONPath-ish strings
-        for param, extra_value in req.params.items():
-            if param.startswith('extra.'):
-                extra = param[6:] if param.startswith('extra.') else param
+EVENT_ORDERING_COLUMNS = ('service_id', 'when', 'status', 'informational')
 
-                if extra.endswith(':exists'):
-                    # Do a has_key instead
-                    extra = extra[:-7]
-                    extra_value = None
 
-                q = generate_jsonb_query(query=q, column=Event.extra, jsonpath=extra, value=extra_value)
+def filter_events(db, req, service_slug):
+    """
+    The events of a service, filtered and ordered by the query parameters of `req`
 
-        if order_bys is not None:
-            # Use an ordered dictionary so specifying the same key twice doesn't confuse things
-            order_bys_dict = OrderedDict()
-            for order_by_string in order_bys:
-                if order_by_string.startswith('-'):
-                    column_name = order_by_string[1:]
-                    descending = True
-                else:
-                    column_name = order_by_string
-                    descending = False
+    This is shared by everything that lists events, so they all accept the same parameters.
+    """
+    # search_query = req.get_param('q')
 
-                if column_name not in EventsRoute.ALLOWED_ORDERING_COLUMNS:
-                    title = _(f"Unknown ordering column name '{column_name}'")
-                    description = _("You can only order events by these columns "
-                                    f"{', '.join(EventsRoute.ALLOWED_ORDERING_COLUMNS)}. To use "
-                                    "descending order, prepend a dash in front of the column name.")
-                    raise falcon.HTTPBadRequest(title, description)
+    status = req.get_param('status')
+    informational = req.get_param_as_bool('informational')
+    after = req.get_param_as_datetime('after')
+    before = req.get_param_as_datetime('before')
+    since = get_param_as_precise_datetime(req, 'since')
+    until = get_param_as_precise_datetime(req, 'until')
 
-                column = getattr(Event, column_name)
+    order_bys = req.get_param_as_list('order_by')
 
-                order_bys_dict[column_name] = column.desc() if descending else column.asc()
-        else:
-            order_bys_dict = OrderedDict(when=Event.when.desc())
+    # self.events.search(slug=service_slug, status=status, informational=informational, after=after, before=before, order_bys=order_bys)
+    q = db.query(Event).join(Service).filter(Service.slug == service_slug)
 
-        page = paginate(
-            q.order_by(*order_bys_dict.values()), page_number, 20,
-            path=req.path,
-            params=req.params,
-            # Combine two dictionaries: https://stackoverflow.com/a/26853961
-            convert_items_callback=lambda obj: {
-                **obj_to_dict(obj, exclude_attrs=['service_id']),
-                **{
-                    "url": f"/services/{service_slug}/events/{obj.id}",
-                    "service": f"/services/{service_slug}",
-                }
-            })
+    # TODO: Implement full-text search
+    # if search_query is not None:
+    #     q = q.filter(Event.description.)
 
-        resp.media = obj_to_dict(page)
+    if status is not None:
+        q = q.filter(Event.status == status)
 
-    @jsonschema.validate({
-        "$schema": "http:/json-schema.org/draft-06/schema#",
-        "title": "Event",
-        "description": "Report an event for a registered service.",
-        "type": "object",
-        "properties": {
-            "status": {
+    if informational is not None:
+        q = q.filter(Event.informational == informational)
+
+    if after is not None:
+        q = q.filter(Event.when > after)
+
+    if before is not None:
+        q = q.filter(Event.when < before)
+
+    if since is not None:
+        q = q.filter(Event.when >= since)
+
+    if until is not None:
+        q = q.filter(Event.when <= until)
+
+    # Special processing for extra because we want to allow JSONPath-ish strings
+    for param, extra_value in req.params.items():
+        if param.startswith('extra.'):
+            extra = param[6:] if param.startswith('extra.') else param
+
+            if extra.endswith(':exists'):
+                # Do a has_key instead
+                extra = extra[:-7]
+                extra_value = None
+
+            q = generate_jsonb_query(query=q, column=Event.extra, jsonpath=extra, value=extra_value)
+
+    if order_bys is not None:
+        # Use an ordered dictionary so specifying the same key twice doesn't confuse things
+        order_bys_dict = OrderedDict()
+        for order_by_string in order_bys:
+            if order_by_string.startswith('-'):
+                column_name = order_by_string[1:]
+                descending = True
+            else:
+                column_name = order_by_string
+                descending = False
+
+            if column_name not in EVENT_ORDERING_COLUMNS:
+                title = _(f"Unknown ordering column name '{column_name}'")
+                description = _("You can only order events by these columns "
+                                f"{', '.join(EVENT_ORDERING_COLUMNS)}. To use "
+                                "descending order, prepend a dash in front of the column name.")
+                raise falcon.HTTPBadRequest(title, description)
+
+            column = getattr(Event, column_name)
+
+            order_bys_dict[column_name] = column.desc() if descending else column.asc()
+    else:
+        order_bys_dict = OrderedDict(when=Event.when.desc())
+
+    return q.order_by(*order_bys_dict.values())
+
+
+class EventsRoute(object):
+    ALLOWED_ORDERING_COLUMNS = EVENT_ORDERING_COLUMNS
+
+    # Recording events is what the status page is for, it's the last thing shed when overloaded
+    PRIORITY = {'POST': AdmissionController.HIGH}
+
+    # The fields of each result, and the columns they need
+    FIELDS = OrderedDict([
+        ('id', ()),
+        ('url', ()),
+        ('service', ()),
+        ('when', ('when',)),
+        ('status', ('status',)),
+        ('description', ('description',)),
+        ('informational', ('informational',)),
+        ('extra', ('extra',)),
+    ])
+
+    # The extra JSON can be large, so it's only loaded when asked for
+    DEFAULT_FIELDS = tuple(field for field in FIELDS if field != 'extra')
+
+    # Services can have a lot of events, counting them exactly costs as much as loading a page
+    COUNT = 'estimate'
+
+    def __init__(self, ingestor=None):
+        self.ingestor = ingestor if ingestor is not None else EventIngestor()
+
+    def on_options(self, req, resp, service_slug):
+        resp.media = {
+            "q": {
                 "type": "string",
-                "enum": ["up", "down"],
+                "description": _("Search event descriptions"),
             },
-            "description": {
+            "status": {
                 "type": "string",
+                "enum": ["up", "down"],  # Also "limited", but we don't expose that yet
+                "description": _("Search by status"),
             },
             "informational": {
                 "type": "boolean",
+                "description": _("Search by informational status"),
+            },
+            "after": {
+                "type": "string",
+                "format": "date-time",
+                "description": _("Search for events after this datetime"),
             },
-            "extra": {
-                "type": "object",
+            "before": {
+                "type": "string",
+                "format": "date-time",
+                "description": _("Search for events before this datetime"),
             },
-        },
-        "required": ["status", "description", "informational"],
-    })
+            "since": {
+                "type": "string",
+                "format": "date-time",
+                "description": _("Search for events at or after this datetime, which can have "
+                                 "fractional seconds, eg: 2018-01-01T00:00:00.250000Z"),
+            },
+            "until": {
+                "type": "string",
+                "format": "date-time",
+                "description": _("Search for events at or before this datetime, which can have "
+                                 "fractional seconds"),
+            },
+            "order_by": {
+                "type": "string",
+                "enum": EventsRoute.ALLOWED_ORDERING_COLUMNS,
+                "description": _("Order results by different columns. Prepend with '-' "
+                                 "to order by descending."),
+            },
+            "fields": fields_option(EventsRoute.FIELDS, EventsRoute.DEFAULT_FIELDS),
+            **PAGINATION_OPTIONS,
+        }
+
+    def on_get(self, req, resp, service_slug):
+        page_number = req.get_param_as_int('page', min_value=1)
+        page_size = get_page_size(req)
+        fields, only_columns = get_fields(req, EventsRoute.FIELDS, EventsRoute.DEFAULT_FIELDS)
+
+        q = filter_events(self.db, req, service_slug).options(only_columns)
+
+        page = paginate(
+            q, page_number, page_size,
+            path=req.path,
+            params=req.params,
+            # Combine two dictionaries: https://stackoverflow.com/a/26853961
+            convert_items_callback=only_fields(lambda obj: {
+                **obj_to_dict(obj, exclude_attrs=['service_id']),
+                **{
+                    "url": f"/services/{service_slug}/events/{obj.id}",
+                    "service": f"/services/{service_slug}",
+                }
+            }, fields),
+            count=get_count_strategy(req, self.COUNT))
+
+        resp.media = obj_to_dict(page)
+
+    @validate(EVENT_SCHEMA)
     @authenticate(landing_page_auth | status_page_human_auth | status_page_bot_auth)
+    @event_rate_limit()
     def on_post(self, req, resp, service_slug):
         try:
-            service = self.db.query(Service).filter(Service.slug == service_slug).one()
+            service = get_service(self.db, service_slug)
         except NoResultFound as e:
             title = _(f"Service '{service_slug}' does not exist")
             description = _("You must specify a slug for service that exists. Go to /services "
@@ -632,38 +1287,34 @@ class EventsRoute(object):
             raise falcon.HTTPBadRequest(title, description)
 
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
+        if not is_site_admin(req.user['username']):
             # Only let site admins, service admins, and/or updaters report events
             try:
-                self.db.query(Permission)\
-                    .join(Service, Service.id == Permission.service_id)\
-                    .filter(Service.slug == service_slug,
-                            Permission.type.in_(['service-admin', 'updater']),
-                            Permission.username == req.user['username'])\
-                    .one()
+                get_user_permission(self.db, service_slug, req.user['username'],
+                                    types=('service-admin', 'updater'))
             except NoResultFound:
-                logger.audit(f"Unauthorized: user {req.user['username']} attempted to log an "
-                             f"event for the '{service.name}' service but is not a site admin or "
-                             "a service admin or an updater for it")
+                logger.audit("Unauthorized: user %s attempted to log an event for the '%s' "
+                             "service but is not a site admin or a service admin or an updater "
+                             "for it", req.user['username'], service.name,
+                             action='create-event', user=req.user['username'],
+                             service=service_slug, authorized=False)
 
                 title = _(f"You cannot create events for this service.")
                 description = _(f"Only site administrators, service administrators, and updaters "
                                 "are allowed to report events for this service.")
                 raise falcon.HTTPUnauthorized(title, description)
 
-        event = Event(
-            service_id=service.id,
-            when=datetime.now(tz=pytz.UTC),
+        event = self.ingestor.record(
+            self.db, service,
             status=req.media.get('status'),
             description=req.media.get('description'),
             informational=req.media.get('informational'),
             extra=req.media.get('extra', {}))
 
-        self.db.add(event)
-        self.db.commit()
-
-        logger.audit(f"User {req.user['username']} logged an '{event.status}' event for the "
-                     f"'{service.name}' service")
+        logger.audit("User %s logged an '%s' event for the '%s' service",
+                     req.user['username'], event.status, service.name,
+                     action='create-event', user=req.user['username'], service=service_slug,
+                     event=event.id, status=event.status, authorized=True)
 
         resp.media = dict(
             **event_to_dict(event),
@@ -673,10 +1324,107 @@ class EventsRoute(object):
             })
 
 
+class EventsExportRoute(object):
+    FORMATS = OrderedDict([
+        ('ndjson', 'application/x-ndjson'),
+        ('csv', 'text/csv; charset=utf-8'),
+    ])
+
+    FIELDS = ('id', 'url', 'service', 'when', 'status', 'description', 'informational', 'extra')
+
+    def __init__(self, session_factory, batch_size=1000):
+        """
+        Stream the whole (filtered) event history of a service
+
+        `session_factory` - Creates the session used to stream the events, the request's own
+                            session is closed before the response body is sent
+        `batch_size` - How many events to fetch from the server-side cursor at once
+        """
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+
+    def on_options(self, req, resp, service_slug):
+        # Exports take the same parameters as the event listing, plus the format
+        EventsRoute.on_options(self, req, resp, service_slug)
+
+        for param in ('fields', 'page', 'page_size', 'count'):
+            resp.media.pop(param, None)
+
+        resp.media["format"] = {
+            "type": "string",
+            "enum": list(EventsExportRoute.FORMATS),
+            "description": _("The export format, newline delimited JSON (the default) or CSV. "
+                             "Send 'Accept-Encoding: gzip' to compress it."),
+        }
+
+    def on_get(self, req, resp, service_slug):
+        export_format = req.get_param('format') or 'ndjson'
+
+        if export_format not in EventsExportRoute.FORMATS:
+            title = _(f"Unknown export format '{export_format}'")
+            description = _("You can export events as "
+                            f"{', '.join(EventsExportRoute.FORMATS)}.")
+            raise falcon.HTTPBadRequest(title, description)
+
+        try:
+            get_service(self.db, service_slug)
+        except NoResultFound:
+            title = _(f"Service '{service_slug}' does not exist")
+            description = _("You must specify a slug for a service that exists. Go to /services "
+                            "for a list of services and their slugs.")
+            raise falcon.HTTPBadRequest(title, description)
+
+        # Build (and validate) the query now, so bad parameters still get a proper error response
+        # instead of a broken stream
+        q = filter_events(self.db, req, service_slug)\
+            .with_entities(Event.id, Event.when, Event.status, Event.description,
+                           Event.informational, Event.extra)
+
+        rows = self.stream_rows(q, service_slug)
+
+        if export_format == 'csv':
+            chunks = csv_chunks(rows, EventsExportRoute.FIELDS)
+        else:
+            chunks = ndjson_chunks(rows)
+
+        resp.append_header('Vary', 'Accept-Encoding')
+        if accepts_encoding(req.get_header('Accept-Encoding'), 'gzip'):
+            resp.set_header('Content-Encoding', 'gzip')
+            chunks = gzip_chunks(chunks)
+
+        resp.content_type = EventsExportRoute.FORMATS[export_format]
+        resp.set_header('Content-Disposition',
+                        f'attachment; filename="{service_slug}-events.{export_format}"')
+        resp.stream = chunks
+
+    def stream_rows(self, query, service_slug):
+        session = self.session_factory()
+
+        try:
+            # A server-side cursor, so neither the driver nor SQLAlchemy buffers every row
+            rows = query.with_session(session)\
+                .execution_options(stream_results=True)\
+                .yield_per(self.batch_size)
+
+            for row in rows:
+                yield {
+                    "id": str(row.id),
+                    "url": f"/services/{service_slug}/events/{row.id}",
+                    "service": f"/services/{service_slug}",
+                    "when": row.when.isoformat(),
+                    "status": row.status,
+                    "description": row.description,
+                    "informational": row.informational,
+                    "extra": row.extra,
+                }
+        finally:
+            session.close()
+
+
 class EventRoute(object):
     def on_get(self, req, resp, service_slug, event_id):
         try:
-            self.db.query(Service).filter(Service.slug == service_slug).one()
+            get_service(self.db, service_slug)
         except NoResultFound:
             title = _(f"Service '{service_slug}' does not exist")
             description = _("You must specify a slug for a service that exists. Go to /services "
@@ -691,7 +1439,7 @@ class EventRoute(object):
             raise falcon.HTTPBadRequest(title, description)
 
         try:
-            event = self.db.query(Event).join(Service).filter(Service.slug == service_slug, Event.id == event_id).one()
+            event = get_event(self.db, service_slug, event_id)
         except NoResultFound:
             title = _(f"Event with ID '{event_id}' does not exist for '{service_slug}' service")
             description = _("You must specify an event ID that exists. Go to "
@@ -702,23 +1450,414 @@ class EventRoute(object):
             resp.media = event_to_dict(event)
 
 
-class PermissionsRoute(object):
+INCIDENT_OPTIONS = {
+    "open": {
+        "type": "boolean",
+        "description": _("Only open incidents (true), or only closed ones (false)"),
+    },
+    "after": {
+        "type": "string",
+        "format": "date-time",
+        "description": _("Only incidents that started after this datetime"),
+    },
+    "before": {
+        "type": "string",
+        "format": "date-time",
+        "description": _("Only incidents that started before this datetime"),
+    },
+    **PAGINATION_OPTIONS,
+}
+
+# The most events included in an incident
+MAX_INCIDENT_EVENTS = MAX_PAGE_SIZE
+
+
+def filter_incidents(db, req):
+    """
+    Incidents filtered by the query parameters of `req`, newest first
+    """
+    is_open = req.get_param_as_bool('open')
+    after = req.get_param_as_datetime('after')
+    before = req.get_param_as_datetime('before')
+
+    # Every incident is converted with its service's slug, load them in the same query
+    q = db.query(Incident)\
+        .join(Incident.service)\
+        .options(contains_eager(Incident.service))
+
+    # Open incidents come from the partial index of just those
+    if is_open is True:
+        q = q.filter(Incident.ended_at.is_(None))
+    elif is_open is False:
+        q = q.filter(Incident.ended_at.isnot(None))
+
+    if after is not None:
+        q = q.filter(Incident.started_at > after)
+
+    if before is not None:
+        q = q.filter(Incident.started_at < before)
+
+    return q.order_by(Incident.started_at.desc())
+
+
+class IncidentsRoute(object):
+    # There are far fewer incidents than events
+    COUNT = 'exact'
+
+    def on_options(self, req, resp):
+        resp.media = INCIDENT_OPTIONS
+
+    @stale_while_revalidate()
+    def on_get(self, req, resp):
+        page_number = req.get_param_as_int('page', min_value=1)
+        page_size = get_page_size(req)
+
+        # The same "now" for the duration of every open incident
+        now = datetime.now(pytz.utc)
+
+        page = paginate(filter_incidents(self.db, req), page_number, page_size,
+                        path=req.path,
+                        params=req.params,
+                        convert_items_callback=lambda incident: incident_to_dict(incident, now),
+                        count=get_count_strategy(req, self.COUNT))
+
+        resp.media = obj_to_dict(page)
+
+
+class ServiceIncidentsRoute(object):
+    COUNT = IncidentsRoute.COUNT
+
     def on_options(self, req, resp, service_slug):
+        resp.media = INCIDENT_OPTIONS
+
+    def on_get(self, req, resp, service_slug):
+        try:
+            get_service(self.db, service_slug)
+        except NoResultFound:
+            title = _(f"Service '{service_slug}' does not exist")
+            description = _("You must specify a slug for a service that exists. Go to /services "
+                            "for a list of services and their slugs.")
+            raise falcon.HTTPBadRequest(title, description)
+
+        page_number = req.get_param_as_int('page', min_value=1)
+        page_size = get_page_size(req)
+
+        now = datetime.now(pytz.utc)
+
+        q = filter_incidents(self.db, req).filter(Service.slug == service_slug)
+
+        page = paginate(q, page_number, page_size,
+                        path=req.path,
+                        params=req.params,
+                        convert_items_callback=lambda incident: incident_to_dict(incident, now),
+                        count=get_count_strategy(req, self.COUNT))
+
+        resp.media = obj_to_dict(page)
+
+
+class IncidentRoute(object):
+    def on_get(self, req, resp, service_slug, incident_id):
+        try:
+            incident_id = uuid.UUID(incident_id)
+        except ValueError:
+            title = _(f"Couldn't parse UUID from '{incident_id}'")
+            description = _("Incident UUIDs must be in aaaabbbb-cccc-dddd-eeee-ffffgggghhh format")
+            raise falcon.HTTPBadRequest(title, description)
+
+        incident = self.db.query(Incident)\
+            .join(Incident.service)\
+            .options(contains_eager(Incident.service))\
+            .filter(Service.slug == service_slug, Incident.id == incident_id)\
+            .one_or_none()
+
+        if incident is None:
+            title = _(f"Incident with ID '{incident_id}' does not exist for '{service_slug}' "
+                      "service")
+            description = _("You must specify an incident ID that exists. Go to "
+                            f"/services/{service_slug}/incidents for a list of incidents for "
+                            "that service.")
+            raise falcon.HTTPNotFound(title, description)
+
+        # A range of the (service_id, when) index
+        q = self.db.query(Event)\
+            .filter(Event.service_id == incident.service_id, Event.when >= incident.started_at)
+
+        if incident.ended_at is not None:
+            q = q.filter(Event.when <= incident.ended_at)
+
+        events = q.order_by(Event.when.asc()).limit(MAX_INCIDENT_EVENTS + 1).all()
+
         resp.media = {
-            "page": {
-                "type": "number",
-                "description": _("Page to return"),
+            **incident_to_dict(incident),
+            "events": [event_to_dict(event) for event in events[:MAX_INCIDENT_EVENTS]],
+            "truncated": len(events) > MAX_INCIDENT_EVENTS,
+        }
+
+
+WEBHOOK_DELIVERY_OPTIONS = {
+    "state": {
+        "type": "string",
+        "enum": ["pending", "delivered", "dead"],
+        "description": _("Only deliveries in this state"),
+    },
+    **PAGINATION_OPTIONS,
+}
+
+
+def verify_can_manage_webhooks(req, action, **audit):
+    if not is_site_admin(req.user['username']):
+        logger.audit("Unauthorized: user %s attempted to %s a webhook but is not a site admin",
+                     req.user['username'], action.split('-')[0],
+                     action=action, user=req.user['username'], authorized=False, **audit)
+
+        title = _("You cannot manage webhooks.")
+        description = _("Only site administrators are allowed to manage webhooks.")
+        raise falcon.HTTPUnauthorized(title, description)
+
+
+def get_webhook(db, webhook_id):
+    try:
+        webhook_id = uuid.UUID(webhook_id)
+    except ValueError:
+        title = _(f"Couldn't parse UUID from '{webhook_id}'")
+        description = _("Webhook UUIDs must be in aaaabbbb-cccc-dddd-eeee-ffffgggghhh format")
+        raise falcon.HTTPBadRequest(title, description)
+
+    webhook = db.query(Webhook)\
+        .options(joinedload(Webhook.service), joinedload(Webhook.group))\
+        .filter(Webhook.id == webhook_id)\
+        .one_or_none()
+
+    if webhook is None:
+        title = _(f"Webhook with ID '{webhook_id}' does not exist")
+        description = _("You must specify a webhook ID that exists. Go to /webhooks for a list of "
+                        "webhooks.")
+        raise falcon.HTTPNotFound(title, description)
+
+    return webhook
+
+
+class WebhooksRoute(object):
+    COUNT = 'exact'
+
+    def on_options(self, req, resp):
+        resp.media = PAGINATION_OPTIONS
+
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_get(self, req, resp):
+        verify_can_manage_webhooks(req, 'view-webhooks')
+
+        page_number = req.get_param_as_int('page', min_value=1)
+        page_size = get_page_size(req)
+
+        webhooks = self.db.query(Webhook)\
+            .options(joinedload(Webhook.service), joinedload(Webhook.group))\
+            .order_by(Webhook.endpoint, Webhook.id)
+
+        page = paginate(webhooks, page_number, page_size,
+                        path=req.path,
+                        params=req.params,
+                        convert_items_callback=webhook_to_dict,
+                        count=get_count_strategy(req, self.COUNT))
+
+        resp.media = obj_to_dict(page)
+
+    @validate({
+        "$schema": "http://json-schema.org/draft-06/schema#",
+        "title": "Webhook",
+        "description": "Send the events of a service, or of every service in a group, to an "
+                       "endpoint",
+        "type": "object",
+        "properties": {
+            "endpoint": {
+                "type": "string",
+                "pattern": "^https?://",
+            },
+            "service": {
+                "type": "string",
+            },
+            "group": {
+                "type": "string",
+            },
+            # Payloads are signed with it
+            "secret": {
+                "type": "string",
+                "minLength": 16,
+            },
+            "changes_only": {
+                "type": "boolean",
             },
+        },
+        "required": ["endpoint"],
+        "oneOf": [
+            {"required": ["service"]},
+            {"required": ["group"]},
+        ],
+    })
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_post(self, req, resp):
+        verify_can_manage_webhooks(req, 'create-webhook', endpoint=req.media.get('endpoint'))
+
+        webhook = Webhook(endpoint=req.media.get('endpoint'),
+                          secret=req.media.get('secret'),
+                          changes_only=req.media.get('changes_only', True),
+                          created_by=req.user['username'])
+
+        if 'service' in req.media:
+            try:
+                webhook.service = get_service(self.db, req.media['service'])
+            except NoResultFound:
+                title = _(f"Service '{req.media['service']}' does not exist")
+                description = _("You must specify a slug for a service that exists. Go to "
+                                "/services for a list of services and their slugs.")
+                raise falcon.HTTPBadRequest(title, description)
+        else:
+            webhook.group = self.db.query(ServiceGroup)\
+                .filter(ServiceGroup.slug == req.media['group'])\
+                .one_or_none()
+
+            if webhook.group is None:
+                title = _(f"Service group '{req.media['group']}' does not exist")
+                description = _("You must specify a slug for a service group that exists.")
+                raise falcon.HTTPBadRequest(title, description)
+
+        self.db.add(webhook)
+        self.db.commit()
+
+        logger.audit("User %s created a webhook to %s for %s", req.user['username'],
+                     webhook.endpoint, req.media.get('service') or req.media.get('group'),
+                     action='create-webhook', user=req.user['username'], webhook=webhook.id,
+                     endpoint=webhook.endpoint, authorized=True)
+
+        resp.media = webhook_to_dict(webhook)
+        resp.status = falcon.HTTP_CREATED
+        resp.location = f"/webhooks/{webhook.id}"
+
+
+class WebhookRoute(object):
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_get(self, req, resp, webhook_id):
+        verify_can_manage_webhooks(req, 'view-webhook', webhook=webhook_id)
+
+        resp.media = webhook_to_dict(get_webhook(self.db, webhook_id))
+
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_delete(self, req, resp, webhook_id):
+        verify_can_manage_webhooks(req, 'delete-webhook', webhook=webhook_id)
+
+        webhook = get_webhook(self.db, webhook_id)
+
+        # The database deletes its deliveries
+        self.db.delete(webhook)
+        self.db.commit()
+
+        logger.audit("User %s deleted the webhook to %s", req.user['username'], webhook.endpoint,
+                     action='delete-webhook', user=req.user['username'], webhook=webhook.id,
+                     endpoint=webhook.endpoint, authorized=True)
+
+        resp.location = "/webhooks"
+
+
+class WebhookDeliveriesRoute(object):
+    COUNT = 'exact'
+
+    def on_options(self, req, resp, webhook_id):
+        resp.media = WEBHOOK_DELIVERY_OPTIONS
+
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_get(self, req, resp, webhook_id):
+        verify_can_manage_webhooks(req, 'view-webhook', webhook=webhook_id)
+
+        webhook = get_webhook(self.db, webhook_id)
+
+        state = req.get_param('state')
+        if state is not None and state not in WEBHOOK_DELIVERY_OPTIONS['state']['enum']:
+            title = _(f"Invalid delivery state '{state}'")
+            description = _("You can choose from these states: "
+                            f"{', '.join(WEBHOOK_DELIVERY_OPTIONS['state']['enum'])}")
+            raise falcon.HTTPBadRequest(title, description)
+
+        page_number = req.get_param_as_int('page', min_value=1)
+        page_size = get_page_size(req)
+
+        # Every delivery is converted with the slug of its event's service
+        deliveries = self.db.query(WebhookDelivery)\
+            .join(WebhookDelivery.event)\
+            .join(Event.service)\
+            .options(contains_eager(WebhookDelivery.event).contains_eager(Event.service))\
+            .filter(WebhookDelivery.webhook_id == webhook.id)
+
+        if state is not None:
+            deliveries = deliveries.filter(WebhookDelivery.state == state)
+
+        # The ix_webhook_deliveries_webhook_id_created_at index, newest first
+        page = paginate(deliveries.order_by(WebhookDelivery.created_at.desc()),
+                        page_number, page_size,
+                        path=req.path,
+                        params=req.params,
+                        convert_items_callback=webhook_delivery_to_dict,
+                        count=get_count_strategy(req, self.COUNT))
+
+        resp.media = obj_to_dict(page)
+
+
+class WebhookRedeliverRoute(object):
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_post(self, req, resp, webhook_id):
+        """
+        Send the dead-lettered deliveries of a webhook again
+        """
+        verify_can_manage_webhooks(req, 'redeliver-webhook', webhook=webhook_id)
+
+        webhook = get_webhook(self.db, webhook_id)
+
+        redelivered = self.db.query(WebhookDelivery)\
+            .filter(WebhookDelivery.webhook_id == webhook.id, WebhookDelivery.state == 'dead')\
+            .update({
+                WebhookDelivery.state: 'pending',
+                WebhookDelivery.attempts: 0,
+                WebhookDelivery.next_attempt_at: func.now(),
+            }, synchronize_session=False)
+        self.db.commit()
+
+        logger.audit("User %s redelivered %d dead-lettered deliveries to %s",
+                     req.user['username'], redelivered, webhook.endpoint,
+                     action='redeliver-webhook', user=req.user['username'], webhook=webhook.id,
+                     deliveries=redelivered, authorized=True)
+
+        resp.media = {
+            "webhook": f"/webhooks/{webhook.id}",
+            "redelivered": redelivered,
+        }
+
+
+class PermissionsRoute(object):
+    # The fields of each result, and the columns they need
+    FIELDS = OrderedDict([
+        ('id', ()),
+        ('url', ()),
+        ('service', ()),
+        ('username', ('username',)),
+        ('type', ('type',)),
+    ])
+
+    # How results are counted, unless the request asks otherwise
+    COUNT = 'exact'
+
+    def on_options(self, req, resp, service_slug):
+        resp.media = {
             "user": {
                 "type": "string",
                 "description": _("Search by username"),
             },
+            "fields": fields_option(PermissionsRoute.FIELDS, PermissionsRoute.FIELDS),
+            **PAGINATION_OPTIONS,
         }
 
     @authenticate(landing_page_auth | status_page_human_auth)
     def on_get(self, req, resp, service_slug):
         try:
-            self.db.query(Service).filter(Service.slug == service_slug).one()
+            get_service(self.db, service_slug)
         except NoResultFound as e:
             title = _(f"Service '{service_slug}' does not exist")
             description = _("You must specify a slug for a service that exists. Go to /services "
@@ -730,15 +1869,10 @@ class PermissionsRoute(object):
             .filter(Service.slug == service_slug)
 
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
+        if not is_site_admin(req.user['username']):
             # Check that they are a service admin
             try:
-                self.db.query(Permission)\
-                    .join(Service, Service.id == Permission.service_id)\
-                    .filter(Service.slug == service_slug,
-                            Permission.type == 'service-admin',
-                            Permission.username == req.user['username'])\
-                    .one()
+                get_user_permission(self.db, service_slug, req.user['username'])
             except NoResultFound:
                 # If they aren't a service admin, they are only allowed to view their own permissions
                 # title = _(f"You cannot view the permissions of other users.")
@@ -748,16 +1882,21 @@ class PermissionsRoute(object):
                 permissions = permissions.filter(Permission.username == req.user['username'])
 
         page_number = req.get_param_as_int('page')
+        page_size = get_page_size(req)
+        fields, only_columns = get_fields(req, PermissionsRoute.FIELDS, PermissionsRoute.FIELDS,
+                                          required=('service_id',))
 
         page = paginate(
-            permissions.order_by(Service.name, Permission.username), page_number, 20,
+            permissions.options(only_columns).order_by(Service.name, Permission.username),
+            page_number, page_size,
             path=req.path,
             params=req.params,
-            convert_items_callback=permission_to_dict)
+            convert_items_callback=only_fields(permission_to_dict, fields),
+            count=get_count_strategy(req, self.COUNT))
 
         resp.media = obj_to_dict(page)
 
-    @jsonschema.validate({
+    @validate({
         "$schema": "http://json-schema.org/draft-06/schema#",
         "title": "Create a permission",
         "description": "Grant a user a specific permission level for a service",
@@ -776,7 +1915,7 @@ class PermissionsRoute(object):
     @authenticate(landing_page_auth | status_page_human_auth)
     def on_post(self, req, resp, service_slug):
         try:
-            service = self.db.query(Service).filter(Service.slug == service_slug).one()
+            service = get_service(self.db, service_slug)
         except NoResultFound as e:
             title = _(f"Service '{service_slug}' does not exist")
             description = _("You must specify a slug for a service that exists. Go to /services "
@@ -784,20 +1923,18 @@ class PermissionsRoute(object):
             raise falcon.HTTPBadRequest(title, description)
 
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
+        if not is_site_admin(req.user['username']):
             # Only let the user view their own permissions
             try:
-                self.db.query(Permission)\
-                    .join(Service, Service.id == Permission.service_id)\
-                    .filter(Service.slug == service_slug,
-                            Permission.type == 'service-admin',
-                            Permission.username == req.user['username'])\
-                    .one()
+                get_user_permission(self.db, service_slug, req.user['username'])
             except NoResultFound:
-                logger.audit(f"Unauthorized: user {req.user['username']} attempted to grant a "
-                             f"'{req.media.get('type')}' permission for the '{service.name}' "
-                             f"service to {req.media.get('username')} but is not a site "
-                             "admin or a service admin for it")
+                logger.audit("Unauthorized: user %s attempted to grant a '%s' permission for the "
+                             "'%s' service to %s but is not a site admin or a service admin for "
+                             "it", req.user['username'], req.media.get('type'), service.name,
+                             req.media.get('username'),
+                             action='grant-permission', user=req.user['username'],
+                             service=service_slug, grantee=req.media.get('username'),
+                             permission_type=req.media.get('type'), authorized=False)
 
                 title = _(f"You cannot add the permissions of another user.")
                 description = _(f"Only site administrators and service administrators are allowed "
@@ -812,8 +1949,12 @@ class PermissionsRoute(object):
         self.db.add(permission)
         self.db.commit()
 
-        logger.audit(f"User {req.user['username']} granted '{permission.type}' permission for the "
-                     f"'{service.name}' service to '{req.media.get('username')}' ")
+        logger.audit("User %s granted '%s' permission for the '%s' service to '%s'",
+                     req.user['username'], permission.type, service.name,
+                     req.media.get('username'),
+                     action='grant-permission', user=req.user['username'], service=service_slug,
+                     grantee=req.media.get('username'), permission_type=permission.type,
+                     permission=permission.id, authorized=True)
 
         resp.media = permission_to_dict(permission)
 
@@ -826,7 +1967,7 @@ class PermissionRoute(object):
     def on_get(self, req, resp, service_slug, permission_id):
         try:
             # service = self.services.get_by_slug(service_slug)
-            self.db.query(Service).filter(Service.slug == service_slug).one()
+            get_service(self.db, service_slug)
         except NoResultFound as e:
             title = _(f"Service '{service_slug}' does not exist")
             description = _("You must specify a slug for a service that exists. Go to /services "
@@ -841,18 +1982,15 @@ class PermissionRoute(object):
             raise falcon.HTTPBadRequest(title, description)
 
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
+        if not is_site_admin(req.user['username']):
             # Only let the user view their own permissions
             try:
-                self.db.query(Permission)\
-                    .join(Service, Service.id == Permission.service_id)\
-                    .filter(Service.slug == service_slug,
-                            Permission.type == 'service-admin',
-                            Permission.username == req.user['username'])\
-                    .one()
+                get_user_permission(self.db, service_slug, req.user['username'])
             except NoResultFound:
-                logger.audit(f"Unauthorized: user {req.user['username']} attempted to view a "
-                             "permission for another user but is not a site admin")
+                logger.audit("Unauthorized: user %s attempted to view a permission for another "
+                             "user but is not a site admin", req.user['username'],
+                             action='view-permission', user=req.user['username'],
+                             service=service_slug, permission=permission_id, authorized=False)
 
                 title = _(f"You cannot view the permissions of another user.")
                 description = _(f"Only site administrators and service administrators are allowed "
@@ -879,7 +2017,7 @@ class PermissionRoute(object):
     @authenticate(landing_page_auth | status_page_human_auth)
     def on_delete(self, req, resp, service_slug, permission_id):
         try:
-            self.db.query(Service).filter(Service.slug == service_slug).one()
+            get_service(self.db, service_slug)
         except NoResultFound as e:
             title = _(f"Service '{service_slug}' does not exist")
             description = _("You must specify a slug for a service that exists. Go to /services "
@@ -894,21 +2032,17 @@ class PermissionRoute(object):
             raise falcon.HTTPBadRequest(title, description)
 
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
+        if not is_site_admin(req.user['username']):
             # Only let the user remove their own permissions
             try:
-                self.db.query(Permission)\
-                    .join(Service, Service.id == Permission.service_id)\
-                    .filter(Service.slug == service_slug,
-                            Permission.type == 'service-admin',
-                            Permission.username == req.user['username'])\
-                    .one()
+                get_user_permission(self.db, service_slug, req.user['username'])
             except NoResultFound:
-                logger.audit(f"Unauthorized: user {req.user['username']} attempted to revoke the "
-                             f"'{req.media.get('type')}' permission for the '{service.name}' "
-                             f"service from {req.media.get('username')} but "
-                             f"{req.user['username']} is not a site admin or a service admin for "
-                             "it")
+                logger.audit("Unauthorized: user %s attempted to revoke the '%s' permission for "
+                             "the '%s' service from %s but %s is not a site admin or a service "
+                             "admin for it", req.user['username'], req.media.get('type'),
+                             service.name, req.media.get('username'), req.user['username'],
+                             action='revoke-permission', user=req.user['username'],
+                             service=service_slug, permission=permission_id, authorized=False)
 
                 title = _(f"You cannot revoke the permissions of another user.")
                 description = _(f"Only site administrators and service administrators are allowed "
@@ -933,8 +2067,11 @@ class PermissionRoute(object):
             self.db.delete(permission)
             self.db.commit()
 
-            logger.audit(f"User {req.user['username']} revoked the '{permission.type}' permission "
-                         f"for the '{service.name}' service from '{req.media.get('username')}'")
+            logger.audit("User %s revoked the '%s' permission for the '%s' service from '%s'",
+                         req.user['username'], permission.type, service.name,
+                         req.media.get('username'),
+                         action='revoke-permission', user=req.user['username'],
+                         service=service_slug, permission=permission_id, authorized=True)
 
             resp.location = f"/services/{service_slug}/permissions"
 
@@ -951,11 +2088,13 @@ class UserPermissionsRoute(object):
     @authenticate(landing_page_auth | status_page_human_auth)
     def on_get(self, req, resp, username):
         # If the user is not a site admin
-        if req.user['username'] not in SITE_ADMINS:
+        if not is_site_admin(req.user['username']):
             # Only let the user view their own permissions
             if username != req.user['username']:
-                logger.audit(f"Unauthorized: user {req.user['username']} attempted to view the "
-                             f"permissions for {username} but is not a site admin")
+                logger.audit("Unauthorized: user %s attempted to view the permissions for %s but "
+                             "is not a site admin", req.user['username'], username,
+                             action='view-user-permissions', user=req.user['username'],
+                             subject=username, authorized=False)
 
                 title = _(f"You cannot view the permissions of another user.")
                 description = _(f"Only site administrators are allowed to view the permissions of "
@@ -989,8 +2128,140 @@ class UserPermissionsRoute(object):
         }
 
 
+class PreferencesRoute(object):
+    def check_user(self, req, username, action):
+        # If the user is not a site admin
+        if not is_site_admin(req.user['username']):
+            # Only let the user manage their own preferences
+            if username != req.user['username']:
+                logger.audit("Unauthorized: user %s attempted to %s the display preferences for "
+                             "%s but is not a site admin", req.user['username'], action, username,
+                             action=f'{action}-preferences', user=req.user['username'],
+                             subject=username, authorized=False)
+
+                title = _(f"You cannot {action} the display preferences of another user.")
+                description = _(f"Only site administrators are allowed to {action} the display "
+                                "preferences of other users.")
+                raise falcon.HTTPUnauthorized(title, description)
+
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_get(self, req, resp, username):
+        self.check_user(req, username, 'view')
+
+        try:
+            preferences = self.db.query(DisplayPreferences)\
+                .filter(DisplayPreferences.username == username)\
+                .one()
+        except NoResultFound:
+            title = _(f"User '{username}' has not set any display preferences")
+            description = _("You can set display preferences with an HTTP PUT to this URL.")
+            raise falcon.HTTPNotFound(title, description)
+
+        resp.media = {
+            "url": req.path,
+            "preferences": preferences.preferences,
+        }
+
+    @validate({
+        "$schema": "http://json-schema.org/draft-06/schema#",
+        "title": "Display preferences",
+        "description": "Choose what /status?preferences=true shows",
+        "type": "object",
+        "properties": {
+            "services": {
+                "description": "Service slugs",
+                "type": "array",
+                "items": {
+                    "type": "string",
+                },
+                "uniqueItems": True,
+            },
+            "groups": {
+                "description": "Service group slugs",
+                "type": "array",
+                "items": {
+                    "type": "string",
+                },
+                "uniqueItems": True,
+            },
+            "fields": {
+                "description": "Event fields",
+                "type": "array",
+                "items": {
+                    "type": "string",
+                    "enum": list(EVENT_FIELDS),
+                },
+                "uniqueItems": True,
+            },
+        },
+        "additionalProperties": False,
+    })
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_put(self, req, resp, username):
+        self.check_user(req, username, 'modify')
+
+        try:
+            preferences = self.db.query(DisplayPreferences)\
+                .filter(DisplayPreferences.username == username)\
+                .one()
+        except NoResultFound:
+            preferences = DisplayPreferences(username=username)
+
+        preferences.preferences = req.media
+
+        self.db.add(preferences)
+        self.db.commit()
+
+        preferences_cache.pop(username)
+
+        logger.audit("User %s updated the display preferences for %s", req.user['username'],
+                     username,
+                     action='modify-preferences', user=req.user['username'], subject=username,
+                     authorized=True)
+
+        resp.media = {
+            "url": req.path,
+            "preferences": preferences.preferences,
+        }
+
+    @authenticate(landing_page_auth | status_page_human_auth)
+    def on_delete(self, req, resp, username):
+        self.check_user(req, username, 'remove')
+
+        self.db.query(DisplayPreferences)\
+            .filter(DisplayPreferences.username == username)\
+            .delete(synchronize_session=False)
+        self.db.commit()
+
+        preferences_cache.pop(username)
+
+        logger.audit("User %s removed the display preferences for %s", req.user['username'],
+                     username,
+                     action='remove-preferences', user=req.user['username'], subject=username,
+                     authorized=True)
+
+        resp.location = "/status"
+
+
+class MetricsRoute(object):
+    # Monitoring is most useful while the process is overloaded
+    PRIORITY = {'GET': AdmissionController.HIGH}
+
+    def __init__(self, collector=None):
+        self.collector = collector
+
+    def on_get(self, req, resp):
+        if self.collector is not None:
+            snapshot = self.collector.collect()
+        else:
+            snapshot = REGISTRY.snapshot()
+
+        resp.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        resp.body = render_metrics(snapshot)
+
+
 class APIKeyRoute(object):
-    @jsonschema.validate({
+    @validate({
         "$schema": "http://json-schema.org/draft-06/schema#",
         "title": "Get an API key for this service",
         "description": "Get API key (in the form of a JWT) for this status page server. If a "
@@ -1053,17 +2324,21 @@ class APIKeyRoute(object):
             jwt_payload['bot'] = False
             jwt_payload['exp'] = datetime.now(tz=pytz.UTC) + timedelta(hours=24)
 
-        jwt_ = jwt.encode(jwt_payload, STATUS_PAGE_PRIVATE_KEY, algorithm='RS512').decode('utf-8')
+        jwt_ = status_page_human_auth.encode(jwt_payload)
+        # PyJWT < 2 returns bytes
+        if isinstance(jwt_, bytes):
+            jwt_ = jwt_.decode('utf-8')
 
-        logger.audit(f"User {req.user['username']} created a "
-                     f"{'bot ' if jwt_payload['bot'] else ' '}JWT/API key for permission "
-                     f"{permission.id}")
+        logger.audit("User %s created a %sJWT/API key for permission %s", req.user['username'],
+                     'bot ' if jwt_payload['bot'] else '', permission.id,
+                     action='create-api-key', user=req.user['username'], permission=permission.id,
+                     bot=jwt_payload['bot'], authorized=True)
 
         resp.media = {
             "payload": jwt_payload,
             "api_key": {
-                "description": f"Send this API key in a header as the {HTTP_HEADER_PREFIX} auth "
-                               "token or in the 'api-key' URL query parameter.",
+                "description": f"Send this API key in a header as the "
+                               f"{get_config().http_header_prefix} auth token or in the 'api-key' URL query parameter.",
                 "jwt": jwt_,
             },
         }
@@ -1,85 +1,311 @@
-import gettext
+import atexit
 import logging.config
-import os
 import re
+import time
+from collections import OrderedDict
 
 import falcon
 
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import (scoped_session, sessionmaker)
+from sqlalchemy.orm import (configure_mappers, scoped_session, sessionmaker)
 
 # We import this so it registers its JSON encoder function
 from .api import (
-    RootRoute, StatusRoute, ServicesRoute, ServiceRoute, ServiceStatusRoute,
-    EventsRoute, EventRoute, PermissionsRoute, PermissionRoute, UserPermissionsRoute, APIKeyRoute,
+    RootRoute, StatusRoute, StatusBatchRoute, ServicesRoute, ServiceRoute, ServiceStatusRoute,
+    SubscriptionRoute, EventsRoute, EventsExportRoute, EventRoute, IncidentsRoute,
+    ServiceIncidentsRoute, IncidentRoute, PermissionsRoute, PermissionRoute, UserPermissionsRoute,
+    PreferencesRoute, WebhooksRoute, WebhookRoute, WebhookDeliveriesRoute, WebhookRedeliverRoute,
+    APIKeyRoute, MetricsRoute, event_rate_limit, is_site_admin_request,
+    landing_page_auth, stale_while_revalidate, status_page_bot_auth, status_page_human_auth,
+)
+from .config import (Config, set_config)
+from .heartbeats import HeartbeatMonitor
+from .ingestion import EventIngestor
+from .models import make_slug
+from .middleware import (AdmissionMiddleware, CompressionMiddleware, MetricsMiddleware,
+                         ProfilingMiddleware, SQLAlchemySessionManager)
+from .notifications import (ChatTransport, NotificationDispatcher, SMTPTransport)
+from .webhooks import WebhookDispatcher
+from .utils import (
+    AUDIT, AdmissionController, AsyncHandler, AuditFilter, BatchedWatchedFileHandler,
+    JSONFormatter, KeyedRateLimiter, MultiProcessCollector, ResponseCompressor, SharedRateLimiter,
+    TrackedQueuePool, compile_schemas, database_breaker, logging, query_tracker,
 )
-from .middleware import SQLAlchemySessionManager
-
 
-# Configure some things via environment variables
-DB_URL = os.environ.get(
-    'DB_URL',
-    '{db_driver}://{db_username}:{db_password}@{db_host}:{db_port}/{db_name}'.format(
-        db_driver=os.environ.get('DB_DRIVER', 'postgresql'),
-        db_username=os.environ.get('DB_USER', 'postgres'),
-        db_password=os.environ.get('DB_PASSWORD', ''),
-        db_host=os.environ.get('DB_HOST', 'localhost'),
-        db_port=os.environ.get('DB_PORT', '5432'),
-        db_name=os.environ.get('DB_NAME', 'postgres')))
 
-engine = create_engine(DB_URL, echo=True)
+logger = logging.getLogger(__name__)
 
 session_factory = sessionmaker()
 
-session_factory.configure(bind=engine)
-
 Session = scoped_session(session_factory)
 
-logging.config.dictConfig({
-    'version': 1,
-    'disable_existing_loggers': True,
-    'handlers': {
-        'console': {
-            'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-        },
-    },
-    'loggers': {
-        'api': {
-            'handlers': ['console'],
-            'level': 'AUDIT',
+# Threads started by create_app() (or by post_fork() when the application is preloaded), they need
+# restarting in forked worker processes
+background_workers = []
+
+
+def create_engine_from_config(config):
+    options = {}
+    if config.db_url.startswith('postgresql'):
+        # Don't let a database that doesn't answer (or a pool that is all checked out) hold
+        # requests hostage. The pool reports how long requests wait for it, to shed load early.
+        options.update(connect_args={'connect_timeout': config.db_connect_timeout},
+                       pool_timeout=config.db_connect_timeout, poolclass=TrackedQueuePool)
+
+    engine = create_engine(config.db_url, echo=config.db_echo, **options)
+
+    query_tracker.instrument(engine)
+
+    database_breaker.failure_threshold = config.circuit_failure_threshold
+    database_breaker.reset_timeout = config.circuit_reset_timeout
+    database_breaker.instrument(engine)
+
+    return engine
+
+
+def configure_logging(config):
+    """
+    Everything is logged through a background thread, so neither console output nor the durable
+    audit log (JSON lines, only AUDIT records) adds latency to requests
+    """
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.DEBUG)
+
+    audit_file_handler = BatchedWatchedFileHandler(config.audit_log, delay=True)
+    audit_file_handler.setLevel(AUDIT)
+    audit_file_handler.addFilter(AuditFilter())
+    audit_file_handler.setFormatter(JSONFormatter())
+
+    async_handler = AsyncHandler(console_handler, audit_file_handler)
+    background_workers.append(async_handler.worker)
+
+    # dictConfig() forgets the handlers created before it runs, so logging.shutdown() wouldn't
+    # write out the records still queued when the process exits
+    atexit.register(async_handler.close)
+
+    logging.config.dictConfig({
+        'version': 1,
+        # Our loggers are created at import time, before this runs
+        'disable_existing_loggers': False,
+        'handlers': {
+            'async': {
+                '()': lambda: async_handler,
+            },
         },
-        'app': {
-            'handlers': ['console'],
-            'level': 'DEBUG',
+        'loggers': {
+            'status_page': {
+                'handlers': ['async'],
+                'level': config.log_level,
+            },
         },
-    },
-})
+    })
+
+
+def create_notification_transports(config):
+    transports = []
+
+    if config.notification_smtp_host:
+        transports.append(SMTPTransport(
+            host=config.notification_smtp_host,
+            port=config.notification_smtp_port,
+            sender=config.notification_email_from,
+            domain=config.notification_email_domain,
+            rate=config.notification_rate))
+
+    if config.notification_chat_webhook_url:
+        transports.append(ChatTransport(
+            webhook_url=config.notification_chat_webhook_url,
+            rate=config.notification_rate))
+
+    return transports
+
+
+def create_event_rate_limiter(config):
+    if not config.event_rate_limit:
+        return None
+
+    # Without a shared file every worker process allows the full rate on its own
+    if config.rate_limit_file:
+        return SharedRateLimiter(config.rate_limit_file, config.event_rate_limit,
+                                 capacity=config.event_rate_burst)
+
+    return KeyedRateLimiter(config.event_rate_limit, capacity=config.event_rate_burst)
+
+
+def create_app(config=None):
+    """
+    The application factory
+
+    Importing the application doesn't read the environment or build anything expensive, this does.
+    Call it once per process.
+
+    `config` (optional) - A `Config`, read from the environment if not given
+    """
+    if config is None:
+        config = Config.from_environ()
 
-# Install this as a built-in for the entire application
-gettext.install('status_page')
+    set_config(config)
 
+    configure_logging(config)
+
+    engine = create_engine_from_config(config)
+    session_factory.configure(bind=engine)
+
+    stale_while_revalidate.budget = config.read_budget
+    event_rate_limit.limiter = create_event_rate_limiter(config)
+
+    ingestor = EventIngestor()
+
+    transports = create_notification_transports(config)
+    if transports:
+        notification_dispatcher = NotificationDispatcher(session_factory, transports)
+        background_workers.append(notification_dispatcher)
+        ingestor.add_listener(notification_dispatcher)
+
+    # Every worker process runs a monitor, they lock the service before marking it down so each
+    # missed heartbeat is only recorded once
+    if config.heartbeats:
+        heartbeat_monitor = HeartbeatMonitor(session_factory, ingestor,
+                                             sync_interval=config.heartbeat_sync_interval)
+        background_workers.append(heartbeat_monitor)
+        ingestor.add_observer(heartbeat_monitor)
+
+    # Every worker process sends webhook deliveries, they're claimed from the database so each one
+    # is only sent by one of them at a time
+    if config.webhooks:
+        webhook_dispatcher = WebhookDispatcher(
+            session_factory,
+            workers=config.webhook_workers,
+            endpoint_concurrency=config.webhook_endpoint_concurrency,
+            max_attempts=config.webhook_max_attempts)
+        background_workers.append(webhook_dispatcher)
+        ingestor.add_observer(webhook_dispatcher)
+
+    # A preloading process only forks the workers, the threads would hold the pool (and their
+    # locks) across the fork and keep using the database from the master
+    if not config.preload:
+        for worker in background_workers:
+            worker.start()
+
+    # Set this to a directory shared by all of the worker processes (and emptied on deploy) to
+    # aggregate metrics across them
+    if config.metrics_dir:
+        metrics_collector = MultiProcessCollector(config.metrics_dir)
+    else:
+        metrics_collector = None
+
+    middleware = [MetricsMiddleware(metrics_collector)]
+
+    # Reads are shed first when this process has too much to do, so dashboards can't starve the
+    # bots reporting events
+    if config.max_in_flight or config.max_pool_wait:
+        middleware.append(AdmissionMiddleware(AdmissionController(
+            max_in_flight=config.max_in_flight,
+            max_pool_wait=config.max_pool_wait)))
+
+    # Profiling is opt-in, so the middleware isn't even installed unless it's configured
+    if config.profile_dir:
+        middleware.append(ProfilingMiddleware(
+            config.profile_dir,
+            is_site_admin=is_site_admin_request,
+            sample_rate=config.profile_sample_rate,
+            mode=config.profile_mode))
+
+    # Responses are compressed before MetricsMiddleware measures them
+    if config.compression:
+        middleware.append(CompressionMiddleware(ResponseCompressor(
+            min_size=config.compression_min_size,
+            level=config.compression_level,
+            cache_size=config.compression_cache_size)))
+
+    middleware.append(SQLAlchemySessionManager(Session))
 
-def create_app():
     # api = falcon.API(middleware=[auth_middleware])
-    api = falcon.API(middleware=[SQLAlchemySessionManager(Session)])
+    api = falcon.API(middleware=middleware)
     api.add_route('/', RootRoute())
     api.add_route('/status', StatusRoute())
+    api.add_route('/status/batch', StatusBatchRoute())
     api.add_route('/services', ServicesRoute())
     api.add_route('/services/{service_slug}', ServiceRoute())
     api.add_route('/services/{service_slug}/status', ServiceStatusRoute())
-    api.add_route('/services/{service_slug}/events', EventsRoute())
+    api.add_route('/services/{service_slug}/subscription', SubscriptionRoute())
+    api.add_route('/services/{service_slug}/events', EventsRoute(ingestor))
+    api.add_route('/services/{service_slug}/events/export', EventsExportRoute(session_factory))
     api.add_route('/services/{service_slug}/events/{event_id}', EventRoute())
+    api.add_route('/incidents', IncidentsRoute())
+    api.add_route('/services/{service_slug}/incidents', ServiceIncidentsRoute())
+    api.add_route('/services/{service_slug}/incidents/{incident_id}', IncidentRoute())
     api.add_route('/services/{service_slug}/permissions', PermissionsRoute())
     api.add_route('/services/{service_slug}/permissions/{permission_id}', PermissionRoute())
     api.add_route('/users/{username}/permissions', UserPermissionsRoute())
+    api.add_route('/users/{username}/preferences', PreferencesRoute())
+    api.add_route('/webhooks', WebhooksRoute())
+    api.add_route('/webhooks/{webhook_id}', WebhookRoute())
+    api.add_route('/webhooks/{webhook_id}/deliveries', WebhookDeliveriesRoute())
+    api.add_route('/webhooks/{webhook_id}/redeliver', WebhookRedeliverRoute())
     api.add_route('/api-keys', APIKeyRoute())
+    api.add_route('/metrics', MetricsRoute(metrics_collector))
+
+    warm_up(api)
+
     return api
 
 
-def get_app():
-    return create_app()
+def warm_up(api):
+    """
+    Do everything that would otherwise slow down the first requests
+
+    When the application is preloaded (gunicorn's `preload_app`), this runs once in the master
+    process and the forked workers share the results copy-on-write. It never connects to the
+    database, so there are no connections to leak into the workers.
+
+    Returns the time (in seconds) each stage took.
+    """
+    def load_keys():
+        for auth in (landing_page_auth, status_page_human_auth, status_page_bot_auth):
+            auth.load_keys()
+
+    stages = OrderedDict([
+        ('keys', load_keys),
+        ('schemas', compile_schemas),
+        ('mappers', configure_mappers),
+        ('slugs', lambda: make_slug("Warm up")),
+        # Falcon compiles its router on the first lookup
+        ('routes', lambda: api._router.find('/')),
+    ])
+
+    timings = OrderedDict()
+    for name, stage in stages.items():
+        started = time.perf_counter()
+        stage()
+        timings[name] = time.perf_counter() - started
+
+    logger.info("Warmed up in %.1fms (%s)", sum(timings.values()) * 1000,
+                ', '.join(f"{name}: {seconds * 1000:.1f}ms" for name, seconds in timings.items()))
+
+    return timings
+
+
+def post_fork():
+    """
+    Call this in every worker process forked from a process that ran `create_app()`
+
+    Starts the background threads afresh, they're only started here when the application is
+    preloaded.
+    """
+    engine = session_factory.kw.get('bind')
+    if engine is not None:
+        # Never share pooled connections with the parent. dispose() would close the ones the
+        # parent still uses, a new pool just leaves them be.
+        engine.pool = engine.pool.recreate()
+
+    for worker in background_workers:
+        worker.after_fork()
+
+
+def get_app(config=None):
+    return create_app(config)
 
 
 if __name__ == '__main__':
@@ -92,6 +318,8 @@ if __name__ == '__main__':
         'uuid_generate_v4': 'uuid-ossp',
     }
 
+    engine = create_engine_from_config(Config.from_environ())
+
     try:
         Base.metadata.create_all(engine)
     except Exception as e:
@@ -117,5 +345,3 @@ if __name__ == '__main__':
                 f"""'{EXTENSION_MAP[ext_does_not_exist_match.group('func_name')]}';\n""")
         else:
             raise e
-
-application = get_app()
@@ -0,0 +1,428 @@
+'''
+Synthetic checks: probe services over HTTP or TCP and record their status
+
+    python -m status_page.checks checks.json --concurrency 200
+
+Instead of a fleet of scripts that each probe an endpoint and POST the result, one process probes
+every endpoint concurrently on an asyncio event loop, with at most `--concurrency` probes in flight.
+Every check runs on its own jittered schedule, so thousands of them don't all fire at once. Only
+status changes are written, straight through the `EventIngestor`, so subscribers are notified just
+like for events reported through the API.
+
+The checks file is a JSON list, a service may have several checks and is as up as its worst one:
+
+    [
+        {"service": "jira", "http": "https://jira.example.com/status", "interval": 30,
+         "timeout": 5, "expect_status": [200], "max_latency": 1.5},
+        {"service": "postgres", "tcp": "db.example.com:5432", "interval": 10}
+    ]
+
+A failed probe marks the service down, and a successful probe that took longer than `max_latency`
+seconds marks it limited.
+
+Probes only need an address, so they're easy to point at local stand-in servers, and
+`Checker.run_once()` probes everything once instead of forever.
+'''
+import argparse
+import asyncio
+import json
+import random
+import ssl
+import sys
+import time
+from collections import (Counter, namedtuple)
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
+
+from .ingestion import EventIngestor
+from .queries import (get_service, latest_events)
+from .utils import (SchemaValidator, logging)
+
+
+__all__ = ['Check', 'Checker', 'HTTPProbe', 'ProbeResult', 'TCPProbe', 'load_checks']
+
+logger = logging.getLogger(__name__)
+
+
+# `status` is 'up', 'limited' or 'down', `latency` is in seconds (None if there was no answer)
+ProbeResult = namedtuple('ProbeResult', ['status', 'latency', 'detail'])
+
+# From best to worst
+STATUSES = ('up', 'limited', 'down')
+
+
+class Probe(object):
+    type = None
+
+    def __init__(self, timeout=10.0, max_latency=None):
+        """
+        `timeout` - Seconds to wait for an answer before the probe fails
+        `max_latency` (optional) - Seconds an answer may take before the service counts as limited
+        """
+        self.timeout = timeout
+        self.max_latency = max_latency
+
+    @property
+    def target(self):
+        raise NotImplementedError("Subclasses of Probe must implement target themselves")
+
+    async def attempt(self):
+        """
+        Probe the target once, return a description of the answer or raise if it's a failure
+        """
+        raise NotImplementedError("Subclasses of Probe must implement attempt() themselves")
+
+    async def run(self):
+        started = time.monotonic()
+
+        try:
+            detail = await asyncio.wait_for(self.attempt(), self.timeout)
+        except asyncio.TimeoutError:
+            return ProbeResult('down', None, f"No answer from {self.target} within "
+                                             f"{self.timeout:g}s")
+        except (OSError, ValueError) as e:
+            return ProbeResult('down', None, f"{self.target}: {str(e) or e.__class__.__name__}")
+
+        latency = time.monotonic() - started
+
+        if self.max_latency is not None and latency > self.max_latency:
+            return ProbeResult('limited', latency, f"{detail} after {latency:.2f}s, more than "
+                                                   f"{self.max_latency:g}s")
+
+        return ProbeResult('up', latency, detail)
+
+
+class TCPProbe(Probe):
+    type = 'tcp'
+
+    def __init__(self, host, port, **kwargs):
+        """
+        Succeeds when a TCP connection to `host`:`port` can be opened
+        """
+        super().__init__(**kwargs)
+
+        self.host = host
+        self.port = port
+
+    @property
+    def target(self):
+        return f"{self.host}:{self.port}"
+
+    async def attempt(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.close()
+        return f"Connected to {self.target}"
+
+
+class HTTPProbe(Probe):
+    type = 'http'
+
+    def __init__(self, url, expect_status=(200,), **kwargs):
+        """
+        Succeeds when a GET of `url` answers with one of the `expect_status` codes
+
+        Only the status line is read, so this needs nothing beyond asyncio's streams.
+        """
+        super().__init__(**kwargs)
+
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"Not an HTTP(S) URL: {url}")
+
+        self.url = url
+        self.expect_status = frozenset(expect_status)
+
+        self._host = parts.hostname
+        self._port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self._ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self._request = (
+            f"GET {parts.path or '/'}{'?' + parts.query if parts.query else ''} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            "User-Agent: status-page-checks\r\n"
+            "Connection: close\r\n"
+            "\r\n"
+        ).encode('latin-1')
+
+    @property
+    def target(self):
+        return self.url
+
+    async def attempt(self):
+        reader, writer = await asyncio.open_connection(self._host, self._port, ssl=self._ssl)
+        try:
+            writer.write(self._request)
+            await writer.drain()
+
+            status_line = await reader.readline()
+        finally:
+            writer.close()
+
+        # Don't unpack into _, that's gettext
+        version, space, rest = status_line.decode('latin-1').partition(' ')
+        if not version.startswith('HTTP/') or not rest[:3].isdigit():
+            raise ValueError(f"Not an HTTP response: {status_line[:100]!r}")
+
+        status = int(rest[:3])
+        if status not in self.expect_status:
+            raise ValueError(f"HTTP {status}")
+
+        return f"HTTP {status}"
+
+
+class Check(object):
+    def __init__(self, service, probe, interval=60.0):
+        """
+        Probe one endpoint of a service every `interval` seconds
+
+        `service` - The slug of the service
+        `probe` - An `HTTPProbe` or a `TCPProbe`
+        """
+        self.service = service
+        self.probe = probe
+        self.interval = interval
+
+    def __repr__(self):
+        return f"<Check {self.service} {self.probe.type} {self.probe.target}>"
+
+
+CHECKS_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-06/schema#",
+    "title": "Checks",
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "service": {"type": "string"},
+            "http": {"type": "string"},
+            "tcp": {"type": "string", "pattern": "^.+:[0-9]+$"},
+            "interval": {"type": "number", "minimum": 1},
+            "timeout": {"type": "number", "exclusiveMinimum": 0},
+            "max_latency": {"type": "number", "exclusiveMinimum": 0},
+            "expect_status": {
+                "type": "array",
+                "items": {"type": "integer", "minimum": 100, "maximum": 599},
+                "minItems": 1,
+            },
+        },
+        "required": ["service"],
+        "oneOf": [
+            {"required": ["http"]},
+            {"required": ["tcp"]},
+        ],
+        "additionalProperties": False,
+    },
+}
+
+_checks_validator = SchemaValidator(CHECKS_SCHEMA)
+
+
+def load_checks(definitions):
+    """
+    Build `Check`s from a list of definitions, in the format of the checks file
+
+    Raises `jsonschema.ValidationError` (or `ValueError`, for bad URLs) if a definition is invalid.
+    """
+    _checks_validator.validate(definitions)
+
+    checks = []
+    for definition in definitions:
+        options = {key: definition[key] for key in ('timeout', 'max_latency') if key in definition}
+
+        if 'http' in definition:
+            probe = HTTPProbe(definition['http'],
+                              expect_status=definition.get('expect_status', (200,)), **options)
+        else:
+            host, colon, port = definition['tcp'].rpartition(':')
+            probe = TCPProbe(host, int(port), **options)
+
+        checks.append(Check(definition['service'], probe, definition.get('interval', 60.0)))
+
+    return checks
+
+
+class Checker(object):
+    def __init__(self, session_factory, ingestor, checks, concurrency=100, jitter=0.1):
+        """
+        Run checks concurrently and record the status changes of their services
+
+        `session_factory` - Creates the SQLAlchemy sessions events are recorded with
+        `ingestor` - The `EventIngestor` that records the events
+        `checks` - The `Check`s to run
+        `concurrency` - The most probes in flight at once
+        `jitter` - How much (as a fraction of the interval) to vary the time between probes, so
+                   checks that started together drift apart
+        """
+        self.session_factory = session_factory
+        self.ingestor = ingestor
+        self.checks = list(checks)
+        self.concurrency = concurrency
+        self.jitter = jitter
+
+        # The newest result of every check of each service, and the status last recorded for it
+        self.results = {check.service: {} for check in self.checks}
+        self.statuses = {}
+        self._checks_per_service = Counter(check.service for check in self.checks)
+
+        # Recording events blocks, one thread at a time does it off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checks')
+        self._semaphore = None
+
+    def load_statuses(self):
+        """
+        Start from the status each service has in the database, so restarting writes nothing new
+        """
+        db = self.session_factory()
+        try:
+            for service, event in latest_events(db, services=list(self.results)):
+                self.statuses[service.slug] = event.status if event is not None else None
+        finally:
+            db.close()
+
+    async def probe(self, check):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self._semaphore:
+            result = await check.probe.run()
+
+        await self.report(check, result)
+        return result
+
+    async def report(self, check, result):
+        """
+        Record an event if the result changes the status of the service
+        """
+        results = self.results[check.service]
+        results[check] = result
+
+        # Don't judge a service by some of its checks
+        if len(results) < self._checks_per_service[check.service]:
+            return
+
+        worst = max(results.values(), key=lambda result: STATUSES.index(result.status))
+        if worst.status == self.statuses.get(check.service):
+            return
+
+        previous_status = self.statuses.get(check.service)
+        self.statuses[check.service] = worst.status
+
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(self._executor, self.record, check, worst)
+        except Exception:
+            # Try again with the next result
+            self.statuses[check.service] = previous_status
+            logger.exception("Could not record that %s is %s", check.service, worst.status)
+
+    def record(self, check, result):
+        db = self.session_factory()
+        try:
+            try:
+                service = get_service(db, check.service)
+            except NoResultFound:
+                logger.error("Can't record the status of '%s', there is no such service",
+                             check.service)
+                return
+
+            self.ingestor.record(
+                db, service,
+                status=result.status,
+                description=result.detail,
+                informational=False,
+                extra={"check": {
+                    "type": check.probe.type,
+                    "target": check.probe.target,
+                    "latency": result.latency,
+                }})
+
+            logger.info("%s is %s: %s", check.service, result.status, result.detail)
+        finally:
+            db.close()
+
+    async def run_once(self):
+        """
+        Probe everything once, returns the result of each check
+        """
+        results = await asyncio.gather(*(self.probe(check) for check in self.checks))
+        return dict(zip(self.checks, results))
+
+    async def watch(self, check):
+        # Spread the first probes over the interval, instead of all of them at start up
+        await asyncio.sleep(random.uniform(0, check.interval))
+
+        while True:
+            try:
+                await self.probe(check)
+            except Exception:
+                logger.exception("%r failed", check)
+
+            await asyncio.sleep(check.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def run(self):
+        """
+        Probe everything on its schedule, forever
+        """
+        await asyncio.gather(*(self.watch(check) for check in self.checks))
+
+
+def main(argv=None):
+    # Only the checker needs the application's database and notification setup
+    from .app import (configure_logging, create_engine_from_config,
+                      create_notification_transports)
+    from .config import Config
+    from .notifications import NotificationDispatcher
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checks', help="The JSON file with the check definitions")
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help="The most probes in flight at once (default: 100)")
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help="How much to vary the time between probes, as a fraction of the "
+                             "interval (default: 0.1)")
+    parser.add_argument('--once', action='store_true',
+                        help="Probe everything once and exit")
+    args = parser.parse_args(argv)
+
+    config = Config.from_environ()
+    configure_logging(config)
+
+    session_factory = sessionmaker(bind=create_engine_from_config(config))
+
+    ingestor = EventIngestor()
+    notification_dispatcher = None
+    transports = create_notification_transports(config)
+    if transports:
+        notification_dispatcher = NotificationDispatcher(session_factory, transports)
+        notification_dispatcher.start()
+        ingestor.add_listener(notification_dispatcher)
+
+    with open(args.checks) as f:
+        checks = load_checks(json.load(f))
+
+    checker = Checker(session_factory, ingestor, checks, concurrency=args.concurrency,
+                      jitter=args.jitter)
+    checker.load_statuses()
+
+    logger.info("Running %d checks of %d services", len(checks), len(checker.results))
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(checker.run_once() if args.once else checker.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+        # Deliver the notifications that are still queued
+        if notification_dispatcher is not None:
+            notification_dispatcher.stop()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+'''
+Application configuration
+
+Nothing here reads the environment at import time. `Config.from_environ()` reads it once, when
+the application factory runs, and everything expensive built from the configuration (the database
+engine, JWT keys) is built from the `Config` object instead of module level globals.
+'''
+import os
+
+
+__all__ = ['Config', 'ConfigurationError', 'get_config', 'set_config']
+
+
+class ConfigurationError(RuntimeError):
+    pass
+
+
+def _flag(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config(object):
+    def __init__(self, site_admins=(), landing_page_public_key=None, status_page_private_key=None,
+                 status_page_public_key=None, http_header_prefix='JWT', db_url=None, db_echo=False,
+                 audit_log='audit.log', log_level='DEBUG', metrics_dir=None, profile_dir=None,
+                 profile_sample_rate=0.0, profile_mode='cprofile', compression=True,
+                 compression_min_size=1024, compression_level=6, compression_cache_size=256,
+                 db_connect_timeout=5, read_budget=2.0, circuit_failure_threshold=5,
+                 circuit_reset_timeout=30.0, max_in_flight=None, max_pool_wait=1.0,
+                 event_rate_limit=10.0, event_rate_burst=100, rate_limit_file=None,
+                 heartbeats=True, heartbeat_sync_interval=60.0, webhooks=True, webhook_workers=8,
+                 webhook_endpoint_concurrency=2, webhook_max_attempts=10, notification_rate=10.0,
+                 notification_smtp_host=None, notification_smtp_port=25,
+                 notification_email_from='status-page@localhost', notification_email_domain=None,
+                 notification_chat_webhook_url=None, preload=False):
+        """
+        Everything the application factory needs to know
+
+        Tests can construct this directly, the application reads it from the environment with
+        `Config.from_environ()`.
+
+        `site_admins` - Usernames allowed to do anything
+        `landing_page_public_key` - PEM public key of the landing page JWTs
+        `status_page_private_key` - PEM private key used to sign our own API keys
+        `status_page_public_key` - PEM public key used to verify our own API keys
+        `http_header_prefix` - The scheme of the Authorization header, eg: 'JWT <token>'
+        `db_url` - SQLAlchemy database URL
+        `db_echo` - Log every SQL statement
+        `audit_log` - Path of the JSON lines audit log, every worker process appends to it and
+                      it's reopened once it was rotated
+        `metrics_dir` (optional) - Directory shared by all worker processes to aggregate metrics
+        `profile_dir` (optional) - Directory to write request profiles to, enables profiling
+        `compression` - Compress responses for clients that accept it
+        `compression_min_size` - Smallest response body (in bytes) worth compressing
+        `compression_cache_size` - How many compressed response bodies to keep, 0 disables caching
+        `db_connect_timeout` - Seconds to wait for a database connection, new or from the pool
+                               (PostgreSQL only)
+        `read_budget` (optional) - Seconds a statement of the status and service list routes may
+                                   take before the last good response is served instead
+        `circuit_failure_threshold` - Consecutive database failures before giving it a rest
+        `circuit_reset_timeout` - Seconds to leave the database alone after that
+        `max_in_flight` (optional) - Requests a worker process handles at once, reads are shed at
+                                     half of that and other writes at 80% to leave room for events
+        `max_pool_wait` (optional) - Seconds a request may wait for a database connection before
+                                     reads are shed (and other writes after twice as long)
+        `event_rate_limit` (optional) - Events per second each API key or user may record
+        `event_rate_burst` - Events each API key or user may record at once, after a quiet spell
+        `rate_limit_file` (optional) - File (on a tmpfs) the worker processes share their rate
+                                       limits through, otherwise each process limits on its own
+        `heartbeats` - Mark services down when they miss a heartbeat
+        `heartbeat_sync_interval` - Seconds between rebuilding the heartbeat deadlines from the
+                                    database, which picks up changes made by other processes
+        `webhooks` - Send the deliveries of webhooks from this process
+        `webhook_workers` - The most webhook requests in flight at once
+        `webhook_endpoint_concurrency` - The most requests in flight to a single webhook URL
+        `webhook_max_attempts` - Attempts before a webhook delivery is dead-lettered
+        `preload` - The application is built in a process that forks the workers (gunicorn's
+                    `preload_app`), so the background threads are only started by `post_fork()`
+        """
+        self.site_admins = frozenset(site_admins)
+
+        self.landing_page_public_key = landing_page_public_key
+        self.status_page_private_key = status_page_private_key
+        self.status_page_public_key = status_page_public_key
+        self.http_header_prefix = http_header_prefix
+
+        self.db_url = db_url
+        self.db_echo = db_echo
+
+        self.audit_log = audit_log
+        self.log_level = log_level
+
+        self.metrics_dir = metrics_dir
+
+        self.profile_dir = profile_dir
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_mode = profile_mode
+
+        self.compression = compression
+        self.compression_min_size = compression_min_size
+        self.compression_level = compression_level
+        self.compression_cache_size = compression_cache_size
+
+        self.db_connect_timeout = db_connect_timeout
+        self.read_budget = read_budget
+        self.circuit_failure_threshold = circuit_failure_threshold
+        self.circuit_reset_timeout = circuit_reset_timeout
+
+        self.max_in_flight = max_in_flight
+        self.max_pool_wait = max_pool_wait
+        self.event_rate_limit = event_rate_limit
+        self.event_rate_burst = event_rate_burst
+        self.rate_limit_file = rate_limit_file
+
+        self.heartbeats = heartbeats
+        self.heartbeat_sync_interval = heartbeat_sync_interval
+
+        self.webhooks = webhooks
+        self.webhook_workers = webhook_workers
+        self.webhook_endpoint_concurrency = webhook_endpoint_concurrency
+        self.webhook_max_attempts = webhook_max_attempts
+
+        self.notification_rate = notification_rate
+        self.notification_smtp_host = notification_smtp_host
+        self.notification_smtp_port = notification_smtp_port
+        self.notification_email_from = notification_email_from
+        self.notification_email_domain = notification_email_domain
+        self.notification_chat_webhook_url = notification_chat_webhook_url
+
+        self.preload = preload
+
+    @classmethod
+    def from_environ(cls, environ=None):
+        """
+        Read the configuration from environment variables
+
+        Raises `ConfigurationError` if a required variable is missing.
+        """
+        if environ is None:
+            environ = os.environ
+
+        missing = [name for name in ('STATUS_PAGE_SITE_ADMINS', 'LANDING_PAGE_JWT_PUBLIC_KEY',
+                                     'STATUS_PAGE_JWT_PRIVATE_KEY', 'STATUS_PAGE_JWT_PUBLIC_KEY')
+                   if not environ.get(name)]
+        if missing:
+            raise ConfigurationError(f"Missing required environment variables: {', '.join(missing)}")
+
+        db_url = environ.get(
+            'DB_URL',
+            '{db_driver}://{db_username}:{db_password}@{db_host}:{db_port}/{db_name}'.format(
+                db_driver=environ.get('DB_DRIVER', 'postgresql'),
+                db_username=environ.get('DB_USER', 'postgres'),
+                db_password=environ.get('DB_PASSWORD', ''),
+                db_host=environ.get('DB_HOST', 'localhost'),
+                db_port=environ.get('DB_PORT', '5432'),
+                db_name=environ.get('DB_NAME', 'postgres')))
+
+        return cls(
+            site_admins=environ['STATUS_PAGE_SITE_ADMINS'].split(','),
+            landing_page_public_key=environ['LANDING_PAGE_JWT_PUBLIC_KEY'].encode('utf-8'),
+            status_page_private_key=environ['STATUS_PAGE_JWT_PRIVATE_KEY'].encode('utf-8'),
+            status_page_public_key=environ['STATUS_PAGE_JWT_PUBLIC_KEY'].encode('utf-8'),
+            http_header_prefix=environ.get('HTTP_HEADER_PREFIX', 'JWT'),
+            db_url=db_url,
+            db_echo=_flag(environ.get('DB_ECHO', 'true')),
+            audit_log=environ.get('STATUS_PAGE_AUDIT_LOG', 'audit.log'),
+            log_level=environ.get('STATUS_PAGE_LOG_LEVEL', 'DEBUG'),
+            metrics_dir=environ.get('STATUS_PAGE_METRICS_DIR') or None,
+            profile_dir=environ.get('STATUS_PAGE_PROFILE_DIR') or None,
+            profile_sample_rate=float(environ.get('STATUS_PAGE_PROFILE_SAMPLE_RATE', '0')),
+            profile_mode=environ.get('STATUS_PAGE_PROFILE_MODE', 'cprofile'),
+            compression=_flag(environ.get('STATUS_PAGE_COMPRESSION', 'true')),
+            compression_min_size=int(environ.get('STATUS_PAGE_COMPRESSION_MIN_SIZE', '1024')),
+            compression_level=int(environ.get('STATUS_PAGE_COMPRESSION_LEVEL', '6')),
+            compression_cache_size=int(environ.get('STATUS_PAGE_COMPRESSION_CACHE_SIZE', '256')),
+            db_connect_timeout=int(environ.get('DB_CONNECT_TIMEOUT', '5')),
+            read_budget=float(environ.get('STATUS_PAGE_READ_BUDGET', '2')) or None,
+            circuit_failure_threshold=int(environ.get('STATUS_PAGE_CIRCUIT_FAILURE_THRESHOLD', '5')),
+            circuit_reset_timeout=float(environ.get('STATUS_PAGE_CIRCUIT_RESET_TIMEOUT', '30')),
+            max_in_flight=int(environ.get('STATUS_PAGE_MAX_IN_FLIGHT', '0')) or None,
+            max_pool_wait=float(environ.get('STATUS_PAGE_MAX_POOL_WAIT', '1')) or None,
+            event_rate_limit=float(environ.get('STATUS_PAGE_EVENT_RATE_LIMIT', '10')) or None,
+            event_rate_burst=int(environ.get('STATUS_PAGE_EVENT_RATE_BURST', '100')),
+            rate_limit_file=environ.get('STATUS_PAGE_RATE_LIMIT_FILE') or None,
+            heartbeats=_flag(environ.get('STATUS_PAGE_HEARTBEATS', 'true')),
+            heartbeat_sync_interval=float(environ.get('STATUS_PAGE_HEARTBEAT_SYNC_INTERVAL', '60')),
+            webhooks=_flag(environ.get('STATUS_PAGE_WEBHOOKS', 'true')),
+            webhook_workers=int(environ.get('STATUS_PAGE_WEBHOOK_WORKERS', '8')),
+            webhook_endpoint_concurrency=int(
+                environ.get('STATUS_PAGE_WEBHOOK_ENDPOINT_CONCURRENCY', '2')),
+            webhook_max_attempts=int(environ.get('STATUS_PAGE_WEBHOOK_MAX_ATTEMPTS', '10')),
+            notification_rate=float(environ.get('NOTIFICATION_RATE', '10')),
+            notification_smtp_host=environ.get('NOTIFICATION_SMTP_HOST') or None,
+            notification_smtp_port=int(environ.get('NOTIFICATION_SMTP_PORT', '25')),
+            notification_email_from=environ.get('NOTIFICATION_EMAIL_FROM', 'status-page@localhost'),
+            notification_email_domain=environ.get('NOTIFICATION_EMAIL_DOMAIN'),
+            notification_chat_webhook_url=environ.get('NOTIFICATION_CHAT_WEBHOOK_URL') or None,
+            preload=_flag(environ.get('STATUS_PAGE_PRELOAD', 'false')))
+
+
+_config = None
+
+
+def set_config(config):
+    """
+    Make `config` the configuration of this process, the application factory calls this
+    """
+    global _config
+    _config = config
+
+
+def get_config():
+    """
+    The configuration of this process, read from the environment the first time if nothing set one
+    """
+    global _config
+    if _config is None:
+        _config = Config.from_environ()
+    return _config
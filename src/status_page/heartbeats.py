@@ -0,0 +1,245 @@
+'''
+Mark services down when they stop sending heartbeats (a dead man's switch)
+
+Some checks only report while the service is healthy, so when the check itself dies the service
+would stay up forever. Services with a `heartbeat_interval` are expected to report at least that
+often, and `HeartbeatMonitor` records a 'down' event (through the `EventIngestor`, like any other
+event) when one misses its deadline.
+
+The deadlines live in a heap, so a single thread sleeps until the earliest one instead of polling
+every service. They're derived from the newest event of each service, so nothing is lost on a
+restart: the monitor rebuilds them from the database when it starts, and again every
+`sync_interval` seconds to pick up changes made by other processes. A deadline is checked against
+the database before the service is marked down, so heartbeats recorded by other processes count.
+'''
+import heapq
+import threading
+import time
+from datetime import (datetime, timedelta)
+
+import pytz
+
+from .models import Service
+from .queries import (heartbeat_services, newest_event)
+from .utils import (Counter, logging)
+
+
+__all__ = ['HeartbeatMonitor']
+
+logger = logging.getLogger(__name__)
+
+
+# How long to wait before starting over after a failure (at most `sync_interval`), so the monitor
+# doesn't spin while the database is unavailable
+RETRY_DELAY = 5.0
+
+
+missed_heartbeats_total = Counter(
+    'status_page_missed_heartbeats_total', "Services marked down because they missed a heartbeat")
+
+
+class HeartbeatMonitor(object):
+    def __init__(self, session_factory, ingestor, sync_interval=60.0, clock=time.time):
+        """
+        Watch the heartbeat deadlines of every service in a background thread
+
+        `session_factory` - Creates the SQLAlchemy sessions used by the monitor thread
+        `ingestor` - The `EventIngestor` that records the 'down' events
+        `sync_interval` - How often (in seconds) to rebuild the deadlines from the database
+        `clock` (optional) - A wall clock function, mostly useful for testing
+        """
+        self.session_factory = session_factory
+        self.ingestor = ingestor
+        self.sync_interval = sync_interval
+        self.clock = clock
+
+        # The current deadline of each service, and a heap of (deadline, service ID). Moving a
+        # deadline pushes a new heap entry, entries that no longer match are skipped when popped.
+        self._deadlines = {}
+        self._heap = []
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._condition = threading.Condition()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='heartbeat-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def after_fork(self):
+        """
+        Call this in a forked child process to start afresh, the deadlines are rebuilt on start
+        """
+        self._deadlines = {}
+        self._heap = []
+        self._stopping = threading.Event()
+        self._condition = threading.Condition()
+        self._thread = None
+
+        self.start()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __call__(self, service, event):
+        """
+        `EventIngestor` observer - every 'up' event of a service moves its deadline
+        """
+        if service.heartbeat_interval is not None and event.status == 'up':
+            self.schedule(service.id, event.when + timedelta(seconds=service.heartbeat_interval))
+        else:
+            # Services that are already not up can't miss a heartbeat
+            self.cancel(service.id)
+
+    def schedule(self, service_id, deadline):
+        """
+        Expect a heartbeat from the service by `deadline` (a datetime)
+        """
+        deadline = deadline.timestamp()
+
+        with self._condition:
+            self._deadlines[service_id] = deadline
+            heapq.heappush(self._heap, (deadline, service_id))
+
+            # Only wake the thread up if it's sleeping for too long now
+            if self._heap[0][1] == service_id:
+                self._condition.notify()
+
+            # Don't let entries for moved deadlines pile up until they're popped
+            if len(self._heap) > 2 * len(self._deadlines) + 1024:
+                self._heap = [(deadline, service_id)
+                              for service_id, deadline in self._deadlines.items()]
+                heapq.heapify(self._heap)
+
+    def cancel(self, service_id):
+        with self._condition:
+            self._deadlines.pop(service_id, None)
+
+    def sync(self, db):
+        """
+        Rebuild every deadline from the newest event of each service
+        """
+        deadlines = {
+            service_id: (when + timedelta(seconds=interval)).timestamp()
+            for service_id, interval, status, when in heartbeat_services(db)
+            # Services that haven't reported yet aren't watched until they do
+            if status == 'up'
+        }
+
+        with self._condition:
+            self._deadlines = deadlines
+            self._heap = [(deadline, service_id) for service_id, deadline in deadlines.items()]
+            heapq.heapify(self._heap)
+
+        logger.debug("Watching the heartbeats of %d services", len(deadlines))
+
+    def pop_due(self, now):
+        """
+        Remove and return the services whose deadline passed
+        """
+        due = []
+
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, service_id = heapq.heappop(self._heap)
+                if self._deadlines.get(service_id) == deadline:
+                    del self._deadlines[service_id]
+                    due.append(service_id)
+
+        return due
+
+    def check(self, db, service_id):
+        """
+        Record a 'down' event if the service really missed its heartbeat
+
+        The deadline may have moved since it was scheduled (eg: another process recorded a
+        heartbeat), so this looks at the newest event again. The service row stays locked until the
+        event is committed, so monitors in other processes never record the same miss twice.
+        """
+        service = db.query(Service)\
+            .filter(Service.id == service_id)\
+            .with_for_update()\
+            .one_or_none()
+
+        newest = newest_event(db, service_id) if service is not None else None
+
+        if service is None or service.heartbeat_interval is None or newest is None or \
+                newest.status != 'up':
+            db.rollback()
+            return False
+
+        interval, when = service.heartbeat_interval, newest.when
+        deadline = when + timedelta(seconds=interval)
+
+        if deadline.timestamp() > self.clock():
+            db.rollback()
+            self.schedule(service_id, deadline)
+            return False
+
+        self.ingestor.record(
+            db, service,
+            status='down',
+            description=f"No heartbeat since {when.isoformat()}, expected one every "
+                        f"{interval} seconds",
+            informational=False,
+            extra={"heartbeat": {"last_seen": when.isoformat(), "interval": interval}},
+            when=datetime.fromtimestamp(self.clock(), pytz.utc))
+
+        missed_heartbeats_total.inc()
+        logger.warning("The '%s' service missed its heartbeat, marked it down", service.name)
+
+        return True
+
+    def _run(self):
+        next_sync = 0
+        retry_delay = min(self.sync_interval, RETRY_DELAY)
+
+        while not self._stopping.is_set():
+            failed = False
+            db = self.session_factory()
+            try:
+                if self.clock() >= next_sync:
+                    self.sync(db)
+                    db.rollback()
+                    next_sync = self.clock() + self.sync_interval
+
+                for service_id in self.pop_due(self.clock()):
+                    self.check(db, service_id)
+            except Exception:
+                logger.exception("The heartbeat monitor failed, retrying in %.0fs", retry_delay)
+                db.rollback()
+                failed = True
+            finally:
+                db.close()
+
+            if failed:
+                # Something may have been popped before it could be checked, start over with a
+                # sync, which rebuilds every deadline from the database
+                next_sync = 0
+                self._stopping.wait(retry_delay)
+                continue
+
+            with self._condition:
+                wake_up = next_sync
+                if self._heap:
+                    wake_up = min(wake_up, self._heap[0][0])
+
+                if not self._stopping.is_set():
+                    self._condition.wait(max(0, wake_up - self.clock()))
@@ -0,0 +1,189 @@
+'''
+Incidents: the spans of time a service wasn't up
+
+An incident opens with the first event of a service that isn't up, and closes with its next up
+event. The `EventIngestor` keeps them up to date as events are recorded, in the same transaction as
+the event. Incidents of events recorded before that (or imported some other way) are derived from
+the event history in a single streaming pass:
+
+    python -m status_page.incidents backfill
+'''
+import argparse
+import sys
+
+from .models import (Event, Incident)
+from .queries import open_incident
+from .utils import logging
+
+
+__all__ = ['backfill_incidents', 'derive_incidents', 'incident_change', 'update_incidents']
+
+logger = logging.getLogger(__name__)
+
+
+OPEN = 'open'
+ESCALATE = 'escalate'
+CLOSE = 'close'
+
+
+def incident_change(previous_status, status):
+    """
+    What an event with `status` does to the incidents of a service whose status was
+    `previous_status`: OPEN, ESCALATE (eg: from limited to down), CLOSE or nothing (None)
+    """
+    was_up = previous_status in (None, 'up')
+
+    if was_up and status != 'up':
+        return OPEN
+    if not was_up and status == 'up':
+        return CLOSE
+    if not was_up and status == 'down' and previous_status != 'down':
+        return ESCALATE
+    return None
+
+
+def update_incidents(db, previous_status, event):
+    """
+    Open, escalate or close the incident of the service of a new `event`
+
+    This only adds to the session, the caller commits it together with the event.
+    """
+    change = incident_change(previous_status, event.status)
+
+    if change == OPEN:
+        db.add(Incident(service_id=event.service_id, status=event.status, started_at=event.when,
+                        start_event=event))
+        return
+
+    if change is None:
+        return
+
+    incident = open_incident(db, event.service_id)
+    if incident is None:
+        # The service was down before incidents were recorded, the backfill takes care of it
+        return
+
+    if change == ESCALATE:
+        incident.status = event.status
+    else:
+        incident.ended_at = event.when
+        incident.end_event = event
+
+
+def derive_incidents(events):
+    """
+    The incidents of an event history, as dictionaries of `Incident` columns
+
+    `events` - An iterable of `(id, service_id, status, when)` tuples, ordered by service and then
+               time, it's only iterated once
+    """
+    service_id = None
+    previous_status = None
+    incident = None
+
+    for event_id, event_service_id, status, when in events:
+        if event_service_id != service_id:
+            if incident is not None:
+                yield incident
+
+            service_id = event_service_id
+            previous_status = None
+            incident = None
+
+        change = incident_change(previous_status, status)
+
+        if change == OPEN:
+            incident = {
+                'service_id': service_id,
+                'status': status,
+                'started_at': when,
+                'ended_at': None,
+                'start_event_id': event_id,
+                'end_event_id': None,
+            }
+        elif change == ESCALATE:
+            incident['status'] = status
+        elif change == CLOSE:
+            incident.update(ended_at=when, end_event_id=event_id)
+            yield incident
+            incident = None
+
+        previous_status = status
+
+    if incident is not None:
+        yield incident
+
+
+def backfill_incidents(db, batch_size=10000):
+    """
+    Replace every incident with the ones derived from the event history
+
+    The events are streamed (in index order, so there is no sort) and the incidents are inserted in
+    batches, in a single transaction. Events recorded meanwhile wait for it to commit.
+
+    Returns the number of incidents.
+    """
+    # PostgreSQL only. The ingestor locks the incidents it updates, so this waits for the events
+    # being recorded and they wait for it, but the incidents can still be read meanwhile.
+    db.execute(f"LOCK TABLE {Incident.__tablename__} IN EXCLUSIVE MODE")
+    db.query(Incident).delete(synchronize_session=False)
+
+    events = db.query(Event.id, Event.service_id, Event.status, Event.when)\
+        .order_by(Event.service_id, Event.when)\
+        .yield_per(batch_size)
+
+    total = 0
+    batch = []
+    for incident in derive_incidents(events):
+        batch.append(incident)
+
+        if len(batch) >= batch_size:
+            db.execute(Incident.__table__.insert(), batch)
+            total += len(batch)
+            batch = []
+
+    if batch:
+        db.execute(Incident.__table__.insert(), batch)
+        total += len(batch)
+
+    db.commit()
+
+    return total
+
+
+def main(argv=None):
+    # Only the command line needs the application's database setup
+    from sqlalchemy.orm import Session
+
+    from .app import (configure_logging, create_engine_from_config)
+    from .config import Config
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest='command')
+    backfill = subcommands.add_parser('backfill', help="Derive every incident from the events")
+    backfill.add_argument('--batch-size', type=int, default=10000,
+                          help="How many events to read, and incidents to insert, at once "
+                               "(default: 10000)")
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    config = Config.from_environ()
+    configure_logging(config)
+
+    db = Session(bind=create_engine_from_config(config))
+    try:
+        total = backfill_incidents(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+
+    logger.info("Derived %d incidents from the event history", total)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
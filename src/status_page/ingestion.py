@@ -0,0 +1,99 @@
+'''
+Record events and let the rest of the application know when a service changes status
+'''
+from collections import namedtuple
+from datetime import datetime
+
+import pytz
+
+from .incidents import update_incidents
+from .models import Event
+from .queries import lock_service
+from .utils import logging
+from .webhooks import enqueue_deliveries
+
+
+__all__ = ['EventIngestor', 'Transition']
+
+logger = logging.getLogger(__name__)
+
+
+# A service changing from one status to another. `previous_status` is None for the very first
+# event of a service.
+Transition = namedtuple('Transition', [
+    'service_id', 'service_name', 'service_slug', 'event_id', 'previous_status', 'status', 'when',
+])
+
+
+class EventIngestor(object):
+    """
+    The single path for writing events
+
+    Listeners are called with a `Transition` after the event has been committed, and only when
+    the status of the service actually changed. Observers are called with the service and the
+    event after every event, changed status or not. Both run on the request thread, so they
+    must hand work off (eg: to a queue) instead of doing it inline.
+    """
+
+    def __init__(self, listeners=None, observers=None):
+        self.listeners = list(listeners or [])
+        self.observers = list(observers or [])
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def record(self, db, service, status, description, informational, extra=None, when=None):
+        # Otherwise two events recorded at once could both see the same previous status, and both
+        # notify subscribers and open an incident
+        lock_service(db, service.id)
+
+        previous_status = db.query(Event.status)\
+            .filter(Event.service_id == service.id)\
+            .order_by(Event.when.desc())\
+            .limit(1)\
+            .scalar()
+
+        event = Event(
+            service_id=service.id,
+            when=when or datetime.now(tz=pytz.UTC),
+            status=status,
+            description=description,
+            informational=informational,
+            extra=extra if extra is not None else {})
+
+        db.add(event)
+
+        # In the same transaction, so the incidents always agree with the events, and no webhook
+        # misses an event
+        update_incidents(db, previous_status, event)
+        enqueue_deliveries(db, event, changed=previous_status != event.status)
+
+        db.commit()
+
+        for observer in self.observers:
+            try:
+                observer(service, event)
+            except Exception:
+                logger.exception("Event observer %r failed for %r", observer, event)
+
+        if previous_status != event.status:
+            transition = Transition(
+                service_id=service.id,
+                service_name=service.name,
+                service_slug=service.slug,
+                event_id=event.id,
+                previous_status=previous_status,
+                status=event.status,
+                when=event.when)
+
+            for listener in self.listeners:
+                try:
+                    listener(transition)
+                except Exception:
+                    # The event is already committed, so never fail the request because of this
+                    logger.exception("Event listener %r failed for %r", listener, transition)
+
+        return event
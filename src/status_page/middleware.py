@@ -1,6 +1,45 @@
 # http://docs.sqlalchemy.org/en/rel_1_1/orm/contextual.html#using-thread-local-scope-with-web-applications
 # http://docs.sqlalchemy.org/en/latest/orm/session_basics.html#session-faq-whentocreate
 # https://eshlox.net/2017/07/28/integrate-sqlalchemy-with-falcon-framework/
+import cProfile
+import random
+import time
+import uuid
+
+import falcon
+
+from .utils import (AdmissionController, Counter, Gauge, Histogram, ResponseCompressor,
+                    StackSampler, logging, query_tracker, write_profile)
+
+
+logger = logging.getLogger(__name__)
+
+
+def render_body(resp):
+    """
+    The serialized body of a response as bytes, or None for streamed responses
+    """
+    if hasattr(resp, 'render_body'):
+        # Falcon 3 serializes media lazily
+        return resp.render_body()
+
+    if resp.body is not None:
+        return resp.body.encode('utf-8') if isinstance(resp.body, str) else resp.body
+
+    return resp.data
+
+
+def replace_body(resp, data):
+    """
+    Make `data` (bytes) the body of a response, whether it was set as text, data or media
+    """
+    if hasattr(resp, 'text'):
+        # Falcon 3 renamed body to text, it would win over data
+        resp.text = None
+    else:
+        resp.body = None
+
+    resp.data = data
 
 
 class SQLAlchemySessionManager(object):
@@ -19,3 +58,273 @@ class SQLAlchemySessionManager(object):
             if not req_succeeded:
                 resource.db.rollback()
             self.DBSession.remove()
+
+
+request_duration_seconds = Histogram(
+    'status_page_request_duration_seconds', "Time spent handling requests",
+    ['route', 'method'])
+
+response_size_bytes = Histogram(
+    'status_page_response_size_bytes', "Size of response bodies",
+    ['route', 'method'], buckets=(100, 1000, 10000, 100000, 1000000, 10000000))
+
+responses_total = Counter(
+    'status_page_responses_total', "Responses sent, by status code",
+    ['route', 'method', 'status'])
+
+request_db_queries = Histogram(
+    'status_page_request_db_queries', "Number of SQL statements executed per request",
+    ['route', 'method'], buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+
+request_db_seconds = Histogram(
+    'status_page_request_db_seconds', "Time spent executing SQL statements per request",
+    ['route', 'method'])
+
+
+class MetricsMiddleware(object):
+    """
+    Record latency, response size, status codes and database usage for every request
+
+    Routes are labelled by the name of the resource class that handled them, which keeps the
+    number of label values bounded no matter what URLs are requested.
+    """
+
+    def __init__(self, collector=None, tracker=query_tracker):
+        """
+        `collector` (optional) - A `MultiProcessCollector` to share metrics with other workers
+        `tracker` - The `QueryTracker` instrumenting the engine
+        """
+        self.collector = collector
+        self.tracker = tracker
+
+    def process_request(self, req, resp):
+        req.context['metrics_start'] = time.perf_counter()
+        self.tracker.start()
+
+    def process_resource(self, req, resp, resource, params):
+        req.context['metrics_route'] = resource.__class__.__name__
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        labels = {
+            'route': req.context.get('metrics_route', 'unmatched'),
+            'method': req.method,
+        }
+
+        request_duration_seconds.observe(
+            time.perf_counter() - req.context['metrics_start'], **labels)
+
+        responses_total.inc(status=str(resp.status).split(' ', 1)[0], **labels)
+
+        body = render_body(resp)
+        if body is not None:
+            response_size_bytes.observe(len(body), **labels)
+
+        stats = self.tracker.stop()
+        if stats is not None:
+            request_db_queries.observe(stats.count, **labels)
+            request_db_seconds.observe(stats.duration, **labels)
+
+        if self.collector is not None:
+            self.collector.flush()
+
+
+requests_in_flight = Gauge(
+    'status_page_requests_in_flight', "Requests admitted and not yet answered, by priority",
+    ['priority'])
+
+shed_requests_total = Counter(
+    'status_page_shed_requests_total', "Requests turned away because the process was overloaded",
+    ['priority', 'reason'])
+
+
+class AdmissionMiddleware(object):
+    """
+    Turn requests away by priority while the process is overloaded
+
+    A resource sets the priority of its responders with a `PRIORITY` dictionary of HTTP methods to
+    `AdmissionController` priorities. Without one, reads are low priority and writes normal. Add
+    this after `MetricsMiddleware`, so shed requests are counted like any other response.
+    """
+    READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, controller):
+        """
+        `controller` - The `AdmissionController` deciding which requests to admit
+        """
+        self.controller = controller
+
+    def priority(self, req, resource):
+        default = AdmissionController.LOW if req.method in self.READ_METHODS else \
+            AdmissionController.NORMAL
+        return getattr(resource, 'PRIORITY', {}).get(req.method, default)
+
+    def process_resource(self, req, resp, resource, params):
+        if resource is None:
+            return
+
+        priority = self.priority(req, resource)
+        reason = self.controller.try_admit(priority)
+
+        if reason is not None:
+            shed_requests_total.inc(priority=priority, reason=reason)
+            raise falcon.HTTPServiceUnavailable(
+                title="The server is overloaded",
+                description="Try again shortly.",
+                retry_after=1)
+
+        req.context['admission_priority'] = priority
+        requests_in_flight.inc(priority=priority)
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        priority = req.context.get('admission_priority')
+        if priority is not None:
+            self.controller.release()
+            requests_in_flight.dec(priority=priority)
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile a request and write the results to a local directory
+
+    A request is profiled when a site admin sends the `X-Profile` header (with a value of
+    'cprofile' or 'sample'), or when it is randomly picked at `sample_rate`. Only add this
+    middleware when profiling is wanted - requests that aren't profiled still pay for the header
+    lookup and the random draw.
+    """
+    HEADER = 'X-Profile'
+    MODES = ('cprofile', 'sample')
+
+    def __init__(self, directory, is_site_admin, sample_rate=0.0, mode='cprofile',
+                 tracker=query_tracker):
+        """
+        `directory` - Where the profiles are written
+        `is_site_admin` - A callable that takes the request and returns whether it was sent by a
+                          site admin
+        `sample_rate` - The fraction (0 to 1) of all requests to profile
+        `mode` - 'cprofile' for deterministic profiles (.prof), or 'sample' for sampled stacks in
+                 collapsed flame graph format (.folded)
+        `tracker` - The `QueryTracker` instrumenting the engine, used to capture SQL statements
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profiling mode '{mode}'")
+
+        self.directory = directory
+        self.is_site_admin = is_site_admin
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.tracker = tracker
+
+    def profiling_mode(self, req):
+        requested = req.get_header(self.HEADER)
+
+        if requested is not None:
+            requested = requested.lower()
+            if self.is_site_admin(req):
+                return requested if requested in self.MODES else self.mode
+            logger.audit("Ignoring the %s header from a user who is not a site admin", self.HEADER,
+                         action='profile', authorized=False)
+
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.mode
+
+        return None
+
+    def process_request(self, req, resp):
+        mode = self.profiling_mode(req)
+        if mode is None:
+            return
+
+        # Share the statement log with MetricsMiddleware if it is already tracking this request
+        stats = self.tracker.current
+        req.context['profiling_owns_tracker'] = stats is None
+        if stats is None:
+            stats = self.tracker.start()
+        stats.statements = []
+
+        if mode == 'sample':
+            req.context['profiling_sampler'] = StackSampler().start()
+        else:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is already active in this process
+                logger.warning("Could not profile %s %s", req.method, req.path)
+            else:
+                req.context['profiling_profile'] = profile
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        profile = req.context.get('profiling_profile')
+        sampler = req.context.get('profiling_sampler')
+
+        if profile is None and sampler is None:
+            return
+
+        if profile is not None:
+            profile.disable()
+        if sampler is not None:
+            sampler.stop()
+
+        if req.context.get('profiling_owns_tracker'):
+            stats = self.tracker.stop()
+        else:
+            stats = self.tracker.current
+
+        path = req.path.strip('/').replace('/', '_') or 'root'
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{req.method}-{path}-{uuid.uuid4().hex[:8]}"
+
+        written = write_profile(self.directory, name, profile=profile, sampler=sampler,
+                                statements=stats.statements if stats is not None else None)
+
+        resp.set_header('X-Profile-Id', name)
+        logger.info("Profiled %s %s into %s", req.method, req.path, ', '.join(written))
+
+
+compressed_responses_total = Counter(
+    'status_page_compressed_responses_total', "Responses compressed, by encoding and whether the "
+    "compressed body came from the cache",
+    ['encoding', 'cached'])
+
+
+class CompressionMiddleware(object):
+    """
+    Compress response bodies with the best encoding the client accepts
+
+    Add this after `MetricsMiddleware`, so response sizes are measured after compression. Streamed
+    responses, responses that already have a Content-Encoding, and bodies under the compressor's
+    minimum size are sent as they are.
+    """
+    COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+    def __init__(self, compressor=None):
+        """
+        `compressor` (optional) - A `ResponseCompressor`, with its defaults if not given
+        """
+        self.compressor = compressor if compressor is not None else ResponseCompressor()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        if resp.stream is not None or resp.get_header('Content-Encoding') is not None:
+            return
+
+        # The default media type (JSON) is only filled in after the middleware runs
+        if not (resp.content_type or 'application/json').startswith(self.COMPRESSIBLE_TYPES):
+            return
+
+        body = render_body(resp)
+        if body is None or len(body) < self.compressor.min_size:
+            return
+
+        # Caches must keep the compressed and uncompressed responses apart
+        resp.append_header('Vary', 'Accept-Encoding')
+
+        encoding = self.compressor.choose_encoding(req.get_header('Accept-Encoding'))
+        if encoding is None:
+            return
+
+        compressed, cached = self.compressor.compress(body, encoding)
+        if len(compressed) >= len(body):
+            return
+
+        replace_body(resp, compressed)
+        resp.set_header('Content-Encoding', encoding)
+        compressed_responses_total.inc(encoding=encoding, cached=str(cached).lower())
@@ -1,9 +1,11 @@
+from functools import lru_cache
+
 from sqlalchemy import event
-from sqlalchemy import (Column, ForeignKey, Index, text, UniqueConstraint)
+from sqlalchemy import (CheckConstraint, Column, ForeignKey, Index, text, UniqueConstraint)
 from sqlalchemy.dialects.postgresql import (ENUM, JSONB, TEXT, UUID)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from sqlalchemy.types import (Boolean, TIMESTAMP)
+from sqlalchemy.orm import (backref, relationship)
+from sqlalchemy.types import (Boolean, Integer, TIMESTAMP)
 
 from slugify import slugify
 
@@ -54,14 +56,19 @@ class Service(Base):
     name = Column(TEXT, nullable=False)
     description = Column(TEXT, nullable=False)
     slug = Column(TEXT, nullable=False, unique=True)
+    # Seconds between heartbeats, the service is marked down when it misses one. NULL for services
+    # that only report changes.
+    heartbeat_interval = Column(Integer, nullable=True)
 
     ix_services_slug = Index(slug)
 
     groups = relationship('ServiceGroup', backref='services', secondary='service_groups_services')
 
     events = relationship('Event', backref='service', cascade='delete, delete-orphan')
+    incidents = relationship('Incident', backref='service', cascade='delete, delete-orphan')
     ephemeral_notifications = relationship('EphemeralNotification', backref='service', cascade='delete, delete-orphan')
     allowed_users = relationship('Permission', backref='service', cascade='delete, delete-orphan')
+    webhooks = relationship('Webhook', backref='service', cascade='delete, delete-orphan')
 
     def __str__(self):
         return self.name
@@ -91,6 +98,45 @@ class Event(Base):
         return f"{self.service} -> {self.status.upper()}"
 
 
+# The newest events of a service (eg: its current status) are an index scan away
+Index('ix_events_service_id_when', Event.service_id, Event.when)
+
+
+class Incident(Base):
+    '''A span of time a service wasn't up, from its first event that isn't up to the next up event'''
+    __tablename__ = 'incidents'
+
+    id = Column(UUID(as_uuid=True),
+                primary_key=True,
+                # This requires the uuid-ossp extension
+                server_default=text('uuid_generate_v4()'))
+    service_id = Column(UUID(as_uuid=True), ForeignKey('services.id'), nullable=False)
+    # The worst status during the incident
+    status = Column(ENUM('up', 'down', 'limited', name='status_enum', create_type=False),
+                    nullable=False)
+    started_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    # NULL while the incident is open
+    ended_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    start_event_id = Column(UUID(as_uuid=True), ForeignKey('events.id'), nullable=False)
+    end_event_id = Column(UUID(as_uuid=True), ForeignKey('events.id'), nullable=True)
+
+    start_event = relationship('Event', foreign_keys=[start_event_id])
+    end_event = relationship('Event', foreign_keys=[end_event_id])
+
+    def __str__(self):
+        return f"{self.service} {self.status.upper()} since {self.started_at.isoformat()}"
+
+
+# The incidents of a service, newest first
+Index('ix_incidents_service_id_started_at', Incident.service_id, Incident.started_at)
+# Every incident, newest first
+Index('ix_incidents_started_at', Incident.started_at)
+# Only the open incidents, so listing them (or finding the one to close) reads nothing else. A
+# service has at most one.
+Index('ix_incidents_open', Incident.service_id, unique=True,
+      postgresql_where=Incident.ended_at.is_(None))
+
+
 class EphemeralNotification(Base):
     __tablename__ = 'ephemeral_notifications'
     __table_args__ = (UniqueConstraint('username', 'service_id'),)
@@ -104,6 +150,9 @@ class EphemeralNotification(Base):
     service_id = Column(UUID(as_uuid=True), ForeignKey('services.id'), nullable=False)
     chat = Column(Boolean, nullable=False)
     email = Column(Boolean, nullable=False)
+    # Bumped whenever the subscription is renewed, so the dispatcher never consumes one renewed
+    # while it was sending the notifications
+    version = Column(Integer, nullable=False, server_default=text('1'))
 
     # service = relationship('Service', backref='ephemeral_notifications', cascade='delete, delete-orphan')
 
@@ -111,6 +160,92 @@ class EphemeralNotification(Base):
         return f"Notify {self.username} via {'chat' if self.chat else 'email' if self.email else 'None'} about {self.service}"
 
 
+# The unique constraint leads with username, so it can't be used to find subscribers
+Index('ix_ephemeral_notifications_service_id', EphemeralNotification.service_id)
+
+
+class Webhook(Base):
+    '''An endpoint that is sent the events of a service, or of every service in a group'''
+    __tablename__ = 'webhooks'
+    __table_args__ = (
+        # Exactly one of them
+        CheckConstraint('(service_id IS NULL) <> (group_id IS NULL)',
+                        name='webhooks_service_or_group'),
+    )
+
+    id = Column(UUID(as_uuid=True),
+                primary_key=True,
+                # This requires the uuid-ossp extension
+                server_default=text('uuid_generate_v4()'))
+    endpoint = Column(TEXT, nullable=False)
+    # Signs the payloads (HMAC-SHA256), so the endpoint can tell they're from us
+    secret = Column(TEXT, nullable=True)
+    service_id = Column(UUID(as_uuid=True), ForeignKey('services.id'), nullable=True)
+    group_id = Column(UUID(as_uuid=True), ForeignKey('service_groups.id'), nullable=True)
+    # Only send the events that change the status of a service, not every heartbeat
+    changes_only = Column(Boolean, nullable=False)
+    created_by = Column(TEXT, nullable=False)
+
+    group = relationship('ServiceGroup',
+                         backref=backref('webhooks', cascade='delete, delete-orphan'))
+
+    def __str__(self):
+        return f"Webhook {self.endpoint} for {self.service or self.group}"
+
+
+# The webhooks of a new event are looked up with every event that's recorded
+Index('ix_webhooks_service_id', Webhook.service_id)
+Index('ix_webhooks_group_id', Webhook.group_id)
+
+
+class WebhookDelivery(Base):
+    '''
+    The outbox of the webhooks: an event to send to a webhook
+
+    Deliveries are written in the same transaction as their event, and sent later by the
+    `WebhookDispatcher`, so recording an event never waits for a webhook.
+    '''
+    __tablename__ = 'webhook_deliveries'
+
+    id = Column(UUID(as_uuid=True),
+                primary_key=True,
+                # This requires the uuid-ossp extension
+                server_default=text('uuid_generate_v4()'))
+    # The database removes the deliveries of deleted webhooks and events, without loading them
+    webhook_id = Column(UUID(as_uuid=True), ForeignKey('webhooks.id', ondelete='CASCADE'),
+                        nullable=False)
+    event_id = Column(UUID(as_uuid=True), ForeignKey('events.id', ondelete='CASCADE'),
+                      nullable=False)
+    # pending   - waiting to be sent (again)
+    # delivered - the endpoint accepted it
+    # dead      - gave up on it, it's kept until it's retried or the webhook is deleted
+    state = Column(ENUM('pending', 'delivered', 'dead', name='delivery_state_enum',
+                        create_type=False),
+                   nullable=False)
+    attempts = Column(Integer, nullable=False)
+    # When to send a pending delivery, pushed back while a dispatcher is sending it
+    next_attempt_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    delivered_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    last_error = Column(TEXT, nullable=True)
+
+    webhook = relationship('Webhook',
+                           backref=backref('deliveries', cascade='all, delete-orphan',
+                                           passive_deletes=True))
+    event = relationship('Event')
+
+    def __str__(self):
+        return f"{self.event} to {self.webhook} ({self.state})"
+
+
+# Only the pending deliveries, in the order they are due, so claiming them reads nothing else
+Index('ix_webhook_deliveries_due', WebhookDelivery.next_attempt_at,
+      postgresql_where=WebhookDelivery.state == 'pending')
+# The deliveries of a webhook, newest first
+Index('ix_webhook_deliveries_webhook_id_created_at', WebhookDelivery.webhook_id,
+      WebhookDelivery.created_at)
+
+
 class DisplayPreferences(Base):
     __tablename__ = 'display_preferences'
 
@@ -147,14 +282,20 @@ class Permission(Base):
         return f"{self.username} ({self.permission} for {self.service})"
 
 
+@lru_cache(maxsize=4096)
+def make_slug(name):
+    '''Slugify a name, the same names are slugified over and over again'''
+    return slugify(name, to_lower=True)
+
+
 # http://docs.sqlalchemy.org/en/latest/orm/events.html#sqlalchemy.orm.events.AttributeEvents.set
 @event.listens_for(ServiceGroup.name, 'set')
 def set_service_group_slug(target, value, oldvalue, initiator):
     '''Set the slug when the name changes'''
-    target.slug = slugify(value, to_lower=True)
+    target.slug = make_slug(value)
 
 
 @event.listens_for(Service.name, 'set')
 def set_service_slug(target, value, oldvalue, initiator):
     '''Set the slug when the name changes'''
-    target.slug = slugify(value, to_lower=True)
+    target.slug = make_slug(value)
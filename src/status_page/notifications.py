@@ -0,0 +1,249 @@
+'''
+Deliver ephemeral (one time) notifications when services change status
+'''
+import json
+import smtplib
+import threading
+import urllib.request
+from collections import (defaultdict, namedtuple)
+from email.message import EmailMessage
+
+from sqlalchemy import (and_, bindparam)
+
+from .models import EphemeralNotification
+from .utils import (BatchingWorker, TokenBucket, logging)
+
+
+__all__ = [
+    'Notification', 'Transport', 'SMTPTransport', 'ChatTransport', 'LocalTransport',
+    'NotificationDispatcher',
+]
+
+logger = logging.getLogger(__name__)
+
+
+Notification = namedtuple('Notification', ['username', 'channel', 'transition'])
+
+
+def render_subject(transition):
+    return _(f"{transition.service_name} is {transition.status}")
+
+
+def render_body(transition):
+    previous = transition.previous_status or _("unknown")
+    return _(f"{transition.service_name} changed from {previous} to {transition.status} at "
+             f"{transition.when.isoformat()}. See /services/{transition.service_slug}/status for "
+             "details.")
+
+
+class Transport(object):
+    """
+    Delivers batches of notifications for a single channel ('chat' or 'email')
+
+    `send_batch()` should raise if the batch could not be delivered, so the subscriptions are
+    kept for the next status change.
+    """
+    channel = None
+
+    def __init__(self, rate=10, burst=None):
+        self.bucket = TokenBucket(rate, burst)
+
+    def send_batch(self, notifications):
+        raise NotImplementedError("Subclasses of Transport must implement send_batch() themselves")
+
+
+class SMTPTransport(Transport):
+    channel = 'email'
+
+    def __init__(self, host='localhost', port=25, sender='status-page@localhost', domain=None,
+                 timeout=10, **kwargs):
+        """
+        `domain` (optional) - Appended to usernames that are not already email addresses
+        """
+        super().__init__(**kwargs)
+
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.domain = domain
+        self.timeout = timeout
+
+    def address(self, username):
+        if '@' in username or not self.domain:
+            return username
+        return f"{username}@{self.domain}"
+
+    def send_batch(self, notifications):
+        # One connection for the whole batch
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            for notification in notifications:
+                message = EmailMessage()
+                message['From'] = self.sender
+                message['To'] = self.address(notification.username)
+                message['Subject'] = render_subject(notification.transition)
+                message.set_content(render_body(notification.transition))
+
+                smtp.send_message(message)
+
+
+class ChatTransport(Transport):
+    channel = 'chat'
+
+    def __init__(self, webhook_url, timeout=10, **kwargs):
+        """
+        Post notifications to an incoming chat webhook (Slack/Mattermost compatible)
+        """
+        super().__init__(**kwargs)
+
+        self.webhook_url = webhook_url
+        self.timeout = timeout
+
+    def send_batch(self, notifications):
+        # Mention every subscriber once per transition instead of sending one message each
+        by_transition = defaultdict(list)
+        for notification in notifications:
+            by_transition[notification.transition].append(notification.username)
+
+        for transition, usernames in by_transition.items():
+            mentions = ' '.join(f"@{username}" for username in usernames)
+            payload = json.dumps({"text": f"{mentions} {render_body(transition)}"}).encode('utf-8')
+
+            request = urllib.request.Request(
+                self.webhook_url, data=payload, headers={'Content-Type': 'application/json'})
+
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+
+
+class LocalTransport(Transport):
+    def __init__(self, channel, **kwargs):
+        """
+        Keep notifications in memory instead of sending them anywhere
+
+        This stands in for the real chat and email transports in development and testing.
+        """
+        super().__init__(**kwargs)
+
+        self.channel = channel
+        self.outbox = []
+        self._lock = threading.Lock()
+
+    def send_batch(self, notifications):
+        with self._lock:
+            self.outbox.extend(notifications)
+
+
+class NotificationDispatcher(BatchingWorker):
+    def __init__(self, session_factory, transports, batch_size=100, **kwargs):
+        """
+        Fan status transitions out to ephemeral subscribers in a background thread
+
+        `session_factory` - Creates the SQLAlchemy sessions used by the worker thread
+        `transports` - An iterable of `Transport` objects, at most one per channel
+        `batch_size` - The maximum number of notifications handed to a transport at once
+        """
+        super().__init__('notification-dispatcher', batch_size=batch_size, **kwargs)
+
+        self.session_factory = session_factory
+        self.transports = {transport.channel: transport for transport in transports}
+
+    def __call__(self, transition):
+        """
+        `EventIngestor` listener - never blocks the request that recorded the event
+        """
+        self.submit(transition)
+
+    def process_batch(self, transitions):
+        db = self.session_factory()
+        try:
+            for transition in transitions:
+                self.dispatch(db, transition)
+        finally:
+            db.close()
+
+    def dispatch(self, db, transition):
+        # Uses the ix_ephemeral_notifications_service_id index
+        subscriptions = db.query(EphemeralNotification)\
+            .filter(EphemeralNotification.service_id == transition.service_id)\
+            .all()
+
+        if not subscriptions:
+            return
+
+        pending = defaultdict(list)
+        for subscription in subscriptions:
+            for channel in ('chat', 'email'):
+                if getattr(subscription, channel):
+                    pending[channel].append(subscription)
+
+        # The channels each subscription was notified on
+        delivered = defaultdict(set)
+        for channel, channel_subscriptions in pending.items():
+            transport = self.transports.get(channel)
+
+            if transport is None:
+                logger.warning("No transport configured for %s notifications", channel)
+                continue
+
+            for start in range(0, len(channel_subscriptions), self.batch_size):
+                batch = channel_subscriptions[start:start + self.batch_size]
+
+                transport.bucket.consume(len(batch))
+
+                try:
+                    transport.send_batch([
+                        Notification(subscription.username, channel, transition)
+                        for subscription in batch
+                    ])
+                except Exception:
+                    logger.exception("Could not deliver %d %s notifications for %r",
+                                     len(batch), channel, transition)
+                    continue
+
+                for subscription in batch:
+                    delivered[subscription.id].add(channel)
+
+        consumed = self.consume(db, subscriptions, delivered)
+
+        if consumed:
+            logger.info("Delivered %d ephemeral notifications for %r", consumed, transition)
+
+    def consume(self, db, subscriptions, delivered):
+        """
+        Delete the subscriptions that were notified on all of their channels, and turn off the
+        channels that were notified on for the others, so only those are retried on the next
+        status change
+
+        Only subscriptions still at the version that was read are changed, the ones renewed
+        meanwhile are kept as they are. Returns the number of notifications delivered.
+        """
+        table = EphemeralNotification.__table__
+        read = and_(table.c.id == bindparam('_id'), table.c.version == bindparam('_version'))
+
+        finished = []
+        remaining = []
+        for subscription in subscriptions:
+            channels = delivered.get(subscription.id)
+            if not channels:
+                continue
+
+            chat = subscription.chat and 'chat' not in channels
+            email = subscription.email and 'email' not in channels
+            key = {'_id': subscription.id, '_version': subscription.version}
+
+            if chat or email:
+                remaining.append(dict(key, _chat=chat, _email=email))
+            else:
+                finished.append(key)
+
+        if finished:
+            db.execute(table.delete().where(read), finished)
+
+        if remaining:
+            db.execute(table.update().where(read).values(
+                chat=bindparam('_chat'), email=bindparam('_email'), version=table.c.version + 1),
+                remaining)
+
+        db.commit()
+
+        return sum(len(channels) for channels in delivered.values())
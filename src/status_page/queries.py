@@ -0,0 +1,321 @@
+'''
+Baked queries for the hot, fixed-shape lookups
+
+Building a SQLAlchemy `Query` and compiling it to SQL costs more CPU than most of these queries
+take to run. A baked query is only built and compiled the first time, after that every request
+reuses the cached SQL and just binds new parameters.
+
+http://docs.sqlalchemy.org/en/rel_1_3/orm/extensions/baked.html
+
+Everything that varies per request must be a `bindparam()`, the lambdas must never close over
+request data (they are only called once, the results are cached by their code).
+'''
+from sqlalchemy import (DateTime, and_, bindparam, cast, func, or_, select, true)
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import (aliased, contains_eager, defer)
+
+from .models import (Event, Incident, Permission, Service, ServiceGroup, ServiceServiceGroup)
+
+
+__all__ = [
+    'get_event', 'get_service', 'get_user_permission', 'heartbeat_services', 'latest_events',
+    'lock_service', 'newest_event', 'open_incident', 'service_status_events', 'status_events',
+]
+
+bakery = baked.bakery()
+
+
+_service_by_slug = bakery(lambda session: session.query(Service))
+_service_by_slug += lambda q: q.filter(Service.slug == bindparam('slug'))
+
+
+def get_service(db, slug):
+    """
+    The service with the slug `slug`, raises `NoResultFound` if there is none
+    """
+    return _service_by_slug(db).params(slug=slug).one()
+
+
+_user_permission = bakery(lambda session: session.query(Permission))
+_user_permission += lambda q: q\
+    .join(Service, Service.id == Permission.service_id)\
+    .filter(Service.slug == bindparam('slug'),
+            Permission.type.in_(bindparam('types', expanding=True)),
+            Permission.username == bindparam('username'))
+
+
+def get_user_permission(db, slug, username, types=('service-admin',)):
+    """
+    The permission `username` has for the service `slug`, if it's one of `types`
+
+    Raises `NoResultFound` if there is none.
+    """
+    return _user_permission(db).params(slug=slug, username=username, types=list(types)).one()
+
+
+_event = bakery(lambda session: session.query(Event))
+_event += lambda q: q\
+    .join(Service)\
+    .filter(Service.slug == bindparam('slug'), Event.id == bindparam('event_id'))
+
+
+def get_event(db, slug, event_id):
+    """
+    The event `event_id` of the service `slug`, raises `NoResultFound` if there is none
+    """
+    return _event(db).params(slug=slug, event_id=event_id).one()
+
+
+def _newest_event_when(name, *criteria):
+    # Lateral, so it's looked up once per service: a backwards scan of ix_events_service_id_when
+    # that stops at the first match
+    return select([Event.when.label('when')])\
+        .where(and_(Event.service_id == Service.id, *criteria))\
+        .order_by(Event.when.desc())\
+        .limit(1)\
+        .correlate(Service.__table__)\
+        .lateral(name)
+
+
+def _status_window(*criteria):
+    """
+    The events since (and including) the last 'up' event of each service, numbered newest first
+
+    Services that have never been up have all of their events. Only the newest `limit` (bind
+    parameter) events of each service, and one more to tell whether there are any older ones, are
+    selected and numbered in the database, so nothing else is loaded or counted. The `since` bind
+    parameter (optional) leaves out older events, except for the newest event of each service.
+    The `at` bind parameter (optional) turns back time: only the events until then count, as if
+    it was `at` now.
+
+    Every step looks events up by service and time, so the index on both does all of the work
+    instead of a scan of every event, for any `at`.
+
+    Returns an `Event` alias of the window, and the window itself, whose `position` column is 1
+    for the newest event of a service, whose `truncated` column tells whether it has more than
+    `limit` events, and whose `start` column is when its window starts (inclusive), or NULL if it
+    has no lower bound. Filter on `position <= limit` to leave out the extra event.
+
+    `criteria` - Restrict the services
+    """
+    timestamp = DateTime(timezone=True)
+    since = bindparam('since', type_=timestamp)
+    until = func.coalesce(bindparam('at', type_=timestamp), cast('infinity', timestamp))
+
+    last_up = _newest_event_when('last_up', Event.status == 'up', Event.when <= until)
+    latest = _newest_event_when('latest', Event.when <= until)
+
+    in_window = and_(Event.service_id == Service.id,
+                     Event.when >= func.coalesce(last_up.c.when, cast('-infinity', timestamp)),
+                     Event.when <= until,
+                     or_(since.is_(None), Event.when >= since,
+                         # The newest event is always included, it's the current status
+                         Event.when == latest.c.when))
+
+    # The newest `limit` events of each service and one more, a backwards index range scan per
+    # service that stops there however many events there are. The limit also keeps PostgreSQL
+    # from flattening this into a scan of every event.
+    events = select([Event.__table__])\
+        .where(in_window)\
+        .order_by(Event.when.desc())\
+        .limit(bindparam('limit') + 1)\
+        .correlate(Service.__table__, last_up, latest)\
+        .lateral('service_events')
+
+    window = select([
+        events,
+        func.row_number().over(partition_by=events.c.service_id,
+                               order_by=events.c.when.desc()).label('position'),
+        (func.count().over(partition_by=events.c.service_id) > bindparam('limit'))
+        .label('truncated'),
+        # GREATEST ignores NULLs, so this is NULL only without both
+        func.greatest(last_up.c.when, since).label('start'),
+    ])\
+        .select_from(Service.__table__
+                     .outerjoin(last_up, true())
+                     .outerjoin(latest, true())
+                     .join(events, true()))\
+        .where(and_(true(), *criteria))\
+        .alias('status_window')
+
+    return aliased(Event, window), window
+
+
+_service_window_event, _service_window = _status_window(Service.slug == bindparam('slug'))
+
+_service_status_events = bakery(lambda session: session.query(
+    _service_window_event, _service_window.c.truncated, _service_window.c.start))
+_service_status_events += lambda q: q\
+    .filter(_service_window.c.position <= bindparam('limit'))\
+    .order_by(_service_window_event.when.desc())
+
+
+def service_status_events(db, slug, limit, since=None, at=None):
+    """
+    The events of the service `slug` since (and including) its last 'up' event, newest first
+
+    Returns `(event, truncated, start)` tuples, where `truncated` tells whether older events since
+    the last 'up' event were left out, and `start` is when they start (see `_status_window`).
+
+    `limit` - The most events to return
+    `since` (optional) - Leave out events older than this datetime
+    `at` (optional) - The events as they were at this datetime, instead of now
+    """
+    return _service_status_events(db).params(slug=slug, limit=limit, since=since, at=at).all()
+
+
+_all_window_event, _all_window = _status_window()
+
+
+def _status_events_query(session):
+    # Not sure if this is strictly required, since SQLAlchemy doesn't seem to be running any
+    # additional queries when it loads event.service.slug, but this is working
+    service_alias = aliased(Service)
+
+    return session.query(_all_window_event, _all_window.c.truncated, _all_window.c.start)\
+        .join(service_alias, service_alias.id == _all_window_event.service_id)\
+        .filter(_all_window.c.position <= bindparam('limit'))\
+        .order_by(service_alias.name.asc(), _all_window_event.when.desc())\
+        .options(contains_eager(_all_window_event.service, alias=service_alias))
+
+
+def _selected_service_ids(session):
+    return session.query(Service.id)\
+        .filter(Service.slug.in_(bindparam('services', expanding=True)))\
+        .union(
+            session.query(ServiceServiceGroup.service_id)
+            .join(ServiceGroup, ServiceGroup.id == ServiceServiceGroup.group_id)
+            .filter(ServiceGroup.slug.in_(bindparam('groups', expanding=True))))
+
+
+def _filter_selected_services(q):
+    return q.filter(_all_window_event.service_id.in_(_selected_service_ids(q.session).subquery()))
+
+
+_status_events = bakery(_status_events_query)
+
+
+def status_events(db, limit, since=None, at=None, services=None, groups=None, load_extra=True):
+    """
+    The events of every service since (and including) its last 'up' event
+
+    Ordered by service name, then newest first. Returns `(event, truncated, start)` tuples, where
+    `truncated` tells whether older events of that service since its last 'up' event were left
+    out, and `start` is when they start (see `_status_window`).
+
+    `limit` - The most events to return per service
+    `since` (optional) - Leave out events older than this datetime
+    `at` (optional) - The events as they were at this datetime, instead of now
+    `services` (optional) - Only include these service slugs...
+    `groups` (optional) - ...and the services in these service group slugs
+    `load_extra` - Whether to load the (potentially large) `extra` column at all
+    """
+    q = _status_events
+    params = {'limit': limit, 'since': since, 'at': at}
+
+    # Every combination of these steps is baked (and cached) separately
+    if services or groups:
+        q = q + _filter_selected_services
+        params.update(services=list(services or []), groups=list(groups or []))
+
+    if not load_extra:
+        q = q + (lambda q: q.options(defer(_all_window_event.extra)))
+
+    return q(db).params(**params).all()
+
+
+_latest_events = bakery(lambda session: session.query(Service, Event))
+_latest_events += lambda q: q\
+    .outerjoin(Event, Event.service_id == Service.id)\
+    .filter(Service.id.in_(_selected_service_ids(q.session).subquery()))\
+    .distinct(Service.id)\
+    .order_by(Service.id, Event.when.desc())
+
+
+def latest_events(db, services=(), groups=()):
+    """
+    The newest event of each of the selected services, in a single query
+
+    Returns `(service, event)` tuples ordered by service name, `event` is `None` for services
+    without events.
+
+    `services` - Service slugs...
+    `groups` - ...and service group slugs, whose services are included too
+    """
+    rows = _latest_events(db).params(services=list(services), groups=list(groups)).all()
+
+    # DISTINCT ON needs the rows ordered by service first
+    return sorted(rows, key=lambda row: row[0].name)
+
+
+def _heartbeat_services_query(session):
+    newest_event = select([Event.status, Event.when])\
+        .where(Event.service_id == Service.id)\
+        .order_by(Event.when.desc())\
+        .limit(1)\
+        .lateral('newest_event')
+
+    return session.query(Service.id, Service.heartbeat_interval, newest_event.c.status,
+                         newest_event.c.when)\
+        .outerjoin(newest_event, true())\
+        .filter(Service.heartbeat_interval.isnot(None))
+
+
+_heartbeat_services = bakery(_heartbeat_services_query)
+
+
+_newest_event = bakery(lambda session: session.query(Event.status, Event.when))
+_newest_event += lambda q: q\
+    .filter(Event.service_id == bindparam('service_id'))\
+    .order_by(Event.when.desc())\
+    .limit(1)
+
+
+def heartbeat_services(db):
+    """
+    Every service that is expected to send heartbeats, with the status and time of its newest event
+
+    Returns `(service_id, heartbeat_interval, status, when)` tuples, `status` and `when` are `None`
+    for services without events.
+    """
+    return _heartbeat_services(db).all()
+
+
+def newest_event(db, service_id):
+    """
+    The `(status, when)` of the newest event of a service, or `None` if it has no events
+    """
+    return _newest_event(db).params(service_id=service_id).first()
+
+
+# FOR NO KEY UPDATE, so rows that only reference the service (events, incidents, deliveries) can
+# still be inserted meanwhile
+_lock_service = bakery(lambda session: session.query(Service.id))
+_lock_service += lambda q: q\
+    .filter(Service.id == bindparam('service_id'))\
+    .with_for_update(key_share=True)
+
+
+def lock_service(db, service_id):
+    """
+    Lock the row of a service until the end of the transaction, so its events are recorded one at a
+    time
+    """
+    _lock_service(db).params(service_id=service_id).scalar()
+
+
+_open_incident = bakery(lambda session: session.query(Incident))
+_open_incident += lambda q: q\
+    .filter(Incident.service_id == bindparam('service_id'), Incident.ended_at.is_(None))\
+    .order_by(Incident.started_at.desc())\
+    .limit(1)\
+    .with_for_update()
+
+
+def open_incident(db, service_id):
+    """
+    The open incident of a service, locked until the end of the transaction, or `None`
+
+    Uses the partial index of open incidents.
+    """
+    return _open_incident(db).params(service_id=service_id).first()
@@ -2,8 +2,20 @@
 Reusable utilities
 '''
 
+from .admission import *  # noqa
 from .authentication import *  # noqa
+from .cache import *  # noqa
+from .compression import *  # noqa
 from .jsonbpath import *  # noqa
 from .logging import *  # noqa
+from .metrics import *  # noqa
 from .pagination import *  # noqa
+from .profiling import *  # noqa
+from .ratelimit import *  # noqa
+from .resilience import *  # noqa
+from .singleflight import *  # noqa
+from .sqltracking import *  # noqa
+from .streaming import *  # noqa
 from .to_dict import *  # noqa
+from .validation import *  # noqa
+from .workers import *  # noqa
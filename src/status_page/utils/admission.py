@@ -0,0 +1,155 @@
+'''
+Shed the least important requests first when a process is overloaded
+
+Dashboards polling the read routes shouldn't keep bots from reporting events. While a process has
+too many requests in flight, or requests have been waiting too long for a database connection, the
+`AdmissionController` turns requests away by priority: reads go first, then the other writes, and
+the requests that matter most (recording events) only when nothing else is left to shed.
+'''
+import itertools
+import threading
+import time
+
+from sqlalchemy.pool import QueuePool
+
+from .metrics import Gauge
+
+
+__all__ = ['AdmissionController', 'PoolWaitTracker', 'TrackedQueuePool', 'pool_waits']
+
+
+db_pool_waiting = Gauge(
+    'status_page_db_pool_waiting', "Threads waiting for a database connection from the pool")
+
+
+class PoolWaitTracker(object):
+    def __init__(self, clock=time.monotonic):
+        """
+        Keeps track of the threads waiting for a database connection
+
+        `clock` (optional) - A monotonic clock function, mostly useful for testing
+        """
+        self.clock = clock
+
+        self._waiting = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def start(self):
+        """
+        A thread started waiting, pass what this returns to `stop()` once it's done
+        """
+        with self._lock:
+            token = next(self._tokens)
+            self._waiting[token] = self.clock()
+
+        db_pool_waiting.inc()
+        return token
+
+    def stop(self, token):
+        with self._lock:
+            self._waiting.pop(token, None)
+
+        db_pool_waiting.dec()
+
+    def longest_wait(self):
+        """
+        How long (in seconds) the thread that has been waiting the longest has been waiting, 0 if
+        none are
+        """
+        with self._lock:
+            if not self._waiting:
+                return 0.0
+            oldest = min(self._waiting.values())
+
+        return max(0.0, self.clock() - oldest)
+
+
+pool_waits = PoolWaitTracker()
+
+
+class TrackedQueuePool(QueuePool):
+    """
+    A `QueuePool` that reports the threads waiting for one of its connections to `pool_waits`
+
+    Pass it as the `poolclass` of an engine.
+    """
+
+    def _do_get(self):
+        token = pool_waits.start()
+        try:
+            return super()._do_get()
+        finally:
+            pool_waits.stop(token)
+
+
+class AdmissionController(object):
+    LOW = 'low'
+    NORMAL = 'normal'
+    HIGH = 'high'
+
+    # The share of `max_in_flight` that requests of each priority may fill
+    IN_FLIGHT_SHARES = {LOW: 0.5, NORMAL: 0.8, HIGH: 1.0}
+
+    # How many times `max_pool_wait` requests of each priority put up with, high priority requests
+    # wait as long as the pool lets them
+    POOL_WAIT_FACTORS = {LOW: 1, NORMAL: 2, HIGH: None}
+
+    # Why requests are shed
+    IN_FLIGHT = 'in-flight'
+    POOL_WAIT = 'pool-wait'
+
+    def __init__(self, max_in_flight=None, max_pool_wait=None, pool_waits=pool_waits):
+        """
+        Admits requests by priority while a process is overloaded
+
+        `max_in_flight` (optional) - The most requests the process handles at once. Low priority
+                                     requests are shed once half of that are in flight, normal
+                                     ones at 80%.
+        `max_pool_wait` (optional) - Seconds a request may wait for a database connection before
+                                     low priority requests are shed, normal ones are shed after
+                                     twice as long
+        `pool_waits` - The `PoolWaitTracker` of the database engine's pool
+        """
+        self.max_in_flight = max_in_flight
+        self.max_pool_wait = max_pool_wait
+        self.pool_waits = pool_waits
+
+        self.in_flight_limits = {
+            priority: max(1, int(max_in_flight * share)) if max_in_flight else None
+            for priority, share in self.IN_FLIGHT_SHARES.items()
+        }
+
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def try_admit(self, priority):
+        """
+        Count a request of `priority` in, if the process has room for it
+
+        Returns None when the request is admitted (call `release()` once it's done), otherwise why
+        it's shed: IN_FLIGHT or POOL_WAIT.
+        """
+        factor = self.POOL_WAIT_FACTORS[priority]
+        if self.max_pool_wait and factor is not None and \
+                self.pool_waits.longest_wait() > self.max_pool_wait * factor:
+            return self.POOL_WAIT
+
+        limit = self.in_flight_limits[priority]
+        with self._lock:
+            if limit is not None and self._in_flight >= limit:
+                return self.IN_FLIGHT
+            self._in_flight += 1
+
+        return None
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
@@ -3,14 +3,20 @@ from functools import wraps
 from falcon import (HTTPMissingHeader, HTTPUnauthorized)
 
 import jwt
+import jwt.algorithms
 
 from .logging import logging
+from .metrics import (Histogram, timed)
 
 
 __all__ = ['authenticate', 'JWTAuth', 'JWTAPIKeyAuth']
 
 logger = logging.getLogger(__name__)
 
+jwt_verification_seconds = Histogram(
+    'status_page_jwt_verification_seconds', "Time spent decoding and verifying JWTs",
+    ['algorithm'], buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05))
+
 
 def authenticate(auth_expr, unauthenticated_exception=HTTPUnauthorized):
     """
@@ -62,12 +68,12 @@ class CombinationNode(AuthNode):
 
     def is_authenticated(self, *args, **kwargs):
         if self.operation == self.or_:
-            logger.audit(f"Attempting to authenticate via OR operation")
+            logger.audit("Attempting to authenticate via OR operation")
             return (self.left.is_authenticated(*args, **kwargs) or
                     self.right.is_authenticated(*args, **kwargs))
 
         elif self.operation == self.and_:
-            logger.audit(f"Attempting to authenticate via AND operation")
+            logger.audit("Attempting to authenticate via AND operation")
             return (self.left.is_authenticated(*args, **kwargs) and
                     self.right.is_authenticated(*args, **kwargs))
 
@@ -91,16 +97,22 @@ class JWTAuth(AuthNode):
     def __init__(self, *args, private_key=None, public_key=None, secret_key=None, algorithm=None,
                  http_header_prefix='Bearer', verify_function=None, userdata_function=None,
                  options=None, **kwargs):
+        """
+        The keys (and the header prefix) can also be callables returning them, so defining the
+        directives doesn't require any configuration. They're called whenever they're used, and an
+        application built from another configuration gets its own keys - each key is only parsed
+        once, though.
+        """
         super().__init__(*args, **kwargs)
 
         if algorithm not in JWTAuth.SUPPORTED_ALGORITHMS:
             raise RuntimeError("Unsupported algorithm type '{algorithm}'")
 
-        self.private_key = private_key
-        self.public_key = public_key
-        self.secret_key = secret_key
+        self._private_key = private_key
+        self._public_key = public_key
+        self._secret_key = secret_key
         self.algorithm = algorithm
-        self.http_header_prefix = http_header_prefix
+        self._http_header_prefix = http_header_prefix
         self.options = options
 
         self.verify_function = verify_function
@@ -108,6 +120,51 @@ class JWTAuth(AuthNode):
 
         self.kwargs = kwargs
 
+        # attribute -> (key, parsed key)
+        self._parsed_keys = {}
+
+    def _load_key(self, attribute):
+        key = getattr(self, attribute)
+
+        if callable(key):
+            key = key()
+
+        if key is None:
+            return None
+
+        # Parse PEM keys into key objects once, instead of on every encode() and decode()
+        parsed = self._parsed_keys.get(attribute)
+        if parsed is None or parsed[0] != key:
+            parsed = (key, jwt.algorithms.get_default_algorithms()[self.algorithm].prepare_key(key))
+            self._parsed_keys[attribute] = parsed
+
+        return parsed[1]
+
+    def load_keys(self):
+        """
+        Load (and parse) the keys now instead of on first use
+        """
+        for attribute in ('_private_key', '_public_key', '_secret_key'):
+            self._load_key(attribute)
+
+    @property
+    def http_header_prefix(self):
+        if callable(self._http_header_prefix):
+            return self._http_header_prefix()
+        return self._http_header_prefix
+
+    @property
+    def private_key(self):
+        return self._load_key('_private_key')
+
+    @property
+    def public_key(self):
+        return self._load_key('_public_key')
+
+    @property
+    def secret_key(self):
+        return self._load_key('_secret_key')
+
     def encode(self, payload, headers=None):
         if self.algorithm.startswith('HS'):
             key = self.secret_key
@@ -117,21 +174,23 @@ class JWTAuth(AuthNode):
         return jwt.encode(payload, key, algorithm=self.algorithm, headers=headers)
 
     def decode(self, token):
-        return jwt.decode(token, self.public_key, algorithms=[self.algorithm],
-                          options=self.options, **self.kwargs)
+        with timed(jwt_verification_seconds, algorithm=self.algorithm):
+            return jwt.decode(token, self.public_key, algorithms=[self.algorithm],
+                              options=self.options, **self.kwargs)
 
     def get_token(self, req, *args, **kwargs):
         token = req.auth
+        prefix = self.http_header_prefix
 
         if not token:
-            raise jwt.InvalidTokenError(f"Missing authorization '{self.http_header_prefix}' header with JWT data")
+            raise jwt.InvalidTokenError(f"Missing authorization '{prefix}' header with JWT data")
 
         # Ignore the header prefix, eg: Authorization: Bearer <token_data>
-        if not token.startswith(f'{self.http_header_prefix} '):
-            raise jwt.InvalidTokenError(f"Missing authorization header prefix '{self.http_header_prefix}'")
+        if not token.startswith(f'{prefix} '):
+            raise jwt.InvalidTokenError(f"Missing authorization header prefix '{prefix}'")
         else:
             # Strip off the prefix
-            token = token.replace(f'{self.http_header_prefix} ', '')
+            token = token.replace(f'{prefix} ', '')
 
         return token
 
@@ -151,13 +210,15 @@ class JWTAuth(AuthNode):
         try:
             user_data = self.authenticate(req, *args, **kwargs)
         except jwt.InvalidTokenError as e:
-            logger.audit(f"Unsuccessful authentication attempt via JWT: {str(e)}")
+            logger.audit("Unsuccessful authentication attempt via JWT: %s", e,
+                         action='authenticate', authenticated=False)
             resp.media = {"error": str(e)}
             return False
         else:
             if self.userdata_function:
                 req.user = self.userdata_function(user_data)
-            logger.audit(f"Successful authentication via JWT: {str(req.user)}")
+            logger.audit("Successful authentication via JWT: %s", req.user.get('username'),
+                         action='authenticate', user=req.user.get('username'), authenticated=True)
             return True
 
 
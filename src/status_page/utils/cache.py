@@ -0,0 +1,96 @@
+'''
+Caching utilities
+'''
+import threading
+import time
+from collections import OrderedDict
+
+
+__all__ = ['TTLCache']
+
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        """
+        A thread-safe, least recently used cache whose entries expire
+
+        `maxsize` - The maximum number of entries to keep
+        `ttl` (optional) - How long (in seconds) entries are kept. If not given, entries only leave
+                           the cache when it is full.
+        `clock` (optional) - A monotonic clock function, mostly useful for testing
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires is not None and expires <= self.clock():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=_MISSING):
+        """
+        Store `value`, optionally overriding the cache-wide TTL for this entry (`None` never
+        expires)
+        """
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires = self.clock() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, function):
+        """
+        Return the cached value for `key`, calling `function()` to create it when it is missing
+
+        `function` is called without holding the lock, so two threads may compute the same
+        value at the same time.
+        """
+        value = self.get(key, _MISSING)
+
+        if value is _MISSING:
+            value = function()
+            self.set(key, value)
+
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+
+            if expires is not None and expires <= self.clock():
+                return default
+
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,92 @@
+'''
+Compress response bodies
+
+gzip and deflate come with the standard library, brotli is used when it's installed
+(`pip install status_page[brotli]`). Compressed bodies are cached by a digest of the uncompressed
+body, so responses that don't change between requests (eg: /status, polled by every client) are
+only compressed once.
+'''
+import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .cache import TTLCache
+from .streaming import accepts_encoding
+
+
+__all__ = ['ENCODINGS', 'ResponseCompressor']
+
+
+# In order of preference, when the client accepts more than one
+ENCODINGS = (('br',) if brotli is not None else ()) + ('gzip', 'deflate')
+
+
+def _gzip(data, level):
+    # 16 + MAX_WBITS writes a gzip header and trailer instead of a raw zlib stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _brotli(data, level):
+    # Brotli's quality goes up to 11, map zlib's 1-9 onto it
+    return brotli.compress(data, quality=min(11, round(level * 11 / 9)))
+
+
+_COMPRESSORS = {
+    'br': _brotli,
+    'gzip': _gzip,
+    'deflate': zlib.compress,
+}
+
+
+class ResponseCompressor(object):
+    def __init__(self, min_size=1024, level=6, encodings=ENCODINGS, cache_size=256, cache_ttl=None):
+        """
+        Negotiates an encoding and compresses response bodies with it
+
+        `min_size` - Bodies smaller than this (in bytes) are left alone, compressing them saves
+                     next to nothing and costs a round through zlib
+        `level` - The compression level, 1 (fastest) to 9 (smallest)
+        `encodings` - The encodings to offer, in order of preference
+        `cache_size` - How many compressed bodies to keep, 0 disables the cache
+        `cache_ttl` (optional) - How long (in seconds) to keep compressed bodies
+        """
+        unknown = [encoding for encoding in encodings if encoding not in _COMPRESSORS]
+        if unknown or (brotli is None and 'br' in encodings):
+            raise ValueError(f"Unsupported encodings: {', '.join(unknown or ['br'])}")
+
+        self.min_size = min_size
+        self.level = level
+        self.encodings = tuple(encodings)
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_size else None
+
+    def choose_encoding(self, accept_encoding):
+        """
+        The preferred encoding allowed by an Accept-Encoding header value, or None
+        """
+        for encoding in self.encodings:
+            if accepts_encoding(accept_encoding, encoding):
+                return encoding
+        return None
+
+    def compress(self, data, encoding):
+        """
+        `data` compressed with `encoding`, returns the compressed bytes and whether they were cached
+        """
+        if self.cache is None:
+            return _COMPRESSORS[encoding](data, self.level), False
+
+        # Hashing is much cheaper than compressing, and the key doesn't keep the body alive
+        key = (encoding, len(data), hashlib.sha1(data).digest())
+
+        compressed = self.cache.get(key)
+        if compressed is not None:
+            return compressed, True
+
+        compressed = _COMPRESSORS[encoding](data, self.level)
+        self.cache.set(key, compressed)
+        return compressed, False
@@ -1,8 +1,30 @@
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import (datetime, timezone)
 
+from .metrics import Counter
+from .workers import BatchingWorker
+
+
+__all__ = [
+    'AUDIT', 'AsyncHandler', 'AuditFilter', 'BatchedWatchedFileHandler', 'JSONFormatter', 'logging',
+]
 
 AUDIT = 27
 
+logging.addLevelName(AUDIT, 'AUDIT')
+
+dropped_log_records_total = Counter(
+    'status_page_dropped_log_records_total', "Log records dropped because the logging queue was "
+    "full", ['level'])
+
+
+_PLAIN_VALUES = (str, int, float, type(None))
+
 
 class _AuditLogger(logging.getLoggerClass()):
     def __init__(self, name, level=logging.NOTSET):
@@ -10,9 +32,184 @@ class _AuditLogger(logging.getLoggerClass()):
 
         logging.addLevelName(AUDIT, 'AUDIT')
 
-    def audit(self, msg, *args, **kwargs):
+    def audit(self, msg, *args, exc_info=None, extra=None, stack_info=False, **fields):
+        """
+        Log an audit record
+
+        Use %-style `args` instead of f-strings, so the message is only formatted if (and when)
+        a handler writes it. Any other keyword arguments are kept as structured fields of the
+        record, eg: `logger.audit("User %s deleted %s", user, slug, user=user, service=slug)`.
+
+        Records are formatted on the log writer thread, when an ORM object passed in `args` may
+        already be expired or detached from its session, so anything but plain values is turned
+        into a string here.
+        """
         if self.isEnabledFor(AUDIT):
-            self._log(AUDIT, msg, args, **kwargs)
+            args = tuple(arg if isinstance(arg, _PLAIN_VALUES) else str(arg) for arg in args)
+            extra = dict(extra or {}, audit=fields)
+            self._log(AUDIT, msg, args, exc_info=exc_info, extra=extra, stack_info=stack_info)
 
 
 logging.setLoggerClass(_AuditLogger)
+
+
+class AuditFilter(logging.Filter):
+    """
+    Only let audit records through
+    """
+
+    def filter(self, record):
+        return record.levelno == AUDIT
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format records as single line JSON objects
+    """
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+
+        data.update(getattr(record, 'audit', {}))
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, default=str)
+
+
+class BatchedWatchedFileHandler(logging.handlers.WatchedFileHandler):
+    def __init__(self, *args, fsync=True, **kwargs):
+        """
+        A file handler that appends a whole batch of records at once
+
+        Every worker process appends to the same file, so it's rotated from outside (eg: by
+        logrotate, without copytruncate): the file is reopened once it was moved away. Rotating it
+        from each process would rename the file under the others and lose their records.
+
+        `fsync` - Make sure every batch reaches the disk before the next one is written
+        """
+        super().__init__(*args, **kwargs)
+        self.fsync = fsync
+
+    def handle_batch(self, records):
+        lines = []
+        for record in records:
+            if record.levelno < self.level or not self.filter(record):
+                continue
+
+            # A record that can't be formatted mustn't take the rest of the batch down with it
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+
+        if not lines:
+            return
+
+        data = ''.join(lines)
+
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+                self._statstream()
+            else:
+                self.reopenIfNeeded()
+            self.stream.flush()
+
+            # One write() of the whole batch to a file opened for appending, so the batches of
+            # different processes never interleave
+            fd = self.stream.fileno()
+            remaining = memoryview(data.encode(self.stream.encoding))
+            while remaining:
+                remaining = remaining[os.write(fd, remaining):]
+
+            # Special files like /dev/null can't be synced
+            if self.fsync and os.path.isfile(self.baseFilename):
+                os.fsync(fd)
+        except Exception:
+            self.handleError(records[-1])
+        finally:
+            self.release()
+
+
+class _LogWorker(BatchingWorker):
+    def __init__(self, handlers, **kwargs):
+        super().__init__('log-writer', **kwargs)
+        self.handlers = handlers
+
+    def process_batch(self, records):
+        for handler in self.handlers:
+            if hasattr(handler, 'handle_batch'):
+                handler.handle_batch(records)
+            else:
+                for record in records:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+
+class AsyncHandler(logging.Handler):
+    def __init__(self, *handlers, maxsize=10000, batch_size=500, batch_wait=0.5,
+                 audit_timeout=0.1):
+        """
+        Hand records to other handlers in a background thread
+
+        Logging never blocks (or formats messages on) the calling thread. If the queue fills up,
+        records are dropped and counted instead of slowing requests down - except audit records,
+        which wait for room and are written on the calling thread if there is none.
+
+        `handlers` - The handlers that actually write the records
+        `audit_timeout` - How long (in seconds) an audit record waits for room in a full queue
+        """
+        super().__init__()
+
+        self.handlers = handlers
+        self.audit_timeout = audit_timeout
+        self.dropped = 0
+
+        self.worker = _LogWorker(handlers, maxsize=maxsize, batch_size=batch_size,
+                                 batch_wait=batch_wait)
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if not self.worker.running:
+                self.worker.start()
+
+    def emit(self, record):
+        # Started lazily, so the thread exists in (forked) worker processes
+        if not self.worker.running:
+            self.start()
+
+        try:
+            self.worker.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if record.levelno != AUDIT:
+            self.dropped += 1
+            dropped_log_records_total.inc(level=record.levelname)
+            return
+
+        # Audit records are security records, they're never dropped
+        try:
+            self.worker.queue.put(record, timeout=self.audit_timeout)
+        except queue.Full:
+            self.worker.process_batch([record])
+
+    def close(self):
+        self.worker.stop()
+
+        for handler in self.handlers:
+            handler.close()
+
+        super().close()
@@ -0,0 +1,309 @@
+'''
+Prometheus-style metrics
+
+Metrics are kept in memory per process. When several worker processes serve the application,
+point `MultiProcessCollector` at a directory shared by the workers: each worker periodically
+writes a snapshot of its metrics there, and whichever worker is scraped merges all of them.
+'''
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+__all__ = [
+    'Counter', 'Gauge', 'Histogram', 'MetricsRegistry', 'MultiProcessCollector', 'REGISTRY',
+    'render_metrics', 'timed',
+]
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"A metric named '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._metrics.values()))
+
+    def snapshot(self):
+        """
+        A JSON serializable copy of every metric
+        """
+        return OrderedDict((metric.name, metric.snapshot()) for metric in self)
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._values = {}
+        self._lock = threading.Lock()
+
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.labelnames}, got "
+                             f"{tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "type": self.type,
+                "help": self.documentation,
+                "labelnames": list(self.labelnames),
+                "samples": [[list(key), self._copy(value)] for key, value in self._values.items()],
+            }
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            try:
+                counts = self._values[key]
+            except KeyError:
+                # One count per bucket plus +Inf, then the sum of all observations
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+
+class timed(object):
+    def __init__(self, histogram, **labels):
+        """
+        Context manager that observes how long its block took, in seconds
+        """
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def _merge(snapshots):
+    """
+    Combine per-process snapshots
+
+    Counters and histograms are summed. Gauges are summed too, which is correct for the
+    "currently in flight" kind of gauge this application uses.
+    """
+    merged = OrderedDict()
+
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, samples=OrderedDict()))
+
+            for labelvalues, value in metric['samples']:
+                key = tuple(labelvalues)
+                if key not in target['samples']:
+                    target['samples'][key] = value
+                elif metric['type'] == 'histogram':
+                    target['samples'][key] = [a + b for a, b in zip(target['samples'][key], value)]
+                else:
+                    target['samples'][key] += value
+
+    for metric in merged.values():
+        metric['samples'] = [[list(key), value] for key, value in metric['samples'].items()]
+
+    return merged
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def render_metrics(snapshot):
+    """
+    Render a registry snapshot in the Prometheus text exposition format
+    """
+    lines = []
+
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+
+        for labelvalues, value in metric['samples']:
+            if metric['type'] == 'histogram':
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + [float('inf')], value[:-1]):
+                    cumulative += count
+                    labels = _format_labels(metric['labelnames'], labelvalues,
+                                            [('le', _format_value(bound))])
+                    lines.append(f"{name}_bucket{labels} {_format_value(cumulative)}")
+
+                labels = _format_labels(metric['labelnames'], labelvalues)
+                lines.append(f"{name}_sum{labels} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{labels} {_format_value(cumulative)}")
+            else:
+                labels = _format_labels(metric['labelnames'], labelvalues)
+                lines.append(f"{name}{labels} {_format_value(value)}")
+
+    return '\n'.join(lines) + '\n'
+
+
+class MultiProcessCollector(object):
+    def __init__(self, directory, registry=REGISTRY, interval=1.0):
+        """
+        Share metrics between worker processes through snapshot files
+
+        `directory` - A directory shared by all of the worker processes. It should be emptied
+                      when the application is (re)deployed.
+        `registry` - The registry of this process
+        `interval` - The minimum number of seconds between snapshots written by `flush()`
+        """
+        self.directory = directory
+        self.registry = registry
+        self.interval = interval
+
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def path(self):
+        # Evaluated on every call so forked workers write their own file
+        return os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+
+    def flush(self, force=False):
+        now = time.monotonic()
+
+        if not force and now - self._last_flush < self.interval:
+            return
+
+        with self._lock:
+            self._last_flush = now
+
+            fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"pid": os.getpid(), "metrics": self.registry.snapshot()}, f)
+
+            # Atomic, so readers never see a partially written file
+            os.replace(temporary_path, self.path)
+
+    def collect(self):
+        self.flush(force=True)
+
+        snapshots = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            metrics = data['metrics']
+
+            # Counters and histograms of recycled workers are kept so totals never go backwards,
+            # but the gauges of dead processes no longer describe anything
+            if not _pid_is_alive(data['pid']):
+                metrics = OrderedDict((name, metric) for name, metric in metrics.items()
+                                      if metric['type'] != 'gauge')
+
+            snapshots.append(metrics)
+
+        return _merge(snapshots)
+
+
+def _pid_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    else:
+        return True
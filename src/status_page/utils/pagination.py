@@ -1,14 +1,90 @@
 '''
 Pagination utilities
+
+Counting every result for `Page.count` can cost as much as loading the page itself on big tables,
+so `paginate()` takes one of these count strategies:
+
+  exact    - Run `COUNT(*)` over the query
+  estimate - Use the query planner's row estimate when it's above `ESTIMATE_THRESHOLD` (PostgreSQL
+             only), and an exact count for smaller results, where estimates are the least accurate
+  cached   - Exact counts, reused for `COUNT_CACHE_TTL` seconds by every query with the same SQL
+             and parameters
+  none     - Don't count at all, fetch one extra row to find out if there is a next page
 '''
+import json
 import math
 from urllib.parse import (urlencode, urlunparse)
 
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import (ClauseElement, Executable)
+
+from .cache import TTLCache
+
+
+__all__ = ['COUNT_STRATEGIES', 'paginate']
+
+
+COUNT_STRATEGIES = ('exact', 'estimate', 'cached', 'none')
+
+ESTIMATE_THRESHOLD = 10000
+
+COUNT_CACHE_TTL = 60
+
+count_cache = TTLCache(maxsize=4096, ttl=COUNT_CACHE_TTL)
+
+
+class explain(Executable, ClauseElement):
+    def __init__(self, statement):
+        """
+        `EXPLAIN (FORMAT JSON)` of a statement, its parameters are bound like the statement's own
+        """
+        self.statement = statement
+
+
+@compiles(explain, 'postgresql')
+def _compile_explain(element, compiler, **kwargs):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kwargs)
 
-__all__ = ['paginate']
 
+def exact_count(query):
+    return query.order_by(None).count()
 
-def paginate(query, page, page_size, request=None, path=None, params=None, convert_items_callback=None):
+
+def estimated_count(query, threshold=ESTIMATE_THRESHOLD):
+    """
+    The planner's estimate of how many rows `query` returns, if it's at least `threshold`
+
+    Smaller (or non-PostgreSQL) results are counted exactly. Returns the count and whether it's
+    exact.
+    """
+    session = query.session
+
+    if session.get_bind().dialect.name == 'postgresql':
+        plan = session.execute(explain(query.order_by(None).statement)).scalar()
+        # psycopg2 parses the JSON, other drivers may not
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        estimate = plan[0]['Plan']['Plan Rows']
+        if estimate >= threshold:
+            return int(estimate), False
+
+    return exact_count(query), True
+
+
+def cached_count(query, cache=count_cache):
+    """
+    An exact count of `query`, shared with every query that has the same SQL and parameters
+    """
+    statement = query.order_by(None).statement
+    compiled = statement.compile(dialect=query.session.get_bind().dialect)
+    key = (str(compiled), json.dumps(compiled.params, sort_keys=True, default=str))
+
+    return cache.get_or_set(key, lambda: exact_count(query))
+
+
+def paginate(query, page, page_size, request=None, path=None, params=None, convert_items_callback=None,
+             count='exact'):
     """
     Split results from a SQLAlchemy query into multiple pages
 
@@ -19,6 +95,7 @@ def paginate(query, page, page_size, request=None, path=None, params=None, conve
     `path` - If the request parameter was not passed, this should be the request path
     `params` - If the request parameter was not passed, this should be the request query parameters
     `convert_items_callback` - A callback function to convert each query object to a dictionary
+    `count` (optional) - How to count the results, one of `COUNT_STRATEGIES` (default: exact)
     """
 
     if not page:
@@ -30,24 +107,61 @@ def paginate(query, page, page_size, request=None, path=None, params=None, conve
     if page_size and page_size <= 0:
         raise ValueError("The page_size parameter must be greater than zero")
 
-    items = query.limit(page_size).offset((page - 1) * page_size).all()
-    count = query.order_by(None).count()
-    return Page(items, page, page_size, count, path=path, params=params,
-                convert_items_callback=convert_items_callback)
+    if count not in COUNT_STRATEGIES:
+        raise ValueError(f"The count parameter must be one of: {', '.join(COUNT_STRATEGIES)}")
+
+    offset = (page - 1) * page_size
+    has_next = None
+    count_exact = True
+
+    if count == 'none':
+        items = query.limit(page_size + 1).offset(offset).all()
+        has_next = len(items) > page_size
+        items = items[:page_size]
+        total = None
+    elif count == 'estimate':
+        # Whether there is a next page can't depend on the estimate
+        items = query.limit(page_size + 1).offset(offset).all()
+        has_next = len(items) > page_size
+        items = items[:page_size]
+
+        total, count_exact = estimated_count(query)
+
+        if not count_exact:
+            seen = offset + len(items) + has_next
+
+            # A short page is the last one, which tells us the exact count for free. An empty one
+            # is past the end, which tells us nothing.
+            if 0 < len(items) < page_size:
+                total, count_exact = seen, True
+            # Still an estimate, but never fewer than the results we know of
+            elif total < seen:
+                total = seen
+    else:
+        items = query.limit(page_size).offset(offset).all()
+
+        if count == 'cached':
+            total = cached_count(query)
+        else:
+            total = exact_count(query)
+
+    return Page(items, page, page_size, total, path=path, params=params,
+                convert_items_callback=convert_items_callback, has_next=has_next,
+                count_exact=count_exact)
 
 
 # Adapted from:
 # https://github.com/wizeline/sqlalchemy-pagination/blob/master/sqlalchemy_pagination/__init__.py
 class Page(object):
     def __init__(self, items, page, page_size, count, request=None, path=None, params=None,
-                 convert_items_callback=None):
+                 convert_items_callback=None, has_next=None, count_exact=True):
         """
         A single page in a list of pages of results
 
         `items` - An iterable of items in this page
         `page` - The page number in the page sequence
         `page_size` - The number of items to display on each page
-        `count` - The total number of items in the iterable
+        `count` - The total number of items in the iterable, `None` if it wasn't counted
         `request` (optional) - The request object, passing this will override the path and params
                                parameters
         `path` - The path of the page, used to calculate the next and previous page URLs
@@ -55,6 +169,8 @@ class Page(object):
                    page URLs
         `convert_items_callback` (optional) - A callable used to convert each item to a dictionary
                                               for JSON serialization
+        `has_next` (optional) - Whether there is a next page, required when `count` is `None`
+        `count_exact` (optional) - Whether `count` is exact or an estimate
 
         Either `request` should be given, or `path` and `params` should be given. If none are
         given, path defaults to `/` and `params` defaults to an empty dictionary.
@@ -82,12 +198,14 @@ class Page(object):
 
         has_previous = page > 1
         previous_items = (page - 1) * page_size
-        has_next = previous_items + len(items) < count
+        if has_next is None:
+            has_next = previous_items + len(items) < count
 
         self.results = [convert_items_callback(item) for item in items]
 
         self.count = count
-        self.pages = int(math.ceil(count / page_size))
+        self.count_exact = count_exact if count is not None else False
+        self.pages = int(math.ceil(count / page_size)) if count is not None else None
 
         self.previous_page = (page - 1) if has_previous else None
         self.next_page = (page + 1) if has_next else None
@@ -0,0 +1,98 @@
+'''
+Request profiling utilities
+'''
+import os
+import sys
+import threading
+from collections import Counter
+
+
+__all__ = ['StackSampler', 'write_profile']
+
+
+class StackSampler(object):
+    def __init__(self, thread_id=None, interval=0.001):
+        """
+        Periodically sample the stack of a single thread
+
+        The samples are aggregated into "collapsed" stacks, the input format of flamegraph.pl,
+        speedscope, and most other flame graph tools.
+
+        `thread_id` (optional) - The thread to sample, defaults to the calling thread
+        `interval` - Seconds between samples
+        """
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def write_profile(directory, name, profile=None, sampler=None, statements=None):
+    """
+    Write the results of a profiled request to `directory`
+
+    `name` - The common file name prefix of the written files
+    `profile` (optional) - A `cProfile.Profile`, written as `<name>.prof` (pstats format)
+    `sampler` (optional) - A `StackSampler`, written as `<name>.folded` (collapsed stacks)
+    `statements` (optional) - A list of (statement, parameters, duration) tuples, written as
+                              `<name>.sql`
+
+    Returns the list of files that were written
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = []
+
+    if profile is not None:
+        path = os.path.join(directory, f"{name}.prof")
+        profile.dump_stats(path)
+        written.append(path)
+
+    if sampler is not None:
+        path = os.path.join(directory, f"{name}.folded")
+        with open(path, 'w') as f:
+            f.write(sampler.collapsed())
+        written.append(path)
+
+    if statements is not None:
+        path = os.path.join(directory, f"{name}.sql")
+        with open(path, 'w') as f:
+            total = sum(duration for statement, parameters, duration in statements)
+            f.write(f"-- {len(statements)} statements, {total * 1000:.3f} ms total\n\n")
+
+            for statement, parameters, duration in statements:
+                f.write(f"-- {duration * 1000:.3f} ms, parameters: {parameters!r}\n")
+                f.write(f"{statement.strip()};\n\n")
+        written.append(path)
+
+    return written
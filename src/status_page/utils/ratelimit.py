@@ -0,0 +1,265 @@
+'''
+Rate limiting utilities
+'''
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+import falcon
+
+from .metrics import (Counter, Gauge)
+
+
+__all__ = ['KeyedRateLimiter', 'RateLimit', 'SharedRateLimiter', 'TokenBucket']
+
+
+rate_limited_requests_total = Counter(
+    'status_page_rate_limited_requests_total', "Requests refused because their client was over "
+    "its rate limit", ['route'])
+
+rate_limit_keys = Gauge(
+    'status_page_rate_limit_keys', "Clients with a bucket in the in-process rate limiters")
+
+
+def _refill(tokens, last, now, rate, capacity):
+    return min(capacity, tokens + (now - last) * rate)
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        """
+        A thread-safe token bucket
+
+        `rate` - The number of tokens added to the bucket every second
+        `capacity` (optional) - The maximum number of tokens the bucket can hold, which is the
+                                largest burst allowed. Defaults to `rate`.
+        `clock` (optional) - A monotonic clock function, mostly useful for testing
+        """
+        if rate <= 0:
+            raise ValueError("The rate parameter must be greater than zero")
+
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.clock = clock
+
+        self._tokens = self.capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_consume(self, tokens=1):
+        """
+        Take `tokens` out of the bucket without waiting
+
+        Returns a tuple of (allowed, seconds until enough tokens are available)
+        """
+        with self._lock:
+            self._refill()
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True, 0.0
+
+            return False, (tokens - self._tokens) / self.rate
+
+    def consume(self, tokens=1):
+        """
+        Take `tokens` out of the bucket, sleeping until enough tokens are available
+
+        Requests for more tokens than the bucket can hold are clamped to its capacity so they
+        cannot wait forever.
+        """
+        tokens = min(tokens, self.capacity)
+
+        while True:
+            allowed, wait = self.try_consume(tokens)
+            if allowed:
+                return
+            time.sleep(wait)
+
+
+class KeyedRateLimiter(object):
+    def __init__(self, rate, capacity=None, maxsize=10000, clock=time.monotonic):
+        """
+        A thread-safe token bucket per key, eg: per user
+
+        The buckets are kept in memory, so every process has its own. Once there are `maxsize` of
+        them, the least recently used ones are forgotten - a bucket that was left alone for
+        `capacity / rate` seconds is full again anyway.
+
+        `rate` - The number of tokens added to each bucket every second
+        `capacity` (optional) - The maximum number of tokens a bucket can hold. Defaults to `rate`.
+        `maxsize` - The most buckets to keep
+        `clock` (optional) - A monotonic clock function, mostly useful for testing
+        """
+        if rate <= 0:
+            raise ValueError("The rate parameter must be greater than zero")
+
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.maxsize = maxsize
+        self.clock = clock
+
+        # key -> [tokens, time of the last refill], least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def try_consume(self, key, tokens=1):
+        """
+        Take `tokens` out of the bucket of `key` without waiting
+
+        Returns a tuple of (allowed, seconds until enough tokens are available)
+        """
+        with self._lock:
+            now = self.clock()
+            bucket = self._buckets.get(key)
+
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+                rate_limit_keys.inc()
+
+                while len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+                    rate_limit_keys.dec()
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = _refill(bucket[0], bucket[1], now, self.rate, self.capacity)
+                bucket[1] = now
+
+            if bucket[0] >= tokens:
+                bucket[0] -= tokens
+                return True, 0.0
+
+            return False, (tokens - bucket[0]) / self.rate
+
+
+class SharedRateLimiter(object):
+    # The tokens in a bucket and the time of its last refill
+    SLOT = struct.Struct('dd')
+
+    def __init__(self, path, rate, capacity=None, slots=65536, clock=time.monotonic):
+        """
+        A token bucket per key, shared by every process that opens the same file
+
+        The buckets live in a memory mapped file (put it on a tmpfs, eg: /dev/shm) with a fixed
+        number of slots. Keys are hashed to a slot, so two keys may share a bucket - with enough
+        slots, rarely. A slot is locked while it's updated, so processes never lose each other's
+        updates.
+
+        `path` - The file holding the buckets, created if it doesn't exist
+        `rate` - The number of tokens added to each bucket every second
+        `capacity` (optional) - The maximum number of tokens a bucket can hold. Defaults to `rate`.
+        `slots` - The number of buckets in the file
+        `clock` (optional) - A monotonic clock function that every process shares, like the
+                             default
+        """
+        if rate <= 0:
+            raise ValueError("The rate parameter must be greater than zero")
+
+        self.path = path
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.slots = slots
+        self.clock = clock
+
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # A new file is all zeroes, which is what an unused slot looks like
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+        # Record locks are per process, the threads of a process take turns
+        self._lock = threading.Lock()
+
+    def try_consume(self, key, tokens=1):
+        """
+        Take `tokens` out of the bucket of `key` without waiting
+
+        Returns a tuple of (allowed, seconds until enough tokens are available)
+        """
+        # Unlike hash(), this is the same in every process
+        offset = zlib.crc32(str(key).encode('utf-8')) % self.slots * self.SLOT.size
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT.size, offset)
+            try:
+                available, last = self.SLOT.unpack_from(self._map, offset)
+                now = self.clock()
+
+                # Unused, or last written before the clock started over (eg: a reboot)
+                if last == 0 or now < last:
+                    available = self.capacity
+                else:
+                    available = _refill(available, last, now, self.rate, self.capacity)
+
+                allowed = available >= tokens
+                if allowed:
+                    available -= tokens
+
+                self.SLOT.pack_into(self._map, offset, available, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT.size, offset)
+
+        if allowed:
+            return True, 0.0
+
+        return False, (tokens - available) / self.rate
+
+
+class RateLimit(object):
+    def __init__(self, key, limiter=None):
+        """
+        Limits how often each client may call a responder
+
+        `key` - A callable that takes the (authenticated) request and returns whose bucket it
+                takes a token out of
+        `limiter` (optional) - A `KeyedRateLimiter` or a `SharedRateLimiter`, nothing is limited
+                               without one
+        """
+        self.key = key
+        self.limiter = limiter
+
+    def __call__(self):
+        """
+        Decorate a responder, below the `authenticate` decorator so the client is known
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(resource, req, resp, *args, **kwargs):
+                if self.limiter is not None:
+                    self.check(resource, req)
+                return func(resource, req, resp, *args, **kwargs)
+
+            return wrapper
+        return decorator
+
+    def check(self, resource, req):
+        allowed, wait = self.limiter.try_consume(self.key(req))
+
+        if not allowed:
+            rate_limited_requests_total.inc(route=resource.__class__.__name__)
+            raise falcon.HTTPTooManyRequests(
+                title="Too many requests",
+                description="Slow down, this client is over its rate limit.",
+                retry_after=max(1, math.ceil(wait)))
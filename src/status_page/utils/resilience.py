@@ -0,0 +1,258 @@
+'''
+Keep the read routes up when the database isn't
+
+A status page that fails whenever its own database is slow is useless during incidents. The
+circuit breaker stops sending statements to a database that keeps failing, so requests fail fast
+instead of piling up behind it, and `StaleWhileRevalidate` answers them with the last good response
+(marked stale) while it refreshes that response in the background.
+'''
+import copy
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+
+import falcon
+import pytz
+from sqlalchemy import event
+from sqlalchemy.exc import (InterfaceError, OperationalError, TimeoutError)
+from sqlalchemy.orm import Session
+
+from .cache import TTLCache
+from .logging import logging
+from .singleflight import request_key
+
+
+__all__ = [
+    'CircuitBreaker', 'CircuitOpenError', 'StaleWhileRevalidate', 'database_breaker',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"The circuit breaker is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        """
+        Stops calls to a dependency after it failed `failure_threshold` times in a row
+
+        Once open, calls fail immediately for `reset_timeout` seconds. Then the breaker is half-open:
+        calls go through again, the first success closes it and the first failure opens it again.
+
+        `failure_threshold` - Consecutive failures that open the breaker
+        `reset_timeout` - Seconds to wait before trying the dependency again
+        `clock` (optional) - A monotonic clock function, mostly useful for testing
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if self.clock() - self._opened_at < self.reset_timeout:
+                return self.OPEN
+            return self.HALF_OPEN
+
+    def retry_after(self):
+        """
+        Seconds until calls are allowed again, 0 if they already are
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - self.clock())
+
+    def check(self):
+        """
+        Raise `CircuitOpenError` if calls aren't allowed right now
+        """
+        retry_after = self.retry_after()
+        if retry_after > 0:
+            raise CircuitOpenError(retry_after)
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Closing the circuit breaker, the dependency recovered")
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+
+            half_open = (self._opened_at is not None and
+                         self.clock() - self._opened_at >= self.reset_timeout)
+
+            if half_open or (self._opened_at is None and
+                             self._failures >= self.failure_threshold):
+                logger.warning("Opening the circuit breaker after %d failures", self._failures)
+                self._opened_at = self.clock()
+
+    def instrument(self, engine):
+        """
+        Put the breaker around an engine
+
+        Connection errors and statement timeouts count as failures, statements that complete count
+        as successes. While the breaker is open, neither new connections nor statements reach the
+        database.
+        """
+        event.listen(engine, 'do_connect', self._before_connect)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_connect(self, dialect, conn_rec, cargs, cparams):
+        self.check()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.check()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._opened_at is not None or self._failures:
+            self.record_success()
+
+    def _handle_error(self, context):
+        # Disconnects and timeouts (psycopg2's QueryCanceledError) are OperationalErrors, but
+        # errors in the statements themselves aren't the database's fault
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            self.record_failure()
+
+
+database_breaker = CircuitBreaker()
+
+
+class StaleWhileRevalidate(object):
+    # What counts as the database being unavailable
+    ERRORS = (OperationalError, InterfaceError, TimeoutError, CircuitOpenError)
+
+    def __init__(self, breaker=database_breaker, budget=None, max_stale=24 * 60 * 60,
+                 maxsize=1024):
+        """
+        Serves the last good response of a read route while the database is unavailable
+
+        `breaker` - The `CircuitBreaker` around the database engine
+        `budget` (optional) - How long (in seconds) each statement may take before it's cancelled
+                              and the stale response is served instead (PostgreSQL only)
+        `max_stale` - How long (in seconds) to keep serving a response that couldn't be refreshed
+        `maxsize` - The most responses to keep
+        """
+        self.breaker = breaker
+        self.budget = budget
+
+        self.snapshots = TTLCache(maxsize=maxsize, ttl=max_stale)
+
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, scope=None):
+        """
+        Decorate a read only responder, that only sets the response status and media
+
+        `scope` (optional) - A callable that takes the request and returns what else the response
+                             depends on, eg: the user for personalized responses
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(resource, req, resp, *args, **kwargs):
+                key = request_key(resource, req, scope)
+
+                try:
+                    self.limit_statements(resource.db)
+                    func(resource, req, resp, *args, **kwargs)
+                except self.ERRORS as e:
+                    self.rollback(resource.db)
+                    self.serve_stale(key, resp, e)
+                    self.refresh_later(key, func, resource, req, args, kwargs)
+                else:
+                    self.store(key, resp)
+
+            return wrapper
+        return decorator
+
+    def limit_statements(self, db):
+        if self.budget is not None and db.get_bind().dialect.name == 'postgresql':
+            # Only for this transaction, the session is closed at the end of the request
+            db.execute(f"SET LOCAL statement_timeout = {int(self.budget * 1000)}")
+
+    def rollback(self, db):
+        try:
+            db.rollback()
+        except self.ERRORS:
+            pass
+
+    def store(self, key, resp):
+        if str(resp.status).startswith('200'):
+            self.snapshots.set(key, (resp.status, resp.media, datetime.now(pytz.utc)))
+
+    def serve_stale(self, key, resp, error):
+        # Not the whole statement, just what went wrong
+        error = getattr(error, 'orig', None) or error
+
+        snapshot = self.snapshots.get(key)
+        retry_after = max(1, int(self.breaker.retry_after()))
+
+        if snapshot is None:
+            logger.warning("The database is unavailable and there is no stale response to serve: "
+                           "%s", error)
+            raise falcon.HTTPServiceUnavailable(
+                title="The database is unavailable",
+                description="Try again shortly.",
+                retry_after=retry_after)
+
+        status, media, stored_at = snapshot
+        logger.warning("The database is unavailable, serving a response from %s: %s",
+                       stored_at.isoformat(), error)
+
+        resp.status = status
+        resp.media = dict(media, stale=True, as_of=stored_at.isoformat())
+        resp.set_header('Warning', '110 - "Response is Stale"')
+        resp.set_header('Retry-After', str(retry_after))
+
+    def refresh_later(self, key, func, resource, req, args, kwargs):
+        """
+        Refresh a stale response in a background thread, once the breaker allows it again
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                time.sleep(self.breaker.retry_after())
+
+                # Resources are shared between requests, give this one its own session
+                background = copy.copy(resource)
+                background.db = Session(bind=resource.db.get_bind())
+                fresh = falcon.Response()
+                try:
+                    self.limit_statements(background.db)
+                    func(background, req, fresh, *args, **kwargs)
+                    self.store(key, fresh)
+                finally:
+                    background.db.close()
+            except Exception as e:
+                logger.info("Could not refresh a stale response: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='stale-while-revalidate', daemon=True).start()
@@ -0,0 +1,123 @@
+'''
+Request coalescing
+
+When an outage hits, every client polls the status at once, and every worker thread would run the
+same queries at the same time. With single-flight, the first of a set of identical concurrent
+requests computes the response, and the others wait for it and share the result.
+
+This only coalesces requests within a process, each worker still computes its own response.
+'''
+import json
+import threading
+from functools import wraps
+
+from .metrics import Counter
+
+
+__all__ = ['SingleFlight', 'coalesce', 'request_key']
+
+
+coalesced_requests_total = Counter(
+    'status_page_coalesced_requests_total', "Requests answered with the response of an "
+    "identical request that was already in flight",
+    ['route'])
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        """
+        Runs a function at most once at a time per key, concurrent callers share its result
+        """
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Call `function()`, unless a call with the same `key` is already running, then wait for it
+
+        Returns the result and whether it was shared. Exceptions are shared too, everybody waiting
+        on a call that raised gets the same exception.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            # Callers that come after this point start a new call, they may see newer data
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+def request_key(resource, req, scope=None):
+    """
+    What identifies a read request: the route, path, query parameters and `scope`
+
+    `scope` (optional) - A callable that takes the request and returns what else the response
+                         depends on, eg: the user for personalized responses
+    """
+    return (
+        resource.__class__.__name__,
+        req.path,
+        json.dumps(req.params, sort_keys=True),
+        scope(req) if scope is not None else None,
+    )
+
+
+def coalesce(scope=None):
+    """
+    Share a responder's response between identical concurrent requests
+
+    Requests are identical when they have the same `request_key()`. The status, media and the
+    headers the responder set (eg: the `Warning` of a stale response) are shared, so only use
+    this on read only responders, and never change the shared media afterwards.
+
+    `scope` (optional) - A callable that takes the request and returns what else the response
+                         depends on, eg: the user for personalized responses
+    """
+    def decorator(func):
+        flight = SingleFlight()
+
+        @wraps(func)
+        def wrapper(self, req, resp, *args, **kwargs):
+            key = request_key(self, req, scope)
+
+            def respond():
+                # Only what the responder set, not what middleware already set for this request
+                before = resp.headers
+                func(self, req, resp, *args, **kwargs)
+                headers = {name: value for name, value in resp.headers.items()
+                           if before.get(name) != value}
+                return resp.status, resp.media, headers
+
+            (status, media, headers), shared = flight.do(key, respond)
+            if shared:
+                resp.status = status
+                resp.media = media
+                resp.set_headers(headers)
+                coalesced_requests_total.inc(route=self.__class__.__name__)
+
+        return wrapper
+    return decorator
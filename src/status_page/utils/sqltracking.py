@@ -0,0 +1,75 @@
+'''
+Track the SQL statements issued while handling a request
+'''
+import threading
+import time
+
+from sqlalchemy import event
+
+
+__all__ = ['QueryStats', 'QueryTracker', 'query_tracker']
+
+
+class QueryStats(object):
+    def __init__(self, record_statements=False):
+        """
+        The number of statements and the time spent in the database by a single thread
+
+        `record_statements` - Also keep every statement with its parameters and duration
+        """
+        self.count = 0
+        self.duration = 0.0
+        self.statements = [] if record_statements else None
+
+
+class QueryTracker(object):
+    """
+    Count and time the statements executed by every engine passed to `instrument()`
+
+    Tracking is per thread: call `start()` at the beginning of a request and `stop()` at the
+    end. Statements executed by threads that are not tracking cost one attribute lookup.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def instrument(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def start(self, record_statements=False):
+        self._local.stats = QueryStats(record_statements)
+        return self._local.stats
+
+    def stop(self):
+        stats = getattr(self._local, 'stats', None)
+        self._local.stats = None
+        return stats
+
+    @property
+    def current(self):
+        return getattr(self._local, 'stats', None)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current is not None:
+            conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self.current
+        if stats is None:
+            return
+
+        try:
+            duration = time.perf_counter() - conn.info['query_start_time'].pop()
+        except (KeyError, IndexError):
+            # Tracking started in the middle of this statement
+            return
+
+        stats.count += 1
+        stats.duration += duration
+
+        if stats.statements is not None:
+            stats.statements.append((statement, parameters, duration))
+
+
+query_tracker = QueryTracker()
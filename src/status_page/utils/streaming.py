@@ -0,0 +1,107 @@
+'''
+Stream large responses in chunks
+
+Each function turns an iterable of rows into an iterable of byte chunks, which can be assigned to
+`resp.stream` so nothing ever holds the whole response in memory.
+'''
+import csv
+import io
+import json
+import zlib
+
+
+__all__ = ['accepts_encoding', 'csv_chunks', 'gzip_chunks', 'ndjson_chunks']
+
+CHUNK_SIZE = 64 * 1024
+
+
+def accepts_encoding(accept_encoding, encoding):
+    """
+    Whether an Accept-Encoding header value allows `encoding` (eg: 'gzip')
+    """
+    for part in (accept_encoding or '').split(','):
+        # Don't unpack into _, that's gettext
+        name, separator, parameters = part.strip().partition(';')
+
+        if name.strip().lower() not in (encoding, '*'):
+            continue
+
+        parameters = parameters.replace(' ', '')
+        if parameters.startswith('q='):
+            try:
+                return float(parameters[2:]) > 0
+            except ValueError:
+                return False
+
+        return True
+
+    return False
+
+
+def ndjson_chunks(rows, chunk_size=CHUNK_SIZE):
+    """
+    Newline delimited JSON, one object per row
+
+    `rows` - An iterable of dictionaries
+    `chunk_size` - Roughly how many bytes to collect before yielding them
+    """
+    buffer = []
+    size = 0
+
+    for row in rows:
+        line = json.dumps(row) + '\n'
+        buffer.append(line)
+        size += len(line)
+
+        if size >= chunk_size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def csv_chunks(rows, fieldnames, chunk_size=CHUNK_SIZE):
+    """
+    CSV with a header row
+
+    Values that aren't strings or numbers (eg: dictionaries) are written as JSON.
+
+    `rows` - An iterable of dictionaries
+    `fieldnames` - The columns, in order
+    `chunk_size` - Roughly how many bytes to collect before yielding them
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction='ignore')
+
+    writer.writeheader()
+
+    for row in rows:
+        writer.writerow({
+            key: json.dumps(value) if isinstance(value, (dict, list)) else value
+            for key, value in row.items()
+        })
+
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compress a stream of byte chunks into a gzip stream
+    """
+    # 16 + MAX_WBITS writes a gzip header and trailer instead of a raw zlib stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
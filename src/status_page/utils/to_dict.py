@@ -1,6 +1,15 @@
 '''
 Convert objects to dictionaries
 '''
+from datetime import datetime
+
+import pytz
+
+
+__all__ = [
+    'event_to_dict', 'incident_to_dict', 'obj_to_dict', 'permission_to_dict', 'service_to_dict',
+    'subscription_to_dict', 'webhook_delivery_to_dict', 'webhook_to_dict',
+]
 
 
 def obj_to_dict(item, exclude_attrs=None):
@@ -36,3 +45,68 @@ def permission_to_dict(permission, exclude_attrs=None):
         },
         **obj_to_dict(permission, exclude_attrs),
     )
+
+
+def subscription_to_dict(subscription, exclude_attrs=None):
+    exclude_attrs = exclude_attrs or ['id', 'service_id', 'service', 'version']
+
+    return dict(
+        **{
+            "url": f"/services/{subscription.service.slug}/subscription",
+            "service": f"/services/{subscription.service.slug}",
+        },
+        **obj_to_dict(subscription, exclude_attrs),
+    )
+
+
+def incident_to_dict(incident, now=None):
+    """
+    `now` (optional) - The end of open incidents when computing their duration (default: now)
+    """
+    slug = incident.service.slug
+    ended_at = incident.ended_at
+
+    if ended_at is None:
+        ended_at = now or datetime.now(pytz.utc)
+
+    return {
+        "url": f"/services/{slug}/incidents/{incident.id}",
+        "service": f"/services/{slug}",
+        "status": incident.status,
+        "open": incident.ended_at is None,
+        "started_at": incident.started_at,
+        "ended_at": incident.ended_at,
+        # Seconds, so far for open incidents
+        "duration": (ended_at - incident.started_at).total_seconds(),
+        "start_event": f"/services/{slug}/events/{incident.start_event_id}",
+        "end_event": f"/services/{slug}/events/{incident.end_event_id}"
+                     if incident.end_event_id is not None else None,
+    }
+
+
+def webhook_to_dict(webhook):
+    return {
+        "url": f"/webhooks/{webhook.id}",
+        "endpoint": webhook.endpoint,
+        "service": f"/services/{webhook.service.slug}" if webhook.service is not None else None,
+        "group": webhook.group.slug if webhook.group is not None else None,
+        "changes_only": webhook.changes_only,
+        # Never the secret itself
+        "signed": bool(webhook.secret),
+        "created_by": webhook.created_by,
+        "deliveries": f"/webhooks/{webhook.id}/deliveries",
+    }
+
+
+def webhook_delivery_to_dict(delivery):
+    return {
+        "id": delivery.id,
+        "event": f"/services/{delivery.event.service.slug}/events/{delivery.event_id}",
+        "state": delivery.state,
+        "attempts": delivery.attempts,
+        # Only pending deliveries are attempted again
+        "next_attempt_at": delivery.next_attempt_at if delivery.state == 'pending' else None,
+        "created_at": delivery.created_at,
+        "delivered_at": delivery.delivered_at,
+        "last_error": delivery.last_error,
+    }
@@ -0,0 +1,138 @@
+'''
+Request body validation with JSON schemas
+
+A drop-in replacement for `falcon.media.validators.jsonschema.validate()` that builds the
+validator for each schema once, instead of re-checking the schema and building a new validator on
+every request. Every schema is registered when its decorator runs (at import time), so
+`compile_schemas()` can build all of the validators up front, before worker processes fork.
+Decorators with identical schemas share a single validator.
+
+If fastjsonschema is installed (`pip install status_page[fast]`), schemas are also compiled into
+generated Python code, which accepts valid request bodies several times faster. Invalid bodies are
+still explained by jsonschema, so error messages are the same either way.
+'''
+import json
+import threading
+from functools import wraps
+
+import falcon
+import jsonschema
+from jsonschema.exceptions import best_match
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+
+__all__ = ['SchemaValidator', 'compile_schemas', 'get_validator', 'validate']
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class SchemaValidator(object):
+    def __init__(self, schema, use_codegen=None):
+        """
+        Validates instances against a single JSON schema
+
+        `schema` - The JSON schema, the `$schema` keyword selects the draft (default: latest)
+        `use_codegen` (optional) - Whether to generate code with fastjsonschema (default: if it's
+                                   installed)
+        """
+        self.schema = schema
+        self.use_codegen = fastjsonschema is not None if use_codegen is None else use_codegen
+
+        self._validator = None
+        self._fast_validate = None
+        self._lock = threading.Lock()
+
+    def compile(self):
+        """
+        Check the schema and build its validators, unless that already happened
+        """
+        if self._validator is None:
+            with self._lock:
+                if self._validator is None:
+                    cls = jsonschema.validators.validator_for(self.schema)
+                    cls.check_schema(self.schema)
+
+                    if self.use_codegen:
+                        self._fast_validate = fastjsonschema.compile(self.schema)
+
+                    self._validator = cls(self.schema, format_checker=jsonschema.FormatChecker())
+
+        return self._validator
+
+    def validate(self, instance):
+        """
+        Raise `jsonschema.ValidationError` if `instance` doesn't match the schema
+        """
+        validator = self.compile()
+
+        if self._fast_validate is not None:
+            try:
+                self._fast_validate(instance)
+            except fastjsonschema.JsonSchemaException as e:
+                fast_error = e
+            else:
+                return
+        else:
+            fast_error = None
+
+        error = best_match(validator.iter_errors(instance))
+        if error is not None:
+            raise error
+
+        # The two libraries disagree (eg: about formats), stay on the strict side
+        if fast_error is not None:
+            raise jsonschema.ValidationError(fast_error.message)
+
+
+def get_validator(schema):
+    """
+    The shared validator of `schema`, created (and registered) the first time it's needed
+    """
+    key = json.dumps(schema, sort_keys=True)
+
+    with _registry_lock:
+        try:
+            return _registry[key]
+        except KeyError:
+            validator = _registry[key] = SchemaValidator(schema)
+            return validator
+
+
+def compile_schemas():
+    """
+    Build the validators of every registered schema, returns how many there are
+    """
+    with _registry_lock:
+        validators = list(_registry.values())
+
+    for validator in validators:
+        validator.compile()
+
+    return len(validators)
+
+
+def validate(req_schema):
+    """
+    Validate `req.media` against `req_schema` before calling the responder
+
+    Invalid request bodies are rejected with 400 Bad Request, just like Falcon's own validator.
+    """
+    validator = get_validator(req_schema)
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, req, resp, *args, **kwargs):
+            try:
+                validator.validate(req.media)
+            except jsonschema.ValidationError as e:
+                raise falcon.HTTPBadRequest(title='Failed data validation', description=e.message)
+
+            return func(self, req, resp, *args, **kwargs)
+        return wrapper
+    return decorator
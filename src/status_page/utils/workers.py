@@ -0,0 +1,115 @@
+'''
+Background worker utilities
+'''
+import logging
+import queue
+import threading
+import time
+
+
+__all__ = ['BatchingWorker']
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingWorker(object):
+    def __init__(self, name, maxsize=10000, batch_size=100, batch_wait=0.5):
+        """
+        A daemon thread that drains a queue in batches
+
+        Subclasses implement `process_batch(items)`. Items are handed over with `submit()`, which
+        never blocks the caller - if the queue is full the item is dropped and logged.
+
+        `name` - The name of the worker thread
+        `maxsize` - The maximum number of items waiting in the queue
+        `batch_size` - The maximum number of items handed to a single `process_batch()` call
+        `batch_wait` - How long (in seconds) to wait for a batch to fill up before processing it
+        """
+        self.name = name
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+
+        self.queue = queue.Queue(maxsize=maxsize)
+
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker after processing everything already in the queue
+        """
+        self._stopping.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def after_fork(self):
+        """
+        Call this in a forked child process to start afresh
+
+        The parent's thread doesn't exist in the child, and its queue may have been copied with
+        its lock held, so both are replaced. Anything still queued in the parent is not copied.
+        """
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.start()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            logger.error("The %s queue is full, dropping %r", self.name, item)
+            return False
+        else:
+            return True
+
+    def process_batch(self, items):
+        raise NotImplementedError("Subclasses of BatchingWorker must implement process_batch() themselves")
+
+    def _next_batch(self):
+        try:
+            items = [self.queue.get(timeout=self.batch_wait)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_wait
+
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    items.append(self.queue.get(timeout=remaining))
+                else:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return items
+
+    def _run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            items = self._next_batch()
+
+            if not items:
+                continue
+
+            try:
+                self.process_batch(items)
+            except Exception:
+                logger.exception("The %s worker failed to process a batch of %d items",
+                                 self.name, len(items))
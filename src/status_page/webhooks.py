@@ -0,0 +1,557 @@
+'''
+Webhooks: push the events of a service (or of every service in a group) to other systems
+
+Integrations (chat, paging, other dashboards) don't have to poll the status page. The deliveries of
+an event are written to an outbox (the `webhook_deliveries` table) in the same transaction as the
+event, so none are lost, and recording an event never waits for an endpoint. `WebhookDispatcher`
+sends them in the background:
+
+- Deliveries are claimed with `FOR UPDATE SKIP LOCKED` and leased, so the dispatchers of every
+  worker process share the outbox and a delivery whose dispatcher died is sent again once its lease
+  runs out. Deliveries are sent at least once, endpoints can tell repeats apart by their ID.
+- The deliveries due for a webhook are sent together, a burst of events is one request.
+- A bounded pool of threads sends them, with at most a few requests in flight to each endpoint, so
+  one slow endpoint can't hold up the others.
+- Failed deliveries are retried with exponential backoff (or after the endpoint's Retry-After).
+  Deliveries the endpoint rejects, and those that keep failing, are dead-lettered: they're kept
+  until they are retried through the API or the webhook is deleted.
+
+Payloads are signed with the webhook's secret, if it has one, in the `X-Status-Page-Signature`
+header: "sha256=" and the hex HMAC-SHA256 of the body.
+
+Every application worker runs a dispatcher, unless STATUS_PAGE_WEBHOOKS is false. Then they can be
+sent by a process of their own, configured by the same environment variables:
+
+    python -m status_page.webhooks
+'''
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import (OrderedDict, defaultdict, namedtuple)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import (and_, any_, bindparam, false, func, literal, or_, select)
+from sqlalchemy.orm import joinedload
+from sqlalchemy.types import Boolean
+
+from .models import (Event, ServiceServiceGroup, Webhook, WebhookDelivery)
+from .utils import (Counter, event_to_dict, logging)
+
+
+__all__ = ['DeliveryError', 'WebhookDispatcher', 'enqueue_deliveries', 'render_payload', 'sign']
+
+logger = logging.getLogger(__name__)
+
+
+webhook_deliveries_total = Counter(
+    'status_page_webhook_deliveries_total', "Webhook delivery attempts, by outcome",
+    ['outcome'])
+
+
+_webhooks = Webhook.__table__
+_deliveries = WebhookDelivery.__table__
+
+# Built once, every event only binds new parameters
+_enqueue = _deliveries.insert().from_select(
+    ['webhook_id', 'event_id', 'state', 'attempts', 'next_attempt_at', 'created_at'],
+    select([
+        _webhooks.c.id,
+        bindparam('event_id', type_=_deliveries.c.event_id.type),
+        literal('pending', type_=_deliveries.c.state.type),
+        literal(0),
+        func.now(),
+        func.now(),
+    ]).where(and_(
+        # Uses the ix_webhooks_service_id and ix_webhooks_group_id indexes
+        or_(_webhooks.c.service_id == bindparam('service_id'),
+            _webhooks.c.group_id.in_(
+                select([ServiceServiceGroup.group_id])
+                .where(ServiceServiceGroup.service_id == bindparam('service_id')))),
+        or_(_webhooks.c.changes_only == false(), bindparam('changed', type_=Boolean)),
+    )))
+
+
+def enqueue_deliveries(db, event, changed):
+    """
+    Add the deliveries of a new `event` to the outbox
+
+    This only writes to the session's transaction, the caller commits it together with the event.
+
+    `changed` - Whether the event changes the status of its service, webhooks with `changes_only`
+                only get those
+    """
+    # The event needs its ID
+    db.flush()
+
+    db.execute(_enqueue, {
+        'event_id': event.id,
+        'service_id': event.service_id,
+        'changed': changed,
+    })
+
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def render_payload(webhook_id, deliveries):
+    """
+    The body of a request that delivers events to a webhook
+
+    `deliveries` - `(delivery, event)` tuples, `delivery` has an `id` and `attempts`
+    """
+    return json.dumps({
+        "webhook": f"/webhooks/{webhook_id}",
+        "events": [
+            {
+                "delivery": delivery.id,
+                # The attempt this is, starting at 1
+                "attempt": delivery.attempts + 1,
+                "service": f"/services/{event.service.slug}",
+                **event_to_dict(event),
+            }
+            for delivery, event in deliveries
+        ],
+    }).encode('utf-8')
+
+
+class DeliveryError(Exception):
+    def __init__(self, message, retry_after=None, permanent=False):
+        """
+        `retry_after` (optional) - Seconds the endpoint asked us to wait before trying again
+        `permanent` - The endpoint rejected the deliveries, trying again won't help
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+
+# A claimed delivery
+Claim = namedtuple('Claim', ['id', 'event_id', 'attempts'])
+
+# Claimed deliveries sent to an endpoint in a single request
+Batch = namedtuple('Batch', ['webhook_id', 'endpoint', 'secret', 'deliveries'])
+
+
+class WebhookDispatcher(object):
+    def __init__(self, session_factory, workers=8, endpoint_concurrency=2, batch_size=100,
+                 max_attempts=10, backoff=10.0, max_backoff=3600.0, timeout=10.0,
+                 poll_interval=5.0, batch_wait=0.5, retention=timedelta(days=7)):
+        """
+        Send the deliveries in the outbox from a background thread and a pool of senders
+
+        `session_factory` - Creates the SQLAlchemy sessions used by the dispatcher and its senders
+        `workers` - The most requests in flight at once
+        `endpoint_concurrency` - The most requests in flight to a single endpoint
+        `batch_size` - The most events sent in a single request
+        `max_attempts` - Attempts before a delivery is dead-lettered
+        `backoff` - Seconds to wait before the first retry, doubled for every retry after that
+        `max_backoff` - The longest (in seconds) to wait between two attempts
+        `timeout` - Seconds to wait for an endpoint to respond
+        `poll_interval` - Seconds between looking for due deliveries, deliveries of events recorded
+                          by this process are sent straight away
+        `batch_wait` - Seconds to wait for the rest of a burst of events, so it's sent together
+        `retention` - How long to keep delivered deliveries around
+        """
+        self.session_factory = session_factory
+        self.workers = workers
+        self.endpoint_concurrency = endpoint_concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.batch_wait = batch_wait
+        self.retention = retention
+
+        # Long enough for any request to finish, a dispatcher that dies leaves its deliveries
+        # claimed for this long
+        self.lease = timedelta(seconds=max(60.0, 3 * timeout))
+
+        self._reset()
+
+    def _reset(self):
+        # Requests in flight to each endpoint
+        self._in_flight = defaultdict(int)
+        self._executor = None
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._condition = threading.Condition()
+        # Why the dispatcher thread was woken up
+        self._new_events = False
+        self._request_done = False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='webhook-sender')
+        self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop claiming deliveries, and wait for the requests in flight
+        """
+        self._stopping.set()
+        self._wake()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def after_fork(self):
+        """
+        Call this in a forked child process to start afresh
+
+        The parent's threads don't exist in the child. Whatever they had claimed is sent again
+        once the claims expire.
+        """
+        self._reset()
+        self.start()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def __call__(self, service, event):
+        """
+        `EventIngestor` observer - the event may have deliveries, look for them now
+        """
+        self._wake(new_events=True)
+
+    def _wake(self, new_events=False, request_done=False):
+        with self._condition:
+            self._new_events = self._new_events or new_events
+            self._request_done = self._request_done or request_done
+            self._condition.notify()
+
+    def claim(self, db, limit, busy_endpoints=()):
+        """
+        Lease up to `limit` due deliveries, except those of webhooks with a busy endpoint
+
+        Returns them as `Batch`es, oldest first.
+        """
+        due = select([_deliveries.c.id])\
+            .where(and_(_deliveries.c.state == 'pending',
+                        _deliveries.c.next_attempt_at <= func.now()))
+
+        if busy_endpoints:
+            due = due.where(_deliveries.c.webhook_id.notin_(
+                select([_webhooks.c.id]).where(_webhooks.c.endpoint.in_(busy_endpoints))))
+
+        # Uses the ix_webhook_deliveries_due partial index, and skips what other dispatchers are
+        # claiming right now
+        due = due.order_by(_deliveries.c.next_attempt_at)\
+            .limit(limit)\
+            .with_for_update(skip_locked=True)
+
+        # = ANY(ARRAY(...)) looks the claimed deliveries up by their primary key, with IN (...)
+        # PostgreSQL hashes them and scans every delivery that was ever made
+        rows = db.execute(
+            _deliveries.update()
+            .where(and_(_deliveries.c.id == any_(func.array(due.as_scalar())),
+                        _deliveries.c.webhook_id == _webhooks.c.id))
+            .values(next_attempt_at=func.now() + self.lease)
+            .returning(_deliveries.c.id, _deliveries.c.event_id, _deliveries.c.attempts,
+                       _deliveries.c.created_at, _webhooks.c.id, _webhooks.c.endpoint,
+                       _webhooks.c.secret)).fetchall()
+
+        db.commit()
+
+        by_webhook = OrderedDict()
+        for delivery_id, event_id, attempts, _, webhook_id, endpoint, secret in sorted(
+                rows, key=lambda row: row[3]):
+            if webhook_id not in by_webhook:
+                by_webhook[webhook_id] = Batch(webhook_id, endpoint, secret, [])
+            by_webhook[webhook_id].deliveries.append(Claim(delivery_id, event_id, attempts))
+
+        return [
+            batch._replace(deliveries=batch.deliveries[start:start + self.batch_size])
+            for batch in by_webhook.values()
+            for start in range(0, len(batch.deliveries), self.batch_size)
+        ]
+
+    def release(self, db, batches):
+        """
+        Hand claimed deliveries back, for whichever dispatcher has room for them first
+        """
+        ids = [delivery.id for batch in batches for delivery in batch.deliveries]
+        if ids:
+            db.execute(_deliveries.update()
+                       .where(_deliveries.c.id.in_(ids))
+                       .values(next_attempt_at=func.now()))
+            db.commit()
+
+    def dispatch(self):
+        """
+        Claim the due deliveries there is room for, and hand them to the senders
+
+        Returns the number of requests started.
+        """
+        with self._condition:
+            free = self.workers - sum(self._in_flight.values())
+            busy_endpoints = [endpoint for endpoint, requests in self._in_flight.items()
+                              if requests >= self.endpoint_concurrency]
+
+        if free <= 0:
+            return 0
+
+        db = self.session_factory()
+        try:
+            batches = self.claim(db, free * self.batch_size, busy_endpoints)
+
+            started, left_over = [], []
+            with self._condition:
+                for batch in batches:
+                    if len(started) < free and \
+                            self._in_flight[batch.endpoint] < self.endpoint_concurrency:
+                        self._in_flight[batch.endpoint] += 1
+                        started.append(batch)
+                    else:
+                        left_over.append(batch)
+
+            for batch in started:
+                try:
+                    future = self._executor.submit(self.deliver, batch)
+                except RuntimeError:
+                    # The interpreter is exiting, leave them to another dispatcher
+                    self._done(batch.endpoint)
+                    left_over.append(batch)
+                else:
+                    future.add_done_callback(
+                        lambda future, endpoint=batch.endpoint: self._done(endpoint))
+
+            self.release(db, left_over)
+        finally:
+            db.close()
+
+        return len(started)
+
+    def _done(self, endpoint):
+        with self._condition:
+            self._in_flight[endpoint] -= 1
+            if not self._in_flight[endpoint]:
+                del self._in_flight[endpoint]
+
+        self._wake(request_done=True)
+
+    def send(self, url, secret, body):
+        """
+        POST `body` to `url`, raises `DeliveryError` unless the endpoint accepted it
+        """
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'status-page-webhooks',
+        }
+        if secret:
+            headers['X-Status-Page-Signature'] = sign(secret, body)
+
+        request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            retry_after = e.headers.get('Retry-After', '')
+            raise DeliveryError(
+                f"{e.code} {e.reason}",
+                retry_after=float(retry_after) if retry_after.isdigit() else None,
+                # Timeouts, rate limits and server errors are worth retrying, the rest isn't
+                permanent=e.code < 500 and e.code not in (408, 429))
+        except (urllib.error.URLError, OSError) as e:
+            raise DeliveryError(str(getattr(e, 'reason', e)) or e.__class__.__name__)
+
+    def deliver(self, batch):
+        """
+        Send a batch of deliveries in one request, and record how it went
+        """
+        db = self.session_factory()
+        try:
+            events = db.query(Event)\
+                .options(joinedload(Event.service))\
+                .filter(Event.id.in_([delivery.event_id for delivery in batch.deliveries]))\
+                .all()
+            events = {event.id: event for event in events}
+
+            # The deliveries of deleted events are deleted with them
+            deliveries = sorted(
+                ((delivery, events[delivery.event_id])
+                 for delivery in batch.deliveries if delivery.event_id in events),
+                key=lambda item: item[1].when)
+
+            if not deliveries:
+                return
+
+            try:
+                body = render_payload(batch.webhook_id, deliveries)
+                self.send(batch.endpoint, batch.secret, body)
+            except DeliveryError as e:
+                self.record_failure(db, batch, e)
+            else:
+                self.record_success(db, batch)
+        except Exception:
+            logger.exception("Could not deliver %d events to %s", len(batch.deliveries),
+                             batch.endpoint)
+        finally:
+            db.close()
+
+    def record_success(self, db, batch):
+        db.execute(_deliveries.update()
+                   .where(_deliveries.c.id.in_([delivery.id for delivery in batch.deliveries]))
+                   .values(state='delivered',
+                           attempts=_deliveries.c.attempts + 1,
+                           delivered_at=func.now(),
+                           last_error=None))
+        db.commit()
+
+        webhook_deliveries_total.inc(len(batch.deliveries), outcome='delivered')
+        logger.debug("Delivered %d events to %s", len(batch.deliveries), batch.endpoint)
+
+    def retry_delay(self, attempts, retry_after=None):
+        """
+        How long to wait after the `attempts`th failed attempt
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        # Don't retry everything that failed together at the same time
+        delay *= random.uniform(0.5, 1.0)
+
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+
+        return timedelta(seconds=delay)
+
+    def record_failure(self, db, batch, error):
+        updates = []
+        dead = 0
+
+        for delivery in batch.deliveries:
+            attempts = delivery.attempts + 1
+
+            if error.permanent or attempts >= self.max_attempts:
+                state, delay = 'dead', timedelta(0)
+                dead += 1
+            else:
+                state, delay = 'pending', self.retry_delay(attempts, error.retry_after)
+
+            updates.append({
+                'delivery_id': delivery.id,
+                'new_state': state,
+                'new_attempts': attempts,
+                'delay': delay,
+            })
+
+        db.execute(_deliveries.update()
+                   .where(_deliveries.c.id == bindparam('delivery_id'))
+                   .values(state=bindparam('new_state'),
+                           attempts=bindparam('new_attempts'),
+                           next_attempt_at=func.now() + bindparam('delay'),
+                           last_error=str(error)),
+                   updates)
+        db.commit()
+
+        retried = len(updates) - dead
+        if retried:
+            webhook_deliveries_total.inc(retried, outcome='retried')
+            logger.warning("Could not deliver %d events to %s, retrying: %s",
+                           retried, batch.endpoint, error)
+        if dead:
+            webhook_deliveries_total.inc(dead, outcome='dead')
+            logger.error("Gave up on delivering %d events to %s: %s", dead, batch.endpoint, error)
+
+    def prune(self, db):
+        """
+        Delete the deliveries that were delivered longer than `retention` ago
+        """
+        deleted = db.execute(_deliveries.delete()
+                             .where(and_(_deliveries.c.state == 'delivered',
+                                         _deliveries.c.delivered_at < func.now() - self.retention))
+                             ).rowcount
+        db.commit()
+
+        if deleted:
+            logger.info("Deleted %d old webhook deliveries", deleted)
+
+        return deleted
+
+    def _run(self):
+        next_prune = 0
+
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() >= next_prune:
+                    db = self.session_factory()
+                    try:
+                        self.prune(db)
+                    finally:
+                        db.close()
+                    next_prune = time.monotonic() + 3600
+
+                self.dispatch()
+            except Exception:
+                logger.exception("The webhook dispatcher failed, retrying in %.0fs",
+                                 self.poll_interval)
+
+            with self._condition:
+                if not (self._new_events or self._request_done or self._stopping.is_set()):
+                    self._condition.wait(self.poll_interval)
+
+                new_events = self._new_events
+                self._new_events = self._request_done = False
+
+            if new_events:
+                # Let the rest of a burst of events in, so it's sent together
+                self._stopping.wait(self.batch_wait)
+
+
+def main(argv=None):
+    # Only the command line needs the application's database setup
+    from sqlalchemy.orm import sessionmaker
+
+    from .app import (configure_logging, create_engine_from_config)
+    from .config import Config
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args(argv)
+
+    config = Config.from_environ()
+    configure_logging(config)
+
+    dispatcher = WebhookDispatcher(sessionmaker(bind=create_engine_from_config(config)),
+                                   workers=config.webhook_workers,
+                                   endpoint_concurrency=config.webhook_endpoint_concurrency,
+                                   max_attempts=config.webhook_max_attempts)
+    dispatcher.start()
+
+    logger.info("Sending webhook deliveries, %d at a time", dispatcher.workers)
+
+    try:
+        while dispatcher.running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.stop()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
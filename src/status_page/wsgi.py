@@ -1,4 +1,4 @@
-from app import get_app
+from status_page.app import get_app
 
 
 application = get_app()
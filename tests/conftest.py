@@ -0,0 +1,204 @@
+'''
+Shared fixtures
+
+The tests that need PostgreSQL use the database at STATUS_PAGE_TEST_DB_URL and are skipped without
+it. That database is dropped and recreated, so never point it at a real one:
+
+    STATUS_PAGE_TEST_DB_URL=postgresql://localhost/status_page_test pytest
+'''
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from http.server import (BaseHTTPRequestHandler, HTTPServer)
+
+from datetime import (datetime, timedelta)
+
+import falcon.testing
+import jwt
+import pytest
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.database import (create_schema, drop_schema)
+from benchmarks.run import generate_key_pair
+from status_page.config import Config
+from status_page.models import (Base, Service)
+
+
+SITE_ADMIN = 'admin'
+
+
+@pytest.fixture(scope='session')
+def engine():
+    url = os.environ.get('STATUS_PAGE_TEST_DB_URL')
+    if not url:
+        pytest.skip("Set STATUS_PAGE_TEST_DB_URL to a disposable PostgreSQL database")
+
+    engine = create_engine(url)
+    drop_schema(engine)
+    create_schema(engine)
+
+    yield engine
+
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    yield sessionmaker(bind=engine)
+
+    # Every test starts with empty tables
+    tables = ', '.join(table.name for table in Base.metadata.sorted_tables)
+    with engine.begin() as conn:
+        conn.execute(f'TRUNCATE {tables} CASCADE')
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope='session')
+def landing_page_key_pair():
+    return generate_key_pair()
+
+
+@pytest.fixture(scope='session')
+def app(engine, landing_page_key_pair):
+    from status_page.app import create_app
+
+    status_private, status_public = generate_key_pair()
+
+    config = Config(
+        site_admins=[SITE_ADMIN],
+        landing_page_public_key=landing_page_key_pair[1].encode('utf-8'),
+        status_page_private_key=status_private.encode('utf-8'),
+        status_page_public_key=status_public.encode('utf-8'),
+        db_url=str(engine.url),
+        audit_log=os.devnull,
+        log_level='WARNING',
+        # Nothing in the background, the tests run what they need themselves
+        heartbeats=False,
+        webhooks=False,
+        event_rate_limit=None)
+
+    return create_app(config)
+
+
+@pytest.fixture
+def client(app, session_factory):
+    return falcon.testing.TestClient(app)
+
+
+def landing_page_token(private_key, username):
+    token = jwt.encode({
+        'user_dict': {'username': f'{username}@corpmz.com'},
+        'exp': datetime.now(tz=pytz.utc) + timedelta(hours=1),
+    }, private_key, algorithm='RS512')
+
+    return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+@pytest.fixture
+def admin_headers(landing_page_key_pair):
+    return {'Authorization': f"JWT {landing_page_token(landing_page_key_pair[0], SITE_ADMIN)}"}
+
+
+@pytest.fixture
+def service(db):
+    service = Service(name="Jira", description="Issue tracker")
+    db.add(service)
+    db.commit()
+    return service
+
+
+class FakeClock(object):
+    """
+    A clock that only moves when a test moves it, pass it as the `clock` of what's tested
+    """
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Receiver(object):
+    """
+    A local HTTP server that records every request, and answers with the queued statuses (200
+    once they run out) after `delay` seconds
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = queue.Queue()
+        self.delay = 0
+        self._received = threading.Condition()
+
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(receiver.delay)
+
+                try:
+                    status = receiver.statuses.get_nowait()
+                except queue.Empty:
+                    status = 200
+
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+                with receiver._received:
+                    receiver.requests.append((self.path, dict(self.headers), body))
+                    receiver._received.notify_all()
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait_for(self, count, timeout=10):
+        """
+        Wait until at least `count` requests were received, and return them
+        """
+        with self._received:
+            self._received.wait_for(lambda: len(self.requests) >= count, timeout)
+            return list(self.requests)
+
+    def json(self):
+        return [json.loads(body) for path, headers, body in self.requests]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def receiver():
+    receiver = Receiver()
+    yield receiver
+    receiver.close()
@@ -0,0 +1,69 @@
+from status_page.utils import (AdmissionController, PoolWaitTracker)
+
+
+LOW, NORMAL, HIGH = AdmissionController.LOW, AdmissionController.NORMAL, AdmissionController.HIGH
+
+
+def admit(controller, priority, count):
+    return [controller.try_admit(priority) for _ in range(count)]
+
+
+def test_in_flight_requests_are_shed_by_priority():
+    controller = AdmissionController(max_in_flight=10)
+
+    assert admit(controller, LOW, 6) == [None] * 5 + [AdmissionController.IN_FLIGHT]
+    assert admit(controller, NORMAL, 4) == [None] * 3 + [AdmissionController.IN_FLIGHT]
+    assert admit(controller, HIGH, 3) == [None] * 2 + [AdmissionController.IN_FLIGHT]
+    assert controller.in_flight == 10
+
+    controller.release()
+    assert controller.try_admit(LOW) == AdmissionController.IN_FLIGHT
+    assert controller.try_admit(HIGH) is None
+
+
+def test_released_requests_make_room():
+    controller = AdmissionController(max_in_flight=2)
+
+    assert admit(controller, LOW, 2) == [None, AdmissionController.IN_FLIGHT]
+    controller.release()
+    assert controller.try_admit(LOW) is None
+
+
+def test_everything_is_admitted_without_limits():
+    controller = AdmissionController()
+
+    assert admit(controller, LOW, 100) == [None] * 100
+
+
+def test_pool_waits_shed_low_then_normal_priority_requests(clock):
+    waits = PoolWaitTracker(clock=clock)
+    controller = AdmissionController(max_pool_wait=1, pool_waits=waits)
+
+    token = waits.start()
+    clock.now += 1.5
+    assert [controller.try_admit(priority) for priority in (LOW, NORMAL, HIGH)] == \
+        [AdmissionController.POOL_WAIT, None, None]
+
+    clock.now += 1
+    assert [controller.try_admit(priority) for priority in (LOW, NORMAL, HIGH)] == \
+        [AdmissionController.POOL_WAIT, AdmissionController.POOL_WAIT, None]
+
+    waits.stop(token)
+    assert controller.try_admit(LOW) is None
+
+
+def test_pool_wait_tracker_reports_the_longest_wait(clock):
+    waits = PoolWaitTracker(clock=clock)
+    assert waits.longest_wait() == 0
+
+    first = waits.start()
+    clock.now += 2
+    second = waits.start()
+    clock.now += 1
+    assert (len(waits), waits.longest_wait()) == (2, 3)
+
+    waits.stop(first)
+    assert (len(waits), waits.longest_wait()) == (1, 1)
+
+    waits.stop(second)
+    assert waits.longest_wait() == 0
@@ -0,0 +1,95 @@
+from datetime import (datetime, timedelta)
+
+import pytest
+import pytz
+
+from status_page.models import (Event, Permission)
+
+from conftest import landing_page_token
+
+
+@pytest.fixture
+def updater_headers(landing_page_key_pair):
+    return {'Authorization': f"JWT {landing_page_token(landing_page_key_pair[0], 'ops')}"}
+
+
+@pytest.fixture
+def permission(db, service):
+    permission = Permission(username='ops', service_id=service.id, type='updater')
+    db.add(permission)
+    db.commit()
+    return permission
+
+
+def create_api_key(client, headers, permission, bot):
+    response = client.simulate_post('/api-keys', headers=headers, json={
+        'permission': str(permission.id),
+        'bot': bot,
+    })
+    assert response.status_code == 200, response.text
+
+    return response.json['api_key']['jwt']
+
+
+@pytest.mark.parametrize('bot', [True, False])
+def test_api_keys_can_report_events(client, updater_headers, service, permission, bot):
+    api_key = create_api_key(client, updater_headers, permission, bot)
+
+    response = client.simulate_post(f'/services/{service.slug}/events',
+                                    headers={'Authorization': f"JWT {api_key}"},
+                                    json={'status': 'down', 'description': "Jira is down",
+                                          'informational': False})
+
+    assert response.status_code == 200, response.text
+    assert response.json['status'] == 'down'
+
+
+def test_api_keys_cannot_create_api_keys(client, updater_headers, permission):
+    api_key = create_api_key(client, updater_headers, permission, bot=False)
+
+    response = client.simulate_post('/api-keys', headers={'Authorization': f"JWT {api_key}"},
+                                    json={'permission': str(permission.id), 'bot': False})
+
+    assert response.status_code == 401
+
+
+def test_api_keys_need_a_permission_of_their_own(client, admin_headers, permission):
+    response = client.simulate_post('/api-keys', headers=admin_headers,
+                                    json={'permission': str(permission.id), 'bot': True})
+
+    assert response.status_code == 400
+
+
+def record(db, service, *statuses):
+    start = datetime.now(tz=pytz.utc) - timedelta(hours=1)
+    for i, status in enumerate(statuses):
+        db.add(Event(service_id=service.id, status=status, description="", informational=False,
+                     extra={}, when=start + timedelta(minutes=i)))
+    db.commit()
+
+
+def test_status_window_is_only_truncated_with_more_events_than_the_limit(
+        db, client, admin_headers, service):
+    # The window starts at the last 'up' event
+    record(db, service, 'down', 'up', 'limited', 'down', 'limited')
+
+    response = client.simulate_get(f'/services/{service.slug}/status', params={'limit': 4})
+    assert response.status_code == 200, response.text
+    assert [event['status'] for event in response.json['events']] == \
+        ['limited', 'down', 'limited', 'up']
+    assert response.json['truncated'] is False
+
+    response = client.simulate_get(f'/services/{service.slug}/status', params={'limit': 3})
+    assert response.json['truncated'] is True
+    assert len(response.json['events']) == 3
+
+    # The rest of the window, and nothing before it
+    more_link = response.json['more']
+    more = client.simulate_get(more_link, headers=admin_headers)
+    assert more.status_code == 200, more.text
+    assert [event['status'] for event in more.json['results']] == ['up']
+
+    response = client.simulate_get('/status', params={'limit': 4})
+    assert response.json['results'][service.name]['truncated'] is False
+    response = client.simulate_get('/status', params={'limit': 3})
+    assert response.json['results'][service.name]['more'] == more_link
@@ -0,0 +1,37 @@
+from sqlalchemy import create_engine
+
+from status_page import app
+
+
+class Worker(object):
+    def __init__(self):
+        self.forked = False
+
+    def after_fork(self):
+        self.forked = True
+
+
+def test_post_fork_leaves_the_parents_connections_open(engine, monkeypatch):
+    parent_engine = create_engine(engine.url)
+    worker = Worker()
+    monkeypatch.setitem(app.session_factory.kw, 'bind', parent_engine)
+    monkeypatch.setattr(app, 'background_workers', [worker])
+
+    with parent_engine.connect() as conn:
+        parent_connection = conn.connection.connection
+    parent_pool = parent_engine.pool
+
+    try:
+        app.post_fork()
+
+        assert worker.forked
+        assert parent_engine.pool is not parent_pool
+        # Checked back into the parent's pool, and still open for the parent to use
+        assert not parent_connection.closed
+
+        with parent_engine.connect() as conn:
+            assert conn.connection.connection is not parent_connection
+            assert conn.scalar('SELECT 1') == 1
+    finally:
+        parent_pool.dispose()
+        parent_engine.dispose()
@@ -0,0 +1,53 @@
+import jwt
+import pytest
+
+from benchmarks.run import generate_key_pair
+from status_page.config import Config
+from status_page.utils.authentication import JWTAuth
+
+
+class Request(object):
+    def __init__(self, auth):
+        self.auth = auth
+
+
+def encode(auth, payload):
+    token = auth.encode(payload)
+    return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+def config(http_header_prefix='JWT'):
+    private_key, public_key = generate_key_pair()
+    return Config(status_page_private_key=private_key.encode('utf-8'),
+                  status_page_public_key=public_key.encode('utf-8'),
+                  http_header_prefix=http_header_prefix)
+
+
+def test_keys_and_header_prefix_follow_the_configuration():
+    configs = [config(), config(http_header_prefix='Bearer')]
+    current = configs[0]
+
+    auth = JWTAuth(private_key=lambda: current.status_page_private_key,
+                   public_key=lambda: current.status_page_public_key,
+                   http_header_prefix=lambda: current.http_header_prefix, algorithm='RS512')
+
+    auth.load_keys()
+    first_token = encode(auth, {'username': 'admin'})
+    assert auth.authenticate(Request(f"JWT {first_token}")) == {'username': 'admin'}
+
+    # Like a second create_app() in the same process
+    current = configs[1]
+    second_token = encode(auth, {'username': 'admin'})
+    assert auth.authenticate(Request(f"Bearer {second_token}")) == {'username': 'admin'}
+
+    with pytest.raises(jwt.InvalidSignatureError):
+        auth.authenticate(Request(f"Bearer {first_token}"))
+    with pytest.raises(jwt.InvalidTokenError):
+        auth.authenticate(Request(f"JWT {second_token}"))
+
+
+def test_keys_are_only_parsed_once():
+    current = config()
+    auth = JWTAuth(public_key=lambda: current.status_page_public_key, algorithm='RS512')
+
+    assert auth.public_key is auth.public_key
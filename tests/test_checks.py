@@ -0,0 +1,150 @@
+import asyncio
+import socket
+
+import jsonschema
+import pytest
+
+from status_page.checks import (Checker, HTTPProbe, TCPProbe, load_checks)
+from status_page.ingestion import EventIngestor
+from status_page.models import (Event, Service)
+
+
+@pytest.fixture
+def services(db):
+    services = [Service(name="Jira", description="Issue tracker"),
+                Service(name="Postgres", description="Database")]
+    db.add_all(services)
+    db.commit()
+    return services
+
+
+@pytest.fixture
+def listening_port():
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(16)
+        yield listener.getsockname()[1]
+
+
+@pytest.fixture
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def recorded(db, slug):
+    db.expire_all()
+    return [status for status, in db.query(Event.status)
+            .join(Service)
+            .filter(Service.slug == slug)
+            .order_by(Event.when)]
+
+
+def test_run_once_records_the_status_of_every_service(
+        db, session_factory, services, receiver, closed_port):
+    checks = load_checks([
+        {"service": "jira", "http": f"{receiver.url}/status"},
+        {"service": "postgres", "tcp": f"127.0.0.1:{closed_port}"},
+    ])
+    checker = Checker(session_factory, EventIngestor(), checks)
+
+    results = run(checker.run_once())
+
+    assert [result.status for result in results.values()] == ['up', 'down']
+    assert recorded(db, 'jira') == ['up']
+    assert recorded(db, 'postgres') == ['down']
+
+    [event] = db.query(Event).join(Service).filter(Service.slug == 'jira')
+    assert event.extra['check']['type'] == 'http'
+    assert event.extra['check']['target'] == f"{receiver.url}/status"
+
+
+def test_only_changes_are_recorded(db, session_factory, services, receiver):
+    checker = Checker(session_factory, EventIngestor(),
+                      load_checks([{"service": "jira", "http": receiver.url}]))
+
+    run(checker.run_once())
+    run(checker.run_once())
+    assert recorded(db, 'jira') == ['up']
+
+    receiver.statuses.put(503)
+    results = run(checker.run_once())
+    assert [result.detail for result in results.values()] == [f"{receiver.url}: HTTP 503"]
+
+    run(checker.run_once())
+    assert recorded(db, 'jira') == ['up', 'down', 'up']
+
+
+def test_restarting_records_nothing_new(db, session_factory, services, listening_port):
+    checks = load_checks([{"service": "postgres", "tcp": f"127.0.0.1:{listening_port}"}])
+
+    run(Checker(session_factory, EventIngestor(), checks).run_once())
+
+    checker = Checker(session_factory, EventIngestor(), checks)
+    checker.load_statuses()
+    run(checker.run_once())
+
+    assert recorded(db, 'postgres') == ['up']
+
+
+def test_slow_answer_is_limited(db, session_factory, services, receiver):
+    receiver.delay = 0.3
+    checker = Checker(session_factory, EventIngestor(), load_checks([
+        {"service": "jira", "http": receiver.url, "max_latency": 0.1},
+    ]))
+
+    [result] = run(checker.run_once()).values()
+
+    assert result.status == 'limited'
+    assert result.latency >= 0.3
+    assert recorded(db, 'jira') == ['limited']
+
+
+def test_service_is_as_up_as_its_worst_check(
+        db, session_factory, services, receiver, listening_port, closed_port):
+    checker = Checker(session_factory, EventIngestor(), load_checks([
+        {"service": "jira", "http": receiver.url},
+        {"service": "jira", "tcp": f"127.0.0.1:{listening_port}"},
+        {"service": "jira", "tcp": f"127.0.0.1:{closed_port}"},
+    ]))
+
+    run(checker.run_once())
+
+    assert recorded(db, 'jira') == ['down']
+
+
+def test_probe_times_out():
+    # The kernel completes the connection, but nothing ever answers on it
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(0)
+        port = listener.getsockname()[1]
+
+        result = run(HTTPProbe(f"http://127.0.0.1:{port}/", timeout=0.2).run())
+
+    assert result.status == 'down'
+    assert result.latency is None
+
+
+def test_tcp_probe_reports_the_target(closed_port):
+    result = run(TCPProbe('127.0.0.1', closed_port).run())
+
+    assert result.status == 'down'
+    assert result.detail.startswith(f"127.0.0.1:{closed_port}: ")
+
+
+def test_load_checks_rejects_bad_definitions():
+    with pytest.raises(jsonschema.ValidationError):
+        load_checks([{"service": "jira"}])
+
+    with pytest.raises(ValueError):
+        load_checks([{"service": "jira", "http": "ftp://example.com"}])
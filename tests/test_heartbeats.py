@@ -0,0 +1,166 @@
+import threading
+import uuid
+from datetime import (datetime, timedelta)
+
+import pytest
+import pytz
+
+from status_page import heartbeats
+from status_page.heartbeats import HeartbeatMonitor
+from status_page.ingestion import EventIngestor
+from status_page.models import Event
+
+from conftest import FakeClock
+
+
+NOW = datetime(2018, 1, 1, 12, tzinfo=pytz.utc)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(NOW.timestamp())
+
+
+def test_pop_due_only_returns_passed_deadlines(clock):
+    monitor = HeartbeatMonitor(None, None, clock=clock)
+    a, b, c = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    monitor.schedule(a, NOW - timedelta(seconds=10))
+    monitor.schedule(b, NOW)
+    monitor.schedule(c, NOW + timedelta(seconds=10))
+
+    assert sorted(monitor.pop_due(clock())) == sorted([a, b])
+    assert monitor.pop_due(clock()) == []
+    assert len(monitor) == 1
+
+
+def test_pop_due_skips_moved_and_cancelled_deadlines(clock):
+    monitor = HeartbeatMonitor(None, None, clock=clock)
+    moved, cancelled = uuid.uuid4(), uuid.uuid4()
+
+    monitor.schedule(moved, NOW - timedelta(seconds=10))
+    monitor.schedule(moved, NOW + timedelta(seconds=10))
+    monitor.schedule(cancelled, NOW - timedelta(seconds=10))
+    monitor.cancel(cancelled)
+
+    assert monitor.pop_due(clock()) == []
+    assert monitor.pop_due(clock() + 10) == [moved]
+
+
+def test_observer_only_watches_services_that_are_up(clock):
+    monitor = HeartbeatMonitor(None, None, clock=clock)
+
+    class Service(object):
+        id = uuid.uuid4()
+        heartbeat_interval = 60
+
+    up = Event(status='up', when=NOW)
+    monitor(Service, up)
+    assert monitor.pop_due(clock() + 60) == [Service.id]
+
+    monitor(Service, up)
+    monitor(Service, Event(status='down', when=NOW))
+    assert monitor.pop_due(clock() + 60) == []
+
+
+def record(db, service, status, when):
+    db.add(Event(service_id=service.id, status=status, description="", informational=False,
+                 extra={}, when=when))
+    db.commit()
+
+
+def statuses(db, service):
+    db.expire_all()
+    return [status for status, in db.query(Event.status)
+            .filter(Event.service_id == service.id)
+            .order_by(Event.when)]
+
+
+def check(monitor, session_factory, service):
+    db = session_factory()
+    try:
+        return monitor.check(db, service.id)
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def heartbeat_service(db, service):
+    service.heartbeat_interval = 60
+    db.commit()
+    return service
+
+
+def test_check_marks_a_missed_heartbeat_down(db, session_factory, heartbeat_service, clock):
+    record(db, heartbeat_service, 'up', NOW - timedelta(seconds=61))
+    monitor = HeartbeatMonitor(session_factory, EventIngestor(), clock=clock)
+
+    assert check(monitor, session_factory, heartbeat_service)
+    assert statuses(db, heartbeat_service) == ['up', 'down']
+
+    # It's down now, so it can't miss another one
+    assert not check(monitor, session_factory, heartbeat_service)
+    assert statuses(db, heartbeat_service) == ['up', 'down']
+
+
+def test_check_reschedules_a_heartbeat_recorded_meanwhile(
+        db, session_factory, heartbeat_service, clock):
+    record(db, heartbeat_service, 'up', NOW - timedelta(seconds=30))
+    monitor = HeartbeatMonitor(session_factory, EventIngestor(), clock=clock)
+
+    assert not check(monitor, session_factory, heartbeat_service)
+    assert statuses(db, heartbeat_service) == ['up']
+    assert monitor.pop_due(clock() + 30) == [heartbeat_service.id]
+
+
+def test_sync_watches_the_services_that_are_up(db, session_factory, heartbeat_service, clock):
+    monitor = HeartbeatMonitor(session_factory, EventIngestor(), clock=clock)
+
+    # Not watched until it reports
+    monitor.sync(db)
+    assert len(monitor) == 0
+
+    record(db, heartbeat_service, 'up', NOW)
+    monitor.sync(db)
+    assert monitor.pop_due(clock() + 60) == [heartbeat_service.id]
+
+
+def test_failure_resyncs_the_popped_services(monkeypatch, clock):
+    monkeypatch.setattr(heartbeats, 'RETRY_DELAY', 0.01)
+
+    class Session(object):
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    monitor = HeartbeatMonitor(Session, None, sync_interval=3600, clock=clock)
+    service_ids = [uuid.uuid4(), uuid.uuid4()]
+    checked = []
+    done = threading.Event()
+
+    def sync(db):
+        for service_id in service_ids:
+            monitor.schedule(service_id, NOW)
+
+    def flaky_check(db, service_id):
+        if not checked:
+            checked.append(None)
+            raise RuntimeError("The database went away")
+
+        checked.append(service_id)
+        if len(checked) > len(service_ids):
+            done.set()
+
+    monitor.sync = sync
+    monitor.check = flaky_check
+
+    monitor.start()
+    try:
+        assert done.wait(5)
+    finally:
+        monitor.stop(5)
+
+    # Both were popped when the first check failed, the sync after it put them back
+    assert sorted(checked[1:]) == sorted(service_ids)
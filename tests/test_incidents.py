@@ -0,0 +1,87 @@
+from datetime import (datetime, timedelta)
+
+import pytest
+import pytz
+from sqlalchemy.exc import IntegrityError
+
+from status_page.incidents import (CLOSE, ESCALATE, OPEN, backfill_incidents, derive_incidents,
+                                   incident_change)
+from status_page.ingestion import EventIngestor
+from status_page.models import (Event, Incident)
+
+
+START = datetime(2018, 1, 1, tzinfo=pytz.utc)
+
+
+def history(service_id, *statuses):
+    return [(f"{service_id}-{i}", service_id, status, START + timedelta(minutes=i))
+            for i, status in enumerate(statuses)]
+
+
+@pytest.mark.parametrize('previous_status, status, change', [
+    (None, 'up', None),
+    (None, 'down', OPEN),
+    ('up', 'limited', OPEN),
+    ('limited', 'down', ESCALATE),
+    ('down', 'limited', None),
+    ('down', 'down', None),
+    ('limited', 'up', CLOSE),
+])
+def test_incident_change(previous_status, status, change):
+    assert incident_change(previous_status, status) == change
+
+
+def test_derive_incidents_spans_from_the_first_event_that_is_not_up_to_the_next_up():
+    [incident] = derive_incidents(history('a', 'up', 'limited', 'down', 'limited', 'up', 'up'))
+
+    assert incident == {
+        'service_id': 'a',
+        # The worst status during the incident
+        'status': 'down',
+        'started_at': START + timedelta(minutes=1),
+        'ended_at': START + timedelta(minutes=4),
+        'start_event_id': 'a-1',
+        'end_event_id': 'a-4',
+    }
+
+
+def test_derive_incidents_leaves_the_last_one_open_and_starts_over_per_service():
+    incidents = list(derive_incidents(
+        history('a', 'down', 'up', 'down') + history('b', 'limited') + history('c', 'up')))
+
+    assert [(incident['service_id'], incident['status'], incident['end_event_id'])
+            for incident in incidents] == [('a', 'down', 'a-1'), ('a', 'down', None),
+                                           ('b', 'limited', None)]
+
+
+def record(db, service, *statuses):
+    ingestor = EventIngestor()
+    for i, status in enumerate(statuses):
+        ingestor.record(db, service, status=status, description="", informational=False,
+                        when=START + timedelta(minutes=i))
+
+
+def incidents(db):
+    db.expire_all()
+    return [(incident.status, incident.started_at, incident.ended_at)
+            for incident in db.query(Incident).order_by(Incident.started_at)]
+
+
+def test_recorded_events_keep_the_incidents_up_to_date_like_the_backfill(db, service):
+    record(db, service, 'up', 'limited', 'down', 'up', 'down')
+
+    recorded = incidents(db)
+    assert [(status, ended_at is None) for status, started_at, ended_at in recorded] == \
+        [('down', False), ('down', True)]
+
+    assert backfill_incidents(db, batch_size=1) == 2
+    assert incidents(db) == recorded
+
+
+def test_a_service_has_at_most_one_open_incident(db, service):
+    record(db, service, 'down')
+    [event] = db.query(Event).all()
+
+    db.add(Incident(service_id=service.id, status='down', started_at=START, start_event=event))
+    with pytest.raises(IntegrityError):
+        db.commit()
@@ -0,0 +1,91 @@
+import json
+import logging
+
+from status_page.utils import (AUDIT, AuditFilter, BatchedWatchedFileHandler, JSONFormatter)
+
+
+class Expired(object):
+    """
+    Like an ORM object whose session went away before its record is formatted
+    """
+
+    def __init__(self):
+        self.expired = False
+
+    def __str__(self):
+        if self.expired:
+            raise RuntimeError("Instance is not bound to a Session")
+        return "jira"
+
+
+def audit_record(msg, *args):
+    return logging.LogRecord('status_page.api', AUDIT, __file__, 1, msg, args, None)
+
+
+def messages(path):
+    return [json.loads(line)['message'] for line in path.read_text().splitlines()]
+
+
+def file_handler(path):
+    handler = BatchedWatchedFileHandler(str(path), fsync=False, delay=True)
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+
+def test_processes_append_to_the_same_file_and_follow_its_rotation(tmp_path):
+    path = tmp_path / 'audit.log'
+    # One per worker process
+    first, second = file_handler(path), file_handler(path)
+
+    first.handle_batch([audit_record("first %d", 1)])
+    second.handle_batch([audit_record("second %d", 1)])
+
+    path.rename(tmp_path / 'audit.log.1')
+
+    first.handle_batch([audit_record("first %d", 2)])
+    second.handle_batch([audit_record("second %d", 2)])
+    first.close()
+    second.close()
+
+    assert messages(tmp_path / 'audit.log.1') == ["first 1", "second 1"]
+    assert messages(path) == ["first 2", "second 2"]
+
+
+def test_a_record_that_cannot_be_formatted_does_not_lose_the_batch(tmp_path, monkeypatch):
+    # handleError() would print the traceback
+    monkeypatch.setattr(logging, 'raiseExceptions', False)
+
+    path = tmp_path / 'audit.log'
+    handler = file_handler(path)
+
+    broken = Expired()
+    broken.expired = True
+    handler.handle_batch([audit_record("User %s deleted %s", 'admin', 'jira'),
+                          audit_record("User %s created a webhook for %s", 'admin', broken),
+                          audit_record("User %s deleted %s", 'admin', 'confluence')])
+    handler.close()
+
+    assert messages(path) == ["User admin deleted jira", "User admin deleted confluence"]
+
+
+def test_audit_turns_its_arguments_into_strings_on_the_calling_thread():
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    logger = logging.getLogger('status_page.tests.audit')
+    logger.setLevel(AUDIT)
+    handler = Handler()
+    handler.addFilter(AuditFilter())
+    logger.addHandler(handler)
+    try:
+        service = Expired()
+        logger.audit("User %s redelivered %d deliveries for %s", 'admin', 3, service)
+        service.expired = True
+    finally:
+        logger.removeHandler(handler)
+
+    [record] = records
+    assert record.getMessage() == "User admin redelivered 3 deliveries for jira"
@@ -0,0 +1,156 @@
+import email
+import socketserver
+import threading
+import uuid
+from datetime import datetime
+
+import pytest
+import pytz
+
+from status_page.ingestion import Transition
+from status_page.models import EphemeralNotification
+from status_page.notifications import (ChatTransport, LocalTransport, NotificationDispatcher,
+                                       SMTPTransport)
+
+
+class FakeSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Just enough of an SMTP server for smtplib, it keeps the messages it receives
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.messages = []
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+            def handle(self):
+                self.reply("220 localhost ESMTP")
+
+                for line in self.rfile:
+                    command = line.decode('ascii').strip().upper()
+
+                    if command.startswith(('EHLO', 'HELO')):
+                        self.reply("250 localhost")
+                    elif command == 'DATA':
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                        server.messages.append(email.message_from_bytes(data))
+                        self.reply("250 OK")
+                    elif command == 'QUIT':
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        super().__init__(('127.0.0.1', 0), Handler)
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def smtp_server():
+    server = FakeSMTPServer()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def transition(service):
+    return Transition(service_id=service.id, service_name=service.name, service_slug=service.slug,
+                      event_id=uuid.uuid4(), previous_status='up', status='down',
+                      when=datetime(2018, 1, 1, tzinfo=pytz.utc))
+
+
+def subscribe(db, service, username, chat, email):
+    db.add(EphemeralNotification(service_id=service.id, username=username, chat=chat,
+                                 email=email))
+    db.commit()
+
+
+def subscriptions(db):
+    db.expire_all()
+    return {subscription.username: (subscription.chat, subscription.email)
+            for subscription in db.query(EphemeralNotification)}
+
+
+def test_dispatch_delivers_every_channel_and_consumes_the_subscriptions(
+        db, session_factory, service, transition, smtp_server, receiver):
+    subscribe(db, service, 'alice', chat=True, email=True)
+    subscribe(db, service, 'bob', chat=False, email=True)
+
+    dispatcher = NotificationDispatcher(session_factory, [
+        SMTPTransport(*smtp_server.server_address, domain='example.com'),
+        ChatTransport(f"{receiver.url}/chat"),
+    ])
+    dispatcher.process_batch([transition])
+
+    assert sorted(message['To'] for message in smtp_server.messages) == \
+        ['alice@example.com', 'bob@example.com']
+    assert all(message['Subject'] == "Jira is down" for message in smtp_server.messages)
+
+    # One chat message per transition, mentioning every subscriber
+    [chat] = receiver.json()
+    assert chat['text'].startswith("@alice Jira changed from up to down")
+
+    assert subscriptions(db) == {}
+
+
+def test_failed_channel_is_retried_on_the_next_change(
+        db, session_factory, service, transition, smtp_server, receiver):
+    subscribe(db, service, 'alice', chat=True, email=True)
+
+    dispatcher = NotificationDispatcher(session_factory, [
+        SMTPTransport(*smtp_server.server_address),
+        ChatTransport(f"{receiver.url}/chat"),
+    ])
+
+    receiver.statuses.put(500)
+    dispatcher.process_batch([transition])
+
+    # The email went out, so only the chat notification is left
+    assert len(smtp_server.messages) == 1
+    assert subscriptions(db) == {'alice': (True, False)}
+
+    dispatcher.process_batch([transition._replace(previous_status='down', status='up')])
+
+    assert len(smtp_server.messages) == 1
+    assert len(receiver.requests) == 2
+    assert subscriptions(db) == {}
+
+
+def test_subscription_renewed_while_sending_is_kept(db, session_factory, service, transition):
+    subscribe(db, service, 'alice', chat=True, email=False)
+
+    class RenewingTransport(LocalTransport):
+        def send_batch(self, notifications):
+            super().send_batch(notifications)
+
+            # What a PUT to /services/{slug}/subscription does meanwhile
+            other = session_factory()
+            subscription = other.query(EphemeralNotification).one()
+            subscription.version = EphemeralNotification.version + 1
+            other.commit()
+            other.close()
+
+    transport = RenewingTransport('chat')
+    NotificationDispatcher(session_factory, [transport]).process_batch([transition])
+
+    assert [notification.username for notification in transport.outbox] == ['alice']
+    assert subscriptions(db) == {'alice': (True, False)}
+
+
+def test_channel_without_transport_is_kept(db, session_factory, service, transition):
+    subscribe(db, service, 'alice', chat=True, email=True)
+
+    transport = LocalTransport('email')
+    NotificationDispatcher(session_factory, [transport]).process_batch([transition])
+
+    assert len(transport.outbox) == 1
+    assert subscriptions(db) == {'alice': (True, False)}
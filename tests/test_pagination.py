@@ -0,0 +1,53 @@
+import pytest
+
+from status_page.models import Service
+from status_page.utils import (pagination, paginate)
+
+
+@pytest.fixture
+def services(db):
+    db.add_all([Service(name=f"Service {i}", description="") for i in range(5)])
+    db.commit()
+
+    return db.query(Service).order_by(Service.name)
+
+
+@pytest.fixture
+def estimate(monkeypatch):
+    """
+    Make the planner estimate this many rows
+    """
+    def set_estimate(rows):
+        monkeypatch.setattr(pagination, 'estimated_count', lambda query: (rows, False))
+    return set_estimate
+
+
+def test_estimate_short_page_is_counted_exactly(services, estimate):
+    estimate(1000)
+    page = paginate(services, 3, 2, count='estimate')
+
+    assert (len(page.results), page.count, page.count_exact, page.next) == (1, 5, True, None)
+
+
+def test_estimate_page_past_the_end_keeps_the_estimate(services, estimate):
+    estimate(1000)
+    page = paginate(services, 4, 2, count='estimate')
+
+    assert (page.results, page.count, page.count_exact, page.next) == ([], 1000, False, None)
+
+
+def test_estimate_too_low_still_has_a_next_page(services, estimate):
+    estimate(1)
+    page = paginate(services, 1, 2, count='estimate')
+
+    assert len(page.results) == 2
+    assert page.next_page == 2
+    assert (page.count, page.count_exact) == (3, False)
+
+
+def test_estimate_of_the_last_full_page(services, estimate):
+    estimate(1000)
+    page = paginate(services.limit(4).from_self(), 2, 2, count='estimate')
+
+    assert (len(page.results), page.next) == (2, None)
+    assert page.count_exact is False
@@ -0,0 +1,90 @@
+import pytest
+
+from status_page.utils import (KeyedRateLimiter, SharedRateLimiter, TokenBucket)
+
+
+def test_token_bucket_allows_a_burst_then_refills(clock):
+    bucket = TokenBucket(2, capacity=4, clock=clock)
+
+    assert [bucket.try_consume()[0] for _ in range(5)] == [True, True, True, True, False]
+    assert bucket.try_consume() == (False, 0.5)
+
+    clock.now += 1
+    assert bucket.tokens == 2
+    assert bucket.try_consume(2) == (True, 0.0)
+
+
+def test_token_bucket_never_holds_more_than_its_capacity(clock):
+    bucket = TokenBucket(10, clock=clock)
+
+    clock.now += 60
+    assert bucket.tokens == 10
+
+
+def test_token_bucket_consume_clamps_to_the_capacity(monkeypatch, clock):
+    bucket = TokenBucket(1, capacity=2, clock=clock)
+    bucket.try_consume(2)
+
+    def sleep(seconds):
+        clock.now += seconds
+
+    monkeypatch.setattr('status_page.utils.ratelimit.time.sleep', sleep)
+
+    # More than the bucket can ever hold waits for a full bucket instead of forever
+    bucket.consume(5)
+    assert clock.now == 2
+
+
+def test_token_bucket_rejects_a_rate_of_zero():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_keyed_rate_limiter_keeps_a_bucket_per_key(clock):
+    limiter = KeyedRateLimiter(1, capacity=2, clock=clock)
+
+    assert [limiter.try_consume('a')[0] for _ in range(3)] == [True, True, False]
+    assert limiter.try_consume('b') == (True, 0.0)
+
+    clock.now += 1
+    assert limiter.try_consume('a') == (True, 0.0)
+    assert limiter.try_consume('a') == (False, 1.0)
+
+
+def test_keyed_rate_limiter_forgets_the_least_recently_used_keys(clock):
+    limiter = KeyedRateLimiter(1, maxsize=2, clock=clock)
+
+    limiter.try_consume('a')
+    limiter.try_consume('b')
+    limiter.try_consume('a')
+    limiter.try_consume('c')
+
+    assert len(limiter) == 2
+    # 'a' was kept, 'b' was forgotten so it starts over with a full bucket
+    assert not limiter.try_consume('a')[0]
+    assert limiter.try_consume('b')[0]
+
+
+def test_shared_rate_limiter_is_shared_through_its_file(tmp_path, clock):
+    # A slot last written at 0 is unused
+    clock.now = 100.0
+    path = str(tmp_path / 'buckets')
+    first = SharedRateLimiter(path, 1, capacity=2, slots=16, clock=clock)
+    second = SharedRateLimiter(path, 1, capacity=2, slots=16, clock=clock)
+
+    assert first.try_consume('a')[0]
+    assert second.try_consume('a')[0]
+    assert first.try_consume('a') == (False, 1.0)
+
+    clock.now += 1
+    assert second.try_consume('a') == (True, 0.0)
+
+
+def test_shared_rate_limiter_starts_over_when_the_clock_does(tmp_path, clock):
+    clock.now = 100.0
+    limiter = SharedRateLimiter(str(tmp_path / 'buckets'), 1, slots=16, clock=clock)
+    limiter.try_consume('a')
+
+    # Like after a reboot, which the file on a tmpfs wouldn't survive anyway
+    clock.now = 1.0
+    assert limiter.try_consume('a') == (True, 0.0)
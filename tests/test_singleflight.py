@@ -0,0 +1,65 @@
+import threading
+
+import falcon
+
+from status_page.utils import (coalesce, singleflight)
+
+
+class Request(object):
+    path = '/status'
+    params = {}
+
+
+class StatusRoute(object):
+    def __init__(self):
+        self.started = threading.Event()
+        self.finish = threading.Event()
+        self.calls = 0
+
+    @coalesce()
+    def on_get(self, req, resp):
+        self.calls += 1
+        self.started.set()
+        self.finish.wait(5)
+
+        resp.media = {"status": "up", "stale": True}
+        resp.set_header('Warning', '110 - "Response is Stale"')
+        resp.set_header('Retry-After', '30')
+
+
+def test_waiting_requests_share_the_responders_headers(monkeypatch):
+    waiting_for_leader = threading.Event()
+
+    class Done(threading.Event):
+        def wait(self, timeout=None):
+            waiting_for_leader.set()
+            return super().wait(timeout)
+
+    class Call(singleflight._Call):
+        def __init__(self):
+            super().__init__()
+            self.done = Done()
+
+    monkeypatch.setattr(singleflight, '_Call', Call)
+
+    route = StatusRoute()
+    leader, follower = falcon.Response(), falcon.Response()
+    # Set by middleware for the follower's request alone
+    follower.set_header('X-Request-Id', 'follower')
+
+    thread = threading.Thread(target=route.on_get, args=(Request(), leader))
+    thread.start()
+    assert route.started.wait(5)
+
+    waiting = threading.Thread(target=route.on_get, args=(Request(), follower))
+    waiting.start()
+    assert waiting_for_leader.wait(5)
+    route.finish.set()
+    thread.join(5)
+    waiting.join(5)
+
+    assert route.calls == 1
+    assert follower.media == leader.media
+    assert follower.get_header('Warning') == '110 - "Response is Stale"'
+    assert follower.get_header('Retry-After') == '30'
+    assert follower.get_header('X-Request-Id') == 'follower'
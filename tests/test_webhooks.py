@@ -0,0 +1,147 @@
+import json
+
+import pytest
+
+from status_page.models import WebhookDelivery
+from status_page.webhooks import (WebhookDispatcher, sign)
+
+
+SECRET = 'correct horse battery staple'
+
+
+@pytest.fixture
+def webhook(client, admin_headers, service, receiver):
+    response = client.simulate_post('/webhooks', headers=admin_headers, json={
+        'endpoint': f"{receiver.url}/hook",
+        'service': service.slug,
+        'secret': SECRET,
+        'changes_only': False,
+    })
+    assert response.status_code == 201, response.text
+
+    return response.json
+
+
+def post_event(client, headers, service, status):
+    response = client.simulate_post(f'/services/{service.slug}/events', headers=headers, json={
+        'status': status,
+        'description': f"{service.name} is {status}",
+        'informational': False,
+    })
+    assert response.status_code == 200, response.text
+
+
+def send_due(dispatcher, session_factory):
+    """
+    What the dispatcher thread does, once and in the foreground
+    """
+    db = session_factory()
+    try:
+        batches = dispatcher.claim(db, 100)
+    finally:
+        db.close()
+
+    for batch in batches:
+        dispatcher.deliver(batch)
+
+    return batches
+
+
+def deliveries(client, headers, webhook, **params):
+    response = client.simulate_get(webhook['deliveries'], headers=headers, params=params)
+    assert response.status_code == 200, response.text
+    return response.json['results']
+
+
+def test_events_are_batched_and_signed(
+        client, admin_headers, session_factory, service, webhook, receiver):
+    post_event(client, admin_headers, service, 'down')
+    post_event(client, admin_headers, service, 'up')
+
+    batches = send_due(WebhookDispatcher(session_factory), session_factory)
+    assert len(batches) == 1
+
+    [(path, headers, body)] = receiver.wait_for(1)
+    assert path == '/hook'
+    assert headers['X-Status-Page-Signature'] == sign(SECRET, body)
+
+    payload = json.loads(body)
+    assert payload['webhook'] == webhook['url']
+    assert [(event['status'], event['attempt']) for event in payload['events']] == \
+        [('down', 1), ('up', 1)]
+    assert all(event['service'] == f"/services/{service.slug}" for event in payload['events'])
+
+    assert {delivery['state'] for delivery in deliveries(client, admin_headers, webhook)} == \
+        {'delivered'}
+
+    # Nothing is sent twice
+    assert send_due(WebhookDispatcher(session_factory), session_factory) == []
+
+
+def test_failed_deliveries_are_retried(
+        db, client, admin_headers, session_factory, service, webhook, receiver):
+    post_event(client, admin_headers, service, 'down')
+
+    receiver.statuses.put(503)
+    dispatcher = WebhookDispatcher(session_factory, backoff=60)
+    send_due(dispatcher, session_factory)
+
+    [delivery] = deliveries(client, admin_headers, webhook)
+    assert delivery['state'] == 'pending'
+    assert delivery['attempts'] == 1
+    assert delivery['last_error'] == "503 Service Unavailable"
+
+    # Not before its backoff ran out
+    assert send_due(dispatcher, session_factory) == []
+
+    db.query(WebhookDelivery).update({WebhookDelivery.next_attempt_at: WebhookDelivery.created_at})
+    db.commit()
+    send_due(dispatcher, session_factory)
+
+    [retry] = receiver.json()[1:]
+    assert retry['events'][0]['attempt'] == 2
+    assert deliveries(client, admin_headers, webhook)[0]['state'] == 'delivered'
+
+
+def test_rejected_deliveries_are_dead_lettered_until_redelivered(
+        client, admin_headers, session_factory, service, webhook, receiver):
+    post_event(client, admin_headers, service, 'down')
+
+    receiver.statuses.put(410)
+    dispatcher = WebhookDispatcher(session_factory)
+    send_due(dispatcher, session_factory)
+
+    [dead] = deliveries(client, admin_headers, webhook, state='dead')
+    assert dead['last_error'] == "410 Gone"
+    assert send_due(dispatcher, session_factory) == []
+
+    response = client.simulate_post(f"{webhook['url']}/redeliver", headers=admin_headers)
+    assert response.json['redelivered'] == 1
+
+    send_due(dispatcher, session_factory)
+    assert deliveries(client, admin_headers, webhook, state='dead') == []
+    assert len(receiver.requests) == 2
+
+
+def test_deliveries_that_keep_failing_are_dead_lettered(
+        db, client, admin_headers, session_factory, service, webhook, receiver):
+    post_event(client, admin_headers, service, 'down')
+
+    dispatcher = WebhookDispatcher(session_factory, max_attempts=2)
+    for _ in range(2):
+        receiver.statuses.put(500)
+        db.query(WebhookDelivery).update(
+            {WebhookDelivery.next_attempt_at: WebhookDelivery.created_at})
+        db.commit()
+        send_due(dispatcher, session_factory)
+
+    [delivery] = deliveries(client, admin_headers, webhook)
+    assert (delivery['state'], delivery['attempts']) == ('dead', 2)
+
+
+def test_webhooks_are_listed(client, admin_headers, webhook):
+    response = client.simulate_get('/webhooks', headers=admin_headers, params={'page': 1})
+
+    assert response.status_code == 200, response.text
+    assert [result['url'] for result in response.json['results']] == [webhook['url']]
+    assert response.json['results'][0]['signed']